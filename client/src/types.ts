@@ -61,6 +61,12 @@ export interface User {
     permissions: Permission[]
 }
 
+export interface Author {
+    username: string
+    firstName: string
+    lastName: string
+}
+
 export interface Stakeholder {
     pk?: string
     name: string
@@ -99,6 +105,9 @@ export interface File {
     location: string
     key: string
     size: number
+    readonly checksum: string
+    readonly dateVerified: string | null
+    readonly compressed: boolean
     vendor: Vendor
     readonly url: string
     submitter: string
@@ -125,6 +134,7 @@ export interface DataSource {
     status: string
     theme: string
     updatePeriodically: string
+    noteCount?: number
 }
 
 export interface Todo {
@@ -132,7 +142,7 @@ export interface Todo {
     lead: string
     text: string
     complete: boolean
-    createdBy: User
+    createdBy: Author
     createdAt: string
 }
 
@@ -140,6 +150,6 @@ export interface Note {
     pk: string
     status: string
     note: string
-    createdBy: User
+    createdBy: Author
     createdAt: string
 }
@@ -0,0 +1,12 @@
+#!/bin/sh
+# Resolve status transitions a previous run crashed in the middle of before serving requests. This runs as its
+# own process rather than in gunicorn's master, so Django is never imported before gevent patches the workers.
+# Transitions younger than TRANSITION_RECOVERY_AGE are skipped as possibly in flight, so recovery then keeps
+# running in the background every TRANSITION_RECOVERY_INTERVAL seconds to pick them up once they are old enough.
+if [ "$1" = "gunicorn" ]; then
+    python manage.py recover_transitions || echo 'Failed to recover status transitions' >&2
+    if [ "${TRANSITION_RECOVERY_INTERVAL:-300}" -gt 0 ]; then
+        python manage.py recover_transitions --loop &
+    fi
+fi
+exec "$@"
@@ -1,11 +1,38 @@
-"""gunicorn WSGI server configuration."""
+"""gunicorn WSGI server configuration.
+
+Every setting can be overridden from the environment, e.g. GUNICORN_WORKERS=4.
+"""
+import os
 from multiprocessing import cpu_count
 
 def max_workers():
     return cpu_count() * 2 + 1
 
-bind = '0.0.0.0:8000'
-workers = max_workers()
-worker_class = 'gevent'
-accesslog = '/tmp/gunicorn.log'
-errorlog = '/tmp/gunicorn.errlog'
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('true', 'yes', '1')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = env_int('GUNICORN_WORKERS', max_workers())
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+# Greenlets per gevent worker, keep above the sum of the app's PJ_*_CONCURRENCY limits
+worker_connections = env_int('GUNICORN_WORKER_CONNECTIONS', 1000)
+# Uploads of large files are streamed through a single request, so be generous before killing a worker
+timeout = env_int('GUNICORN_TIMEOUT', 300)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+# Recycle workers periodically to bound memory growth, 0 disables
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 0)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 0)
+# Load Django once in the master so workers fork faster and share memory
+preload_app = env_bool('GUNICORN_PRELOAD', False)
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '/tmp/gunicorn.log')
+errorlog = os.environ.get('GUNICORN_ERRORLOG', '/tmp/gunicorn.errlog')
+
+def child_exit(server, worker):
+    # Drop live gauges of dead workers from the shared prometheus_multiproc_dir
+    if 'prometheus_multiproc_dir' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
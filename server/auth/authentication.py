@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+from server.auth.models import token_cache_key
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    CachedTokenAuthentication
+
+    Token authentication that keeps resolved tokens, with their users, in the shared cache so service
+    accounts such as the jumper cables processor skip the token/user join on every request.
+    Entries expire after TOKEN_CACHE_TIMEOUT and are dropped when the token is deleted or its user saved.
+    Without a shared cache that drop would only reach one worker, so tokens are then looked up every time.
+    """
+
+    def authenticate_credentials(self, key):
+        if not settings.SHARED_CACHE:
+            return super().authenticate_credentials(key)
+        cache_key = token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, token, settings.TOKEN_CACHE_TIMEOUT)
+            return user, token
+        return token.user, token
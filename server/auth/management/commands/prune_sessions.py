@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Delete expired database sessions in small batches so the session table is never locked for long.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        if not settings.SESSION_ENGINE.endswith(('.db', '.cached_db')):
+            print(f'{settings.SESSION_ENGINE} sessions are not stored in the database, nothing to prune.')
+            return
+
+        now = timezone.now()
+        batch_size = options['batch_size']
+        deleted = 0
+        while True:
+            pks = list(Session.objects.filter(expire_date__lt=now).values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            count, _ = Session.objects.filter(pk__in=pks).delete()
+            deleted += count
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        print(f'Pruned {deleted} expired session(s).')
@@ -1,16 +1,90 @@
+import hashlib
+import time
+
 from django.conf import settings
+from django.core.cache import cache
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from django.contrib.auth.models import AbstractUser, Permission
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.contrib.auth.models import AbstractUser, Group, Permission
 from rest_framework.authtoken.models import Token
 
+PERMISSIONS_VERSION_KEY = 'auth:permissions:version'
+
+
+def token_cache_key(key):
+    # Hash the key so tokens never show up in cache tables or files
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_permissions_version():
+    version = cache.get(PERMISSIONS_VERSION_KEY)
+    if version is None:
+        # Start from the clock so a lost version key never revives stale entries
+        cache.add(PERMISSIONS_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(PERMISSIONS_VERSION_KEY)
+    return version
+
+
+def bump_permissions_version():
+    try:
+        cache.incr(PERMISSIONS_VERSION_KEY)
+    except ValueError:
+        get_permissions_version()
+
 
 class User(AbstractUser):
 
+    def _permissions_cache_key(self, version=None):
+        return f'auth:permissions:{version or get_permissions_version()}:{self.pk}'
+
+    def get_permission_sets(self):
+        """
+        get_permission_sets
+
+        Permissions granted directly and through groups, read from the shared cache. Without a shared cache
+        they are read from the database, as invalidating them would only reach this worker.
+
+        :return: dict - 'user' and 'group' sets of 'app_label.codename' strings
+        """
+        if not settings.SHARED_CACHE:
+            return self._load_permission_sets()
+        key = self._permissions_cache_key()
+        perms = cache.get(key)
+        if perms is None:
+            perms = self._load_permission_sets()
+            cache.set(key, perms, settings.PERMISSION_CACHE_TIMEOUT)
+        return perms
+
+    def _load_permission_sets(self):
+        from django.contrib.auth.backends import ModelBackend # Importing it needs the user model installed
+        backend = ModelBackend()
+        return {
+            'user': backend.get_user_permissions(self),
+            'group': backend.get_group_permissions(self)
+        }
+
+    def load_permission_cache(self):
+        """Fill the per request permission caches ModelBackend (and AxesBackend) read from."""
+        if hasattr(self, '_perm_cache') or not self.is_active:
+            return
+        perms = self.get_permission_sets()
+        self._user_perm_cache = perms['user']
+        self._group_perm_cache = perms['group']
+        self._perm_cache = {*perms['user'], *perms['group']}
+
+    def get_all_permissions(self, obj=None):
+        if obj is None:
+            self.load_permission_cache()
+        return super().get_all_permissions(obj)
+
+    def has_perm(self, perm, obj=None):
+        if obj is None:
+            self.load_permission_cache()
+        return super().has_perm(perm, obj)
+
     def get_user_permissions(self):
-        if self.is_superuser:
-            return Permission.objects.values_list('codename', flat=True)
-        return self.groups.values_list("permissions__codename", flat=True)
+        # Superusers are granted every permission through the group set
+        return sorted({perm.split('.', 1)[1] for perm in self.get_permission_sets()['group']})
 
     def add_permission_codes(self, *permission_codes):
         permissions = [Permission.objects.get(codename=code) for code in permission_codes]
@@ -23,3 +97,34 @@ def set_auth_token(sender, instance=None, created=False, **kwargs):
     """A method will create tokens for newly created users."""
     if created and instance:
         Token.objects.create(user=instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def clear_user_permissions(sender, instance=None, created=False, **kwargs):
+    """Superuser and active flags change permissions, drop the user's cached sets."""
+    if instance and not created:
+        cache.delete(instance._permissions_cache_key())
+        for attr in ('_perm_cache', '_user_perm_cache', '_group_perm_cache'):
+            instance.__dict__.pop(attr, None)
+        # Cached tokens carry a copy of the user, so deactivation has to reach them too
+        for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+            cache.delete(token_cache_key(key))
+
+
+@receiver(post_delete, sender=Token)
+def clear_cached_token(sender, instance=None, **kwargs):
+    cache.delete(token_cache_key(instance.key))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def permissions_changed(sender, action=None, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_permissions_version()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def permission_deleted(sender, **kwargs):
+    bump_permissions_version()
@@ -15,6 +15,13 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ('username', 'first_name', 'last_name', 'email', 'token', 'is_staff', 'permissions')
 
+class AuthorSerializer(serializers.ModelSerializer):
+    """Names of a user for listing what they wrote, without the token or permission lookups of UserSerializer."""
+
+    class Meta:
+        model = User
+        fields = ('username', 'first_name', 'last_name')
+
 class GroupSerializer(serializers.ModelSerializer):
 
     class Meta:
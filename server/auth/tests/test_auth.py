@@ -1,10 +1,21 @@
 """Tests for the token endpoint"""
 
+import io
+from contextlib import redirect_stdout
+from datetime import timedelta
+
 from django.urls import reverse
+from django.utils import timezone
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from server.auth.models import User
+from server.auth.models import User, token_cache_key
 
 
 class UserTestCase(APITestCase):
@@ -41,3 +52,103 @@ class UserTestCase(APITestCase):
 
         response = self.client.post(reverse('logout'))
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class PermissionCacheTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cached')
+        self.group = Group.objects.create(name='File Control')
+        self.user.groups.add(self.group)
+
+    def test_cached_has_perm(self):
+        """Test permissions are served from the shared cache after the first lookup."""
+        self.assertFalse(self.user.has_perm('pj.view_file'))
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(user.has_perm('pj.view_file'))
+            self.assertEqual(user.get_user_permissions(), [])
+
+    def test_group_permission_change(self):
+        """Test changing a group's permissions invalidates cached permissions."""
+        self.assertFalse(self.user.has_perm('pj.view_file'))
+        self.group.permissions.add(Permission.objects.get(codename='view_file'))
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(user.has_perm('pj.view_file'))
+        self.assertEqual(user.get_user_permissions(), ['view_file'])
+
+        self.user.groups.remove(self.group)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertFalse(user.has_perm('pj.view_file'))
+
+    def test_user_change(self):
+        """Test deactivating a user drops their cached permissions."""
+        self.user.add_permission_codes('view_file')
+        self.assertTrue(User.objects.get(pk=self.user.pk).has_perm('pj.view_file'))
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(User.objects.get(pk=self.user.pk).has_perm('pj.view_file'))
+
+
+    @override_settings(SHARED_CACHE=False)
+    def test_per_process_cache(self):
+        """Test permissions are not cached when other workers would not see them change."""
+        self.assertFalse(self.user.has_perm('pj.view_file'))
+        # Granted without signals, as by another worker with its own cache
+        Group.permissions.through.objects.bulk_create([
+            Group.permissions.through(group=self.group, permission=Permission.objects.get(codename='view_file'))
+        ])
+        self.assertTrue(User.objects.get(pk=self.user.pk).has_perm('pj.view_file'))
+
+class TokenCacheTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='processor')
+        self.token = Token.objects.get(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_token(self):
+        """Test repeated token requests skip the token lookup."""
+        self.assertEqual(self.client.get(reverse('me')).status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            # Token, user and permissions all come from the cache
+            response = self.client.get(reverse('me'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['username'], 'processor')
+
+    def test_deactivated_user(self):
+        """Test deactivating a user stops their cached token from authenticating."""
+        self.assertEqual(self.client.get(reverse('me')).status_code, status.HTTP_200_OK)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('me')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token(self):
+        """Test deleting a token stops it from authenticating."""
+        self.assertEqual(self.client.get(reverse('me')).status_code, status.HTTP_200_OK)
+        self.token.delete()
+        self.assertEqual(self.client.get(reverse('me')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+    @override_settings(SHARED_CACHE=False)
+    def test_per_process_cache(self):
+        """Test tokens are not cached when other workers would not see them being deleted."""
+        self.assertEqual(self.client.get(reverse('me')).status_code, status.HTTP_200_OK)
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        # Deleted without signals, as by another worker with its own cache
+        Token.objects.filter(pk=self.token.pk)._raw_delete(Token.objects.db)
+        self.assertEqual(self.client.get(reverse('me')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+class PruneSessionsTestCase(APITestCase):
+
+    def test_prune(self):
+        """Test only expired sessions are pruned, across several batches."""
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'expired{i}', session_data='', expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key='current', session_data='', expire_date=now + timedelta(days=1))
+        with redirect_stdout(io.StringIO()) as output:
+            call_command('prune_sessions', batch_size=2)
+        self.assertIn('Pruned 5 expired session(s)', output.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['current'])
@@ -0,0 +1,78 @@
+"""
+Shared cache backends.
+
+Django's database and file based caches implement incr as a get followed by a set, so concurrent
+gunicorn workers lose each other's increments. These backends make incr atomic so counters such
+as the upload throttle stay correct when the cache is shared between processes.
+"""
+import base64
+import pickle
+import time
+import zlib
+
+from django.core.cache.backends import db, filebased
+from django.core.files import locks
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+
+class DatabaseCache(db.DatabaseCache):
+    """Postgres table cache that increments under a row lock."""
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        db_alias = router.db_for_write(self.cache_model_class)
+        connection = connections[db_alias]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+        with transaction.atomic(using=db_alias), connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT %s FROM %s WHERE %s = %%s AND %s > %%s FOR UPDATE' % (
+                    quote_name('value'),
+                    table,
+                    quote_name('cache_key'),
+                    quote_name('expires'),
+                ),
+                [key, now]
+            )
+            row = cursor.fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(base64.b64decode(connection.ops.process_clob(row[0]).encode())) + delta
+            pickled = base64.b64encode(pickle.dumps(value, self.pickle_protocol)).decode('latin1')
+            cursor.execute(
+                'UPDATE %s SET %s = %%s WHERE %s = %%s' % (
+                    table,
+                    quote_name('value'),
+                    quote_name('cache_key'),
+                ),
+                [pickled, key]
+            )
+        return value
+
+
+class FileBasedCache(filebased.FileBasedCache):
+    """File cache that increments under an exclusive lock on the cache file."""
+
+    def incr(self, key, delta=1, version=None):
+        fname = self._key_to_file(key, version)
+        try:
+            with open(fname, 'r+b') as f:
+                locks.lock(f, locks.LOCK_EX)
+                try:
+                    expiry = pickle.load(f)
+                    if expiry is not None and expiry < time.time():
+                        raise ValueError(f"Key '{key}' not found")
+                    value = pickle.loads(zlib.decompress(f.read())) + delta
+                    f.seek(0)
+                    f.truncate()
+                    f.write(pickle.dumps(expiry, self.pickle_protocol))
+                    f.write(zlib.compress(pickle.dumps(value, self.pickle_protocol)))
+                finally:
+                    locks.unlock(f)
+        except FileNotFoundError:
+            raise ValueError(f"Key '{key}' not found")
+        return value
@@ -0,0 +1,92 @@
+"""
+Prometheus metrics for the request path, the database connection pool and the storage, email and file hot paths.
+
+With several gunicorn workers set the prometheus_multiproc_dir environment variable to an empty,
+writable directory; each worker then writes its samples there and /metrics aggregates them.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+REQUEST_SECONDS = Histogram(
+    'pj_request_seconds', 'Time spent handling a request', ['view', 'method', 'status']
+)
+REQUEST_QUERIES = Histogram(
+    'pj_request_queries', 'Database queries made by a request', ['view'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, float('inf'))
+)
+REQUEST_QUERY_SECONDS = Histogram(
+    'pj_request_query_seconds', 'Time a request spent waiting on the database', ['view']
+)
+STORAGE_SECONDS = Histogram(
+    'pj_storage_seconds', 'Time spent in storage operations', ['op']
+)
+STORAGE_BYTES = Counter(
+    'pj_storage_bytes', 'Bytes moved to or from storage', ['op']
+)
+EMAIL_SECONDS = Histogram(
+    'pj_email_seconds', 'Time spent sending notification emails'
+)
+FILE_CREATE_SECONDS = Histogram(
+    'pj_file_create_seconds', 'Time spent registering an uploaded file'
+)
+STATUS_CHANGE_SECONDS = Histogram(
+    'pj_status_change_seconds', 'Time spent moving a file to a new status', ['status', 'succeeded']
+)
+DB_POOL_CHECKOUTS = Counter(
+    'pj_db_pool_checkouts', 'Database connections checked out of the connection pool', ['alias']
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    'pj_db_pool_wait_seconds', 'Time spent waiting for a free pooled database connection', ['alias'],
+    buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, float('inf'))
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'pj_db_pool_connections', 'Pooled database connections by state', ['alias', 'state'],
+    multiprocess_mode='livesum'
+)
+POOL_ACTIVE = Gauge(
+    'pj_pool_active_requests', 'Requests currently admitted by a concurrency pool', ['pool'],
+    multiprocess_mode='livesum'
+)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe the duration of the block on histogram, with labels when given."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - start)
+
+
+def export():
+    """
+    export
+
+    :return: bytes - all metrics in the Prometheus text format, aggregated across workers in multiprocess mode
+    """
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+class QueryCounter:
+    """Execute wrapper counting the queries and database time of a request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
@@ -0,0 +1,252 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager, ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.http import JsonResponse
+
+from server.metrics import QueryCounter, REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_QUERY_SECONDS, POOL_ACTIVE
+from server.routers import use_replica
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def get_view_action(request, view_func):
+    """
+    get_view_action
+
+    :view_func: function - resolved view, DRF viewsets expose their class and method to action mapping on it
+
+    :return: tuple - view class and action, (None, None) for other views
+    """
+    view_cls = getattr(view_func, 'cls', None)
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower())
+    return (view_cls, action) if view_cls and action else (None, None)
+
+
+def get_query_budget(view_cls, action):
+    """
+    get_query_budget
+
+    :view_cls: class - view class, budgets are declared as a query_budgets dict of action to query count
+    :action: str - view action
+
+    :return: int - maximum queries the action may make, None when no budget is declared
+    """
+    return getattr(view_cls, 'query_budgets', {}).get(action)
+
+
+@contextmanager
+def count_queries(counter):
+    """
+    count_queries
+
+    Install counter as an execute wrapper on every database alias, so reads routed to replicas count too.
+
+    :counter: QueryCounter - wrapper to install
+
+    :return: QueryCounter - counter, through the with statement
+    """
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(counter))
+        yield counter
+
+
+class ConcurrencyPool:
+    """Bounded number of requests of one route class a worker process handles at once."""
+
+    def __init__(self, name, pattern, limit):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.limit = limit
+        self.active = 0
+        self._semaphore = threading.BoundedSemaphore(limit) if limit else None
+
+    def acquire(self):
+        if self._semaphore and not self._semaphore.acquire(blocking=False):
+            return False
+        self.active += 1
+        POOL_ACTIVE.labels(pool=self.name).inc()
+        return True
+
+    def release(self):
+        self.active -= 1
+        POOL_ACTIVE.labels(pool=self.name).dec()
+        if self._semaphore:
+            self._semaphore.release()
+
+
+class PoolRelease:
+    """Closable handed to streaming responses so the slot is held until the body is sent."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def close(self):
+        self.pool.release()
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    ConcurrencyLimitMiddleware
+
+    Admission control per route class (see CONCURRENCY_POOLS). A request is matched to the first
+    pool whose pattern matches its path, and is answered with 503 and Retry-After when that pool
+    is saturated, so a storm of uploads cannot starve processor callbacks or the UI.
+    Threading primitives are greenlet aware under gevent's monkey patching.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pools = [ConcurrencyPool(*pool) for pool in settings.CONCURRENCY_POOLS]
+
+    def get_pool(self, path):
+        for pool in self.pools:
+            if pool.pattern.match(path):
+                return pool
+        return None
+
+    def __call__(self, request):
+        pool = self.get_pool(request.path_info)
+        if pool is None:
+            return self.get_response(request)
+
+        if not pool.acquire():
+            logger.warning(f'Rejected request to {request.path_info}, {pool.name} pool is saturated ({pool.limit})')
+            response = JsonResponse({'error': 'Server is busy, retry later'}, status=503)
+            response['Retry-After'] = settings.CONCURRENCY_RETRY_AFTER
+            return response
+
+        try:
+            response = self.get_response(request)
+        except Exception:
+            pool.release()
+            raise
+
+        if response.streaming:
+            # Downloads keep their slot until the server finishes sending the body
+            response._closable_objects.append(PoolRelease(pool))
+        else:
+            pool.release()
+        return response
+
+
+class MetricsMiddleware:
+    """Record latency, query count and database time of every request, labelled by url name."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with count_queries(QueryCounter()) as counter:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unknown'
+        REQUEST_SECONDS.labels(view=view, method=request.method, status=response.status_code).observe(elapsed)
+        REQUEST_QUERIES.labels(view=view).observe(counter.count)
+        REQUEST_QUERY_SECONDS.labels(view=view).observe(counter.seconds)
+        return response
+
+
+class QueryBudgetMiddleware:
+    """
+    QueryBudgetMiddleware
+
+    Count the queries of views that declare query_budgets and log (QUERY_BUDGET_MODE = 'log') or
+    raise QueryBudgetExceeded ('raise') when an action goes over its budget. 'off' disables counting.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.QUERY_BUDGET_MODE == 'off':
+            return self.get_response(request)
+
+        with count_queries(QueryCounter()) as counter:
+            response = self.get_response(request)
+
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and counter.count > budget:
+            message = f'{request.query_budget_action} made {counter.count} queries in {counter.seconds:.3f}s, over its budget of {budget}'
+            if settings.QUERY_BUDGET_MODE == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={'request': request})
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_cls, action = get_view_action(request, view_func)
+        if view_cls:
+            request.query_budget = get_query_budget(view_cls, action)
+            request.query_budget_action = f'{view_cls.__name__}.{action}'
+
+
+class ReplicaRoutingMiddleware:
+    """
+    ReplicaRoutingMiddleware
+
+    Route the reads of view actions listed in the view's replica_actions to the read replicas. A client
+    that made a write is kept on the primary for REPLICA_STICKY_SECONDS so it reads its own writes: a signed
+    cookie marks it, and with a shared cache its session cookie or Authorization header is also remembered
+    for clients that do not keep cookies.
+    """
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    STICKY_COOKIE = 'pj_primary'
+    STICKY_SALT = 'server.middleware.ReplicaRoutingMiddleware'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _sticky_key(self, request):
+        identity = request.COOKIES.get(settings.SESSION_COOKIE_NAME) or request.META.get('HTTP_AUTHORIZATION')
+        if identity and settings.SHARED_CACHE:
+            return 'pj:db:primary:' + hashlib.sha256(identity.encode()).hexdigest()
+        return None
+
+    def _is_sticky(self, request):
+        sticky = request.get_signed_cookie(
+            self.STICKY_COOKIE, default=None, salt=self.STICKY_SALT, max_age=settings.REPLICA_STICKY_SECONDS
+        )
+        if sticky:
+            return True
+        key = self._sticky_key(request)
+        return bool(key and cache.get(key))
+
+    def __call__(self, request):
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica(False)
+
+        if request.method not in self.SAFE_METHODS and response.status_code < 400:
+            response.set_signed_cookie(
+                self.STICKY_COOKIE, '1', salt=self.STICKY_SALT, max_age=settings.REPLICA_STICKY_SECONDS,
+                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax'
+            )
+            key = self._sticky_key(request)
+            if key:
+                cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.REPLICA_DATABASES or request.method not in self.SAFE_METHODS:
+            return
+        view_cls, action = get_view_action(request, view_func)
+        if view_cls and action in getattr(view_cls, 'replica_actions', ()):
+            use_replica(not self._is_sticky(request))
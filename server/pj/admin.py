@@ -1,10 +1,19 @@
 from django.contrib import admin
 
-from server.pj.models import File, Vendor, Stakeholder, Todo, DataSource, Note
+from server.pj.models import File, Vendor, Stakeholder, Todo, DataSource, Note, FileStatusRollup, FileTransition, RetentionPolicy
 
 class FileAdmin(admin.ModelAdmin):
     list_display = ('name', 'vendor', 'submitter', 'status')
 
+class FileStatusRollupAdmin(admin.ModelAdmin):
+    list_display = ('hour', 'vendor', 'status', 'file_count', 'byte_count')
+
+class FileTransitionAdmin(admin.ModelAdmin):
+    list_display = ('file', 'origin', 'target', 'created')
+
+class RetentionPolicyAdmin(admin.ModelAdmin):
+    list_display = ('status', 'vendor', 'days', 'action', 'archive_location', 'compress')
+
 # Register your models here.
 admin.site.register(File, FileAdmin)
 admin.site.register(Vendor)
@@ -12,3 +21,6 @@ admin.site.register(Stakeholder)
 admin.site.register(Todo)
 admin.site.register(DataSource)
 admin.site.register(Note)
+admin.site.register(FileStatusRollup, FileStatusRollupAdmin)
+admin.site.register(FileTransition, FileTransitionAdmin)
+admin.site.register(RetentionPolicy, RetentionPolicyAdmin)
@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
 
 
 class PjConfig(AppConfig):
     name = 'server.pj'
+
+    def ready(self):
+        from server.pj.management.commands.partition_files import guard_partitioned_migrations
+        pre_migrate.connect(guard_partitioned_migrations, sender=self)
@@ -1,6 +1,8 @@
 from django.conf import settings
 from django.core.mail import send_mail
 
+from server.metrics import timed, EMAIL_SECONDS
+
 def email(subject, message, recipient_list=(), include_admins=True):
     """
     email 
@@ -15,4 +17,5 @@ def email(subject, message, recipient_list=(), include_admins=True):
     if include_admins:
         recipient_list.extend(settings.EMAIL_ADMIN_LIST)
     recipient_list = list({r.lower() for r in recipient_list}) # Dedupe common recipients
-    return bool(send_mail(subject, message, settings.EMAIL_SENDER, recipient_list))
+    with timed(EMAIL_SECONDS):
+        return bool(send_mail(subject, message, settings.EMAIL_SENDER, recipient_list))
@@ -0,0 +1,133 @@
+import gzip
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from server.pj.models import File, FileTransition, RetentionPolicy
+from server.pj.store import copy, delete, retrieve, upload, ChecksumReader, ChecksumMismatch
+
+# Files compressed up to this size in memory before spilling to disk
+SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def compress(source_url, target_url, expected_checksum=''):
+    """
+    compress
+
+    Gzip an object into a new location, leaving the original to be deleted by the caller. Nothing is written
+    if the original's contents do not match expected_checksum.
+
+    :return: None
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as compressed:
+        source = ChecksumReader(retrieve(source_url))
+        try:
+            with gzip.GzipFile(fileobj=compressed, mode='wb') as gz:
+                shutil.copyfileobj(source, gz)
+        finally:
+            source.file_obj.close()
+        sha256, _, _ = source.digests()
+        if expected_checksum and sha256 != expected_checksum:
+            raise ChecksumMismatch(f'{source_url} has checksum {sha256}, expected {expected_checksum}')
+        compressed.seek(0)
+        upload(target_url, compressed)
+
+
+class Command(BaseCommand):
+    help = '''
+    Archive or delete files older than their retention policy, a batch at a time. A batch's rows are locked while
+    its objects are copied to the archive in parallel and the rows are updated or deleted, and the original objects
+    are only deleted once that has committed. A crash can so leave stray objects, which reconcile reports, but never
+    rows pointing at objects that are gone. Files with a pending status transition are left for a later run.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=8, help='Objects copied or deleted in parallel')
+        parser.add_argument('--limit', type=int, help='Stop after this many files, to spread work over several runs')
+        parser.add_argument('--dry-run', action='store_true', help='Count the files each policy applies to')
+
+    def handle(self, *args, **options):
+        remaining = options['limit']
+        self.failed = set()
+        for policy in RetentionPolicy.objects.select_related('vendor').order_by('status', 'vendor__name'):
+            files = policy.get_files()
+            if options['dry_run']:
+                print(f'{policy}: {files.count()} file(s)')
+                continue
+
+            done = failed = left = 0
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                while remaining is None or remaining > 0:
+                    size = options['batch_size'] if remaining is None else min(options['batch_size'], remaining)
+                    with transaction.atomic():
+                        # Exclude failures so a stuck object does not stop the rest of the policy. Rows locked by
+                        # another run are skipped, rows changed by a status callback wait for the batch to commit.
+                        batch = list(
+                            files
+                            .exclude(pk__in=self.failed)
+                            .exclude(pk__in=FileTransition.objects.values('file_id'))
+                            .select_for_update(skip_locked=True)
+                            .order_by('pk')[:size]
+                        )
+                        if not batch:
+                            break
+                        succeeded, obsolete = self._apply(policy, batch, executor)
+                    left += sum(not ok for ok in executor.map(self._delete_object, obsolete))
+                    done += len(succeeded)
+                    failed += len(batch) - len(succeeded)
+                    if remaining is not None:
+                        remaining -= len(batch)
+            print(f'{policy}: {done} file(s) done, {failed} failed, {left} object(s) could not be deleted')
+
+    def _apply(self, policy, batch, executor):
+        """
+        _apply
+
+        :policy: RetentionPolicy - policy to apply
+        :batch: list - locked files the policy applies to
+
+        :return: tuple - (files whose rows were updated or deleted, urls of objects to delete once committed)
+        """
+        if policy.action == RetentionPolicy.DELETE:
+            File.objects.filter(pk__in=[f.pk for f in batch]).delete()
+            return batch, [f.get_url() for f in batch]
+
+        sources = list(executor.map(lambda f: self._archive(policy, f), batch))
+        succeeded = [f for f, source in zip(batch, sources) if source]
+        self.failed.update(f.pk for f, source in zip(batch, sources) if not source)
+        File.objects.bulk_update(succeeded, ['location', 'key', 'compressed'])
+        return succeeded, [source for source in sources if source]
+
+    def _archive(self, policy, f):
+        """
+        _archive
+
+        :return: str - url of the original object once it is copied to the archive, None if that failed
+        """
+        source = f.get_url()
+        try:
+            if policy.compress and not f.compressed:
+                # The size and checksum stay those of the contents, which downloads decompress back to
+                key = f'{f.key}.gz'
+                compress(source, os.path.join(policy.archive_location, f.status, key), f.checksum)
+                f.key, f.compressed = key, True
+            else:
+                copy(source, os.path.join(policy.archive_location, f.status, f.key))
+            f.location = policy.archive_location
+            return source
+        except Exception as e:
+            print(f'Failed to archive {source}: {e}')
+            return None
+
+    def _delete_object(self, url):
+        try:
+            delete(url)
+            return True
+        except Exception as e:
+            print(f'Failed to delete {url}: {e}')
+            return False
@@ -0,0 +1,173 @@
+import io
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import tracemalloc
+from datetime import datetime, timezone
+
+from django.db import connection
+from django.urls import reverse
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from server.auth.models import User
+from server.pj.models import File, Vendor
+from server.version import get_version
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def summarize(durations):
+    """Throughput and latency percentiles for a list of durations in seconds."""
+    ordered = sorted(durations)
+    total = sum(ordered)
+    return {
+        'count': len(ordered),
+        'total_seconds': total,
+        'per_second': len(ordered) / total if total else None,
+        'p50': ordered[len(ordered) // 2] if ordered else None,
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None,
+        'max': ordered[-1] if ordered else None
+    }
+
+
+class Command(BaseCommand):
+    help = '''
+    Measure upload, status callback, list and bulk approve performance against a new, empty test database
+    created next to the configured one (migrated, seeded, then dropped) and a temporary file:// store,
+    writing the results as JSON.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=1000, help='Files seeded before measuring list latency')
+        parser.add_argument('--uploads', type=int, default=20, help='Uploads measured per file size')
+        parser.add_argument('--sizes', type=parse_ints, default=[1, 1024, 10240], help='Upload sizes in KB')
+        parser.add_argument('--callbacks', type=int, default=200, help='Status callbacks measured')
+        parser.add_argument('--offsets', type=parse_ints, default=[0, 500, 900], help='List offsets measured')
+        parser.add_argument('--batch-sizes', type=parse_ints, default=[1, 10, 100], help='Bulk approve batch sizes')
+        parser.add_argument('--output', type=str, help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--compare', type=str, help='Previous results file to compare against')
+
+    def handle(self, *args, **options):
+        logging.disable(logging.CRITICAL)
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        upload_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(
+                    UPLOAD_LOCATION=f'file://{upload_dir}',
+                    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'
+            ):
+                results = self._run(options)
+        finally:
+            shutil.rmtree(upload_dir)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            logging.disable(logging.NOTSET)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            print(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self._compare(json.load(f)['results'], results['results'])
+
+    def _run(self, options):
+        user = User.objects.create_superuser('benchmark', 'benchmark@test.com', 'benchmark')
+        # Authenticate like the processor does, with its API token
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {user.auth_token.key}')
+
+        # Seeding through file_seed also creates the Acme vendor used for uploads
+        call_command('file_seed', File.TRANSFERRED, options['files'])
+        self.vendor = Vendor.objects.get(short_name='acme')
+
+        return {
+            'version': get_version(),
+            'date': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'parameters': {k: v for k, v in options.items() if k in ('files', 'uploads', 'sizes', 'callbacks', 'offsets', 'batch_sizes')},
+            'results': {
+                'upload': {f'{size}KB': self._uploads(size * 1024, options['uploads']) for size in options['sizes']},
+                'status': self._callbacks(options['callbacks']),
+                'list': {str(offset): self._list(offset) for offset in options['offsets']},
+                'approve_bulk': {str(size): self._approve_bulk(size) for size in options['batch_sizes']}
+            }
+        }
+
+    def _upload(self, data, index):
+        payload = io.BytesIO(data)
+        payload.name = f'benchmark_{len(data)}_{index}.bin'
+        response = self.client.post(reverse('file-upload'), {
+            'vendor_code': self.vendor.code,
+            'submitter': 'benchmark',
+            'file': payload
+        })
+        if response.status_code != 202:
+            raise Exception(f'Upload failed with {response.status_code}')
+
+    def _uploads(self, size, count):
+        data = os.urandom(size)
+        durations = []
+        for index in range(count):
+            start = time.perf_counter()
+            self._upload(data, index)
+            durations.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        self._upload(data, count)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {**summarize(durations), 'peak_memory_bytes': peak, 'bytes_per_second': size * len(durations) / sum(durations)}
+
+    def _callbacks(self, count):
+        call_command('file_seed', File.UNSCANNED, count)
+        durations = []
+        for pk in File.objects.filter(status=File.UNSCANNED).values_list('pk', flat=True)[:count]:
+            start = time.perf_counter()
+            response = self.client.post(reverse('file-status', args=(pk,)), {'status': File.CLEAN}, content_type='application/json')
+            durations.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise Exception(f'Status callback failed with {response.status_code}')
+        return summarize(durations)
+
+    def _list(self, offset, repeat=5):
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            self.client.get(reverse('file-list'), {'limit': 50, 'offset': offset})
+            durations.append(time.perf_counter() - start)
+        return summarize(durations)
+
+    def _approve_bulk(self, size):
+        # Approve only freshly seeded files so each batch moves real objects
+        File.objects.filter(status=File.CLEAN).update(status=File.REJECTED)
+        call_command('file_seed', File.CLEAN, size)
+        pks = list(File.objects.filter(status=File.CLEAN).values_list('pk', flat=True))
+        start = time.perf_counter()
+        response = self.client.post(reverse('file-approve-bulk'), pks, content_type='application/json')
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise Exception(f'Bulk approve failed with {response.status_code}')
+        return {'count': len(pks), 'total_seconds': elapsed, 'per_second': len(pks) / elapsed}
+
+    def _compare(self, previous, current, path=''):
+        for key, value in current.items():
+            name = f'{path}.{key}' if path else key
+            if isinstance(value, dict):
+                if isinstance(previous.get(key), dict):
+                    self._compare(previous[key], value, name)
+            elif key in ('per_second', 'p50') and previous.get(key) and value:
+                print(f'{name}: {previous[key]:.4f} -> {value:.4f} ({value / previous[key] - 1:+.1%})')
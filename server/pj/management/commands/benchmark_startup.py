@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+import server
+from server.version import get_version
+from server.pj.management.commands.benchmark import summarize
+
+
+def parse_importtime(output):
+    """
+    parse_importtime
+
+    :output: str - stderr of python -X importtime
+
+    :return: list - (module, self microseconds, cumulative microseconds) of every import
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((module.strip(), int(own), int(cumulative)))
+    return imports
+
+
+class Command(BaseCommand):
+    help = '''
+    Measure how long fresh processes take to import server.wsgi, as a gunicorn worker does, and to run short
+    management commands, writing the results and the slowest imports as JSON.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Runs measured per target')
+        parser.add_argument('--commands', type=lambda v: [c for c in v.split(',') if c], default=['help', 'check'],
+                            help='Comma separated management commands measured')
+        parser.add_argument('--top', type=int, default=15, help='Slowest imports reported')
+        parser.add_argument('--output', type=str, help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--compare', type=str, help='Previous results file to compare against')
+
+    def handle(self, *args, **options):
+        self.env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'server.settings.common')}
+        # manage.py sits next to the server package
+        self.cwd = os.path.dirname(os.path.dirname(os.path.abspath(server.__file__)))
+        wsgi = [sys.executable, '-c', 'import server.wsgi']
+
+        results = {'wsgi': self._measure(wsgi, options['repeat'])}
+        for name in options['commands']:
+            results[f'manage.py {name}'] = self._measure([sys.executable, 'manage.py', name], options['repeat'])
+
+        output = json.dumps({
+            'version': get_version(),
+            'date': datetime.now(timezone.utc).isoformat(),
+            'parameters': {'repeat': options['repeat'], 'commands': options['commands']},
+            'results': results,
+            'slowest_imports': [
+                {'module': module, 'self_seconds': own / 1e6, 'cumulative_seconds': cumulative / 1e6}
+                for module, own, cumulative in self._slowest_imports(wsgi, options['top'])
+            ]
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            print(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)['results']
+            for name, value in results.items():
+                if previous.get(name, {}).get('p50'):
+                    print(f'{name}: {previous[name]["p50"]:.4f} -> {value["p50"]:.4f} ({value["p50"] / previous[name]["p50"] - 1:+.1%})')
+
+    def _run(self, args):
+        start = time.perf_counter()
+        process = subprocess.run(args, cwd=self.cwd, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        elapsed = time.perf_counter() - start
+        if process.returncode:
+            raise CommandError(f'{" ".join(args[1:])} failed:\n{process.stderr}')
+        return elapsed, process.stderr
+
+    def _measure(self, args, repeat):
+        return summarize([self._run(args)[0] for _ in range(repeat)])
+
+    def _slowest_imports(self, args, top):
+        _, stderr = self._run([args[0], '-X', 'importtime', *args[1:]])
+        return sorted(parse_importtime(stderr), key=lambda i: i[1], reverse=True)[:top]
@@ -1,20 +1,48 @@
 import os.path
+import random
 import urllib.parse
 import string
 import tempfile
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models.expressions import RawSQL
 from django.utils.crypto import get_random_string
-from django.core.management.base import BaseCommand
+from django.utils.http import int_to_base36
+from django.core.management.base import BaseCommand, CommandError
 from django.core.files.uploadedfile import UploadedFile
 
-from server.pj.models import Vendor, File
+from server.pj.models import Vendor, File, FilenameCounter, FileStatusRollup
+
+MIXED = 'mixed'
+
+# Relative weights of each status when seeding a mixed set of files
+status_weights = {
+    File.UNSCANNED: 10,
+    File.CLEAN: 10,
+    File.QUARANTINED: 2,
+    File.APPROVED: 10,
+    File.TRANSFERRED: 60,
+    File.FAILED: 5,
+    File.REJECTED: 3
+}
 
 class Command(BaseCommand):
 
     def add_arguments(self, parser):
-        parser.add_argument('status', type=str)
+        parser.add_argument('status', type=str, help=f'Status of the seeded files, or {MIXED} for a realistic mix with --bulk')
         parser.add_argument('count', type=int)
+        parser.add_argument('--bulk', action='store_true', help='Insert files in batches without uploading through the file manager')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--vendors', type=int, default=20, help='Number of vendors to spread bulk files over')
+        parser.add_argument('--duplicates', type=float, default=0.1, help='Fraction of bulk files reusing a name and so being versioned')
+        parser.add_argument('--days', type=int, default=365, help='Spread bulk upload dates over this many past days')
+        parser.add_argument(
+            '--storage',
+            choices=('none', 'empty', 'sparse'),
+            default='none',
+            help='Storage objects for bulk files: none, zero byte or sparse files of the recorded size (file:// only)'
+        )
 
     def _get_random_number(self):
         return get_random_string(length=4, allowed_chars=string.digits)
@@ -52,12 +80,100 @@ class Command(BaseCommand):
 
         return f
 
+    def _get_vendors(self, count):
+        # Base 36 keeps codes within their 8 characters for up to 36 ** 7 vendors
+        vendors = [
+            Vendor(name=f'Seed Vendor {i}', short_name=f'seed-{i}', code=f's{int_to_base36(i)}', priority=random.randint(1, 10))
+            for i in range(count)
+        ]
+        Vendor.objects.bulk_create(vendors, ignore_conflicts=True)
+        return list(Vendor.objects.filter(short_name__in=[v.short_name for v in vendors]))
+
+    def _get_size(self):
+        # Log-normal sizes, mostly tens of kilobytes with a long tail into gigabytes
+        return min(int(random.lognormvariate(10, 2.5)), 50 * 1024 ** 3)
+
+    def _write_objects(self, files, storage):
+        for f in files:
+            path = urllib.parse.urlparse(f.get_url()).path
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as new_file:
+                if storage == 'sparse':
+                    new_file.truncate(f.size)
+
+    def _bulk_create(self, status, count, options):
+        upload_location = settings.UPLOAD_LOCATION or ''
+        if options['storage'] != 'none' and not upload_location.startswith('file://'):
+            raise CommandError('Storage objects can only be seeded into a file:// UPLOAD_LOCATION')
+
+        vendors = self._get_vendors(options['vendors'])
+        statuses, weights = zip(*status_weights.items())
+        # Prefix names with a run token so repeated seeding never collides with existing files
+        run = get_random_string(length=6, allowed_chars=string.ascii_lowercase)
+        base_names = [f'{run}_{i}.txt' for i in range(max(1, int(count * (1 - options['duplicates']))))]
+        seen = {}
+        originals = {}
+        keys = []
+
+        for start in range(0, count, options['batch_size']):
+            files = []
+            firsts = []
+            for _ in range(start, min(count, start + options['batch_size'])):
+                base = random.choice(base_names)
+                seen[base] = seen.get(base, 0) + 1
+                name = base if seen[base] == 1 else File.objects._build_name(base, seen[base])
+                vendor = random.choice(vendors)
+                submitter = random.choice(('Bob', 'Alice', 'Processor', 'Scanner'))
+                f = File(
+                    name=name,
+                    size=self._get_size() if options['storage'] != 'empty' else 0,
+                    location=upload_location,
+                    key=os.path.join(vendor.short_name, submitter, name),
+                    vendor=vendor,
+                    submitter=submitter,
+                    priority=vendor.priority,
+                    status=status if status != MIXED else random.choices(statuses, weights)[0]
+                )
+                files.append(f)
+                if seen[base] == 1:
+                    firsts.append(f)
+
+            with transaction.atomic():
+                File.objects.bulk_create(files, batch_size=options['batch_size'])
+                # Postgres interval arithmetic, the bulk mode is Postgres only like the rest of the file tooling
+                File.objects.filter(pk__in=[f.pk for f in files]).update(
+                    date_uploaded=RawSQL("now() - random() * interval '1 day' * %s", [options['days']])
+                )
+                # Bulk inserts skip the save signal, so roll the files up for the stats here
+                FileStatusRollup.objects.record_inserted([f.pk for f in files])
+            originals.update((f.name, f.pk) for f in firsts)
+            if options['storage'] != 'none':
+                self._write_objects(files, options['storage'])
+            keys.extend(f.key for f in files[:5 - len(keys)])
+            print(f'Inserted {min(count, start + options["batch_size"])}/{count} files')
+
+        # Point the first file of each duplicated name at a counter, as the file manager would
+        versioned = [(originals[base], total) for base, total in seen.items() if total > 1]
+        with transaction.atomic():
+            counters = FilenameCounter.objects.bulk_create(
+                [FilenameCounter(count=total) for _, total in versioned], batch_size=options['batch_size']
+            )
+            files = [File(pk=pk, counter=counter) for (pk, _), counter in zip(versioned, counters)]
+            # bulk_update builds a CASE per batch that Postgres evaluates for every row, keep those small
+            File.objects.bulk_update(files, ['counter'], batch_size=min(options['batch_size'], 500))
+        return keys
+
     def handle(self, *args, **options):
         statuses = [s for s, _ in File.STATUS_CHOICES]
-        status = options.get('status', '')
-        if status.lower() not in statuses:
-            raise Exception('Must provide status from list')
+        status = options.get('status', '').lower()
         count = options.get('count', 1)
+        if options['bulk'] and status in statuses + [MIXED]:
+            keys = self._bulk_create(status, count, options)
+            print("Seeded {} file(s) of {} status.".format(count, status))
+            print('\n\t- ' + '\n\t- '.join(keys) + '\n\t(+{} more)...'.format(max(0, count - len(keys))))
+            return
+        if status not in statuses:
+            raise Exception('Must provide status from list')
 
         files = [self._create_file(status, index) for index in range(0, count)]
         print("Seeded {} file(s) of {} status.".format(count, status))
@@ -0,0 +1,209 @@
+import csv
+import io
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand, CommandError
+
+from server.pj import store
+from server.pj.models import Vendor, File, FilenameCounter
+
+COLUMNS = ('name', 'location', 'key', 'size', 'vendor_id', 'submitter', 'status', 'priority', 'date_uploaded')
+DONE = object()
+# Names locked per transaction, advisory locks share the lock table sized by max_locks_per_transaction
+NAME_LOCKS = 1000
+
+
+class Command(BaseCommand):
+    help = '''
+    Register objects already in storage as files. Objects must follow the {location}/{status}/{vendor}/{submitter}/{name}
+    layout, where vendor is the short name of an existing vendor. Objects whose key is already registered are skipped
+    and files whose name is already taken are given a versioned name, as repeated uploads are.
+    Rows are loaded with Postgres COPY in batches, so the status rollups are not updated, and without
+    checksums, which verify_files --backfill records.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', type=str, help='Base location to import from, defaults to UPLOAD_LOCATION')
+        parser.add_argument('--statuses', type=lambda v: v.split(','), help='Comma separated statuses to import, defaults to all')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--workers', type=int, default=8, help='Vendor prefixes listed in parallel')
+        parser.add_argument('--dry-run', action='store_true', help='List and count objects without inserting them')
+
+    def handle(self, *args, **options):
+        location = options['location'] or settings.UPLOAD_LOCATION or ''
+        statuses = options['statuses'] or [s for s, _ in File.STATUS_CHOICES]
+        invalid = set(statuses) - {s for s, _ in File.STATUS_CHOICES}
+        if invalid:
+            raise CommandError(f'Unknown statuses: {", ".join(sorted(invalid))}')
+
+        vendors = {v.short_name: v for v in Vendor.objects.all()}
+        prefixes = []
+        for status in statuses:
+            for vendor_name in store.list_prefixes(os.path.join(location, status)):
+                if vendor_name in vendors:
+                    prefixes.append((status, vendors[vendor_name]))
+                else:
+                    print(f'Skipping unknown vendor folder {status}/{vendor_name}')
+
+        self.counts = {'listed': 0, 'skipped': 0, 'inserted': 0, 'renamed': 0}
+        self.lock = threading.Lock()
+        batches = queue.Queue(maxsize=options['workers'] * 2)
+        self.stopped = threading.Event()
+
+        def list_prefix(status, vendor):
+            try:
+                self._list_prefix(location, status, vendor, options['batch_size'], batches)
+            finally:
+                batches.put(DONE)
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(list_prefix, status, vendor) for status, vendor in prefixes]
+            remaining = len(futures)
+            try:
+                while remaining:
+                    batch = batches.get()
+                    if batch is DONE:
+                        remaining -= 1
+                    elif not options['dry_run']:
+                        self.counts['inserted'] += self._copy(batch)
+            except BaseException:
+                # Unblock the listing threads so the executor can shut down
+                self.stopped.set()
+                while remaining:
+                    remaining -= batches.get() is DONE
+                raise
+            # Surface any listing errors
+            for future in futures:
+                future.result()
+
+        print('Listed {listed} object(s), skipped {skipped}, inserted {inserted} file(s). Renamed {renamed} file(s) whose name was taken.'.format(**self.counts))
+
+    def _list_prefix(self, location, status, vendor, batch_size, batches):
+        batch = []
+        for relative, size, modified in store.walk(os.path.join(location, status, vendor.short_name)):
+            if self.stopped.is_set():
+                return
+            parts = relative.split('/')
+            valid = len(parts) == 2 and all(parts) and len(parts[0]) <= 64 and len(parts[1]) <= 128
+            with self.lock:
+                self.counts['listed'] += 1
+                self.counts['skipped'] += not valid
+            if not valid:
+                continue
+            submitter, name = parts
+            batch.append((
+                name, location, f'{vendor.short_name}/{relative}', size, vendor.pk,
+                submitter, status, vendor.priority, modified.isoformat()
+            ))
+            if len(batch) >= batch_size:
+                batches.put(batch)
+                batch = []
+        if batch:
+            batches.put(batch)
+
+    def _version_names(self, rows):
+        """
+        _version_names
+
+        Drop rows whose key is already registered and rename the rest whose name is taken, by another file or
+        an earlier row, the way FileManager._get_next_filename names repeated uploads. Candidate names are
+        checked a round at a time, so a batch costs a few queries however many rows it renames.
+
+        :rows: list - tuples of COLUMNS values
+
+        :return: tuple - (rows to insert, {original name: last version count used})
+        """
+        registered = set(File.objects.filter(key__in=[r[2] for r in rows]).values_list('key', flat=True))
+        unique = {}
+        for row in rows:
+            if row[2] not in registered:
+                unique.setdefault(row[2], row)
+        rows = list(unique.values())
+
+        taken = set(File.objects.filter(name__in={r[0] for r in rows}).values_list('name', flat=True))
+        counts = dict(File.objects.filter(name__in=taken, counter__isnull=False).values_list('name', 'counter__count'))
+        claimed = set()
+        pending = []
+        for index, row in enumerate(rows):
+            if row[0] in taken or row[0] in claimed:
+                pending.append(index)
+            else:
+                claimed.add(row[0])
+
+        versioned = {}
+        next_count = {}
+        while pending:
+            candidates = {}
+            for index in pending:
+                name = rows[index][0]
+                count = next_count.get(name, counts.get(name, 2))
+                while File.objects._build_name(name, count) in claimed:
+                    count += 1
+                candidate = File.objects._build_name(name, count)
+                claimed.add(candidate)
+                next_count[name] = count + 1
+                candidates[index] = (candidate, count)
+            existing = set(File.objects.filter(name__in=[c for c, _ in candidates.values()]).values_list('name', flat=True))
+            pending = [index for index, (candidate, _) in candidates.items() if candidate in existing]
+            for index, (candidate, count) in candidates.items():
+                if candidate not in existing:
+                    name = rows[index][0]
+                    versioned[name] = max(versioned.get(name, count), count)
+                    rows[index] = (candidate,) + rows[index][1:]
+                    self.counts['renamed'] += 1
+        return rows, versioned
+
+    def _count_versions(self, versioned):
+        """Point the original file of each versioned name at a counter holding the last version used."""
+        update = []
+        created = []
+        for f in File.objects.filter(name__in=versioned).select_related('counter'):
+            if f.counter:
+                f.counter.count = max(f.counter.count, versioned[f.name])
+                update.append(f.counter)
+            else:
+                f.counter = FilenameCounter(count=versioned[f.name])
+                created.append(f)
+        FilenameCounter.objects.bulk_update(update, ['count'])
+        FilenameCounter.objects.bulk_create([f.counter for f in created])
+        for f in created:
+            f.counter_id = f.counter.pk
+        File.objects.bulk_update(created, ['counter'])
+
+    def _copy(self, rows):
+        """
+        _copy
+
+        :rows: list - tuples of COLUMNS values
+
+        :return: int - number of rows inserted, rows with an already registered key are ignored
+        """
+        return sum(self._copy_locked(rows[start:start + NAME_LOCKS]) for start in range(0, len(rows), NAME_LOCKS))
+
+    def _copy_locked(self, rows):
+        columns = ', '.join(COLUMNS)
+        table = File._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Uploads of the same names wait until these rows are committed, as concurrent uploads do
+            File.objects._lock_names([r[0] for r in rows])
+            rows, versioned = self._version_names(rows)
+            data = io.StringIO()
+            csv.writer(data).writerows(rows)
+            data.seek(0)
+            cursor.execute(f'CREATE TEMPORARY TABLE file_import AS SELECT {columns} FROM {table} WITH NO DATA')
+            cursor.copy_expert(f'COPY file_import ({columns}) FROM STDIN WITH CSV', data)
+            # Checked explicitly as a partitioned file table has no unique index on key alone
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}, message, fragments, checksum, compressed) '
+                f"SELECT DISTINCT ON (key) {columns}, '', '{{}}', '', false FROM file_import f "
+                f'WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE key = f.key) ON CONFLICT DO NOTHING'
+            )
+            inserted = cursor.rowcount
+            cursor.execute('DROP TABLE file_import')
+            self._count_versions(versioned)
+        return inserted
@@ -0,0 +1,260 @@
+import re
+from datetime import date
+
+from django.db import connection, connections, transaction
+from django.db.migrations import operations
+from django.core.management.base import BaseCommand, CommandError
+
+from server.pj.models import File
+
+TABLE = File._meta.db_table
+OLD_TABLE = f'{TABLE}_unpartitioned'
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_PATTERN = re.compile(rf'^{TABLE}_y(\d{{4}})m(\d{{2}})$')
+# Fields whose constraints convert rebuilds to include date_uploaded, which Django's migration state does not know
+PARTITION_FIELDS = {'id', 'key', 'counter', 'date_uploaded'}
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_y{month.year}m{month.month:02}'
+
+
+def parse_month(value):
+    try:
+        year, month = value.split('-')
+        return date(int(year), int(month), 1)
+    except ValueError:
+        raise CommandError(f'Months must be given as YYYY-MM, not {value}')
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def alters_partitioned_schema(operation):
+    """
+    alters_partitioned_schema
+
+    :operation: Operation - migration operation
+
+    :return: bool - whether the operation changes the keys or constraints of the file table convert rebuilt
+    """
+    if isinstance(operation, (operations.DeleteModel, operations.RenameModel, operations.AlterUniqueTogether)):
+        return operation.name_lower == 'file'
+    if isinstance(operation, (operations.AddConstraint, operations.RemoveConstraint)):
+        return operation.model_name_lower == 'file'
+    if isinstance(operation, operations.RenameField):
+        return operation.model_name_lower == 'file' and operation.old_name_lower in PARTITION_FIELDS
+    if isinstance(operation, (operations.AlterField, operations.RemoveField)):
+        return operation.model_name_lower == 'file' and operation.name_lower in PARTITION_FIELDS
+    return False
+
+
+def guard_partitioned_migrations(sender, plan=None, using='default', **kwargs):
+    """
+    pre_migrate receiver refusing migrations that would change what convert rebuilt. Django's migration state
+    still has the primary key on id and key unique on its own, so its generated SQL no longer fits the table and
+    such changes have to be written by hand, as RunSQL with state_operations.
+    """
+    pending = [
+        migration for migration, backwards in plan or ()
+        if migration.app_label == sender.label and any(alters_partitioned_schema(op) for op in migration.operations)
+    ]
+    if not pending:
+        return
+    with connections[using].cursor() as cursor:
+        if not is_partitioned(cursor, TABLE):
+            return
+    raise CommandError(
+        f'{TABLE} is partitioned, so its keys and unique constraints include date_uploaded and these migrations '
+        f'cannot be applied as generated: {", ".join(str(m) for m in pending)}. '
+        'Rewrite them as RunSQL operations with state_operations.'
+    )
+
+
+def detached_partitions(cursor):
+    """
+    detached_partitions
+
+    :cursor: CursorWrapper - cursor to query the catalog with
+
+    :return: list - quoted schema qualified names of monthly file partitions detached into an archive schema
+    """
+    cursor.execute(
+        "SELECT n.nspname, c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relkind = 'r' AND c.relname LIKE %s AND NOT c.relispartition ORDER BY 1, 2",
+        [f'{TABLE}_y%']
+    )
+    return [
+        f'{connection.ops.quote_name(schema)}.{connection.ops.quote_name(name)}'
+        for schema, name in cursor.fetchall() if PARTITION_PATTERN.match(name)
+    ]
+
+
+class Command(BaseCommand):
+    help = '''
+    Manage monthly range partitions of the file table by date_uploaded.
+
+    convert  - rebuild the file table as a partitioned table, copying every row (locks the table while it runs)
+    create   - add partitions for the coming months, run this monthly ahead of time
+    detach   - detach partitions of months before --before and move them to the --schema archive schema, or drop them
+
+    Postgres requires unique constraints to include the partition key, so once converted the primary key and the
+    unique indexes on key and counter also cover date_uploaded. Migrations do not know this, so migrate refuses
+    generated migrations that change those fields of a partitioned table.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('convert', 'create', 'detach'))
+        parser.add_argument('--months-ahead', type=int, default=3, help='Future monthly partitions to create')
+        parser.add_argument('--before', type=parse_month, help='Detach partitions of months before this YYYY-MM')
+        parser.add_argument('--schema', type=str, default='pj_archive', help='Schema detached partitions are moved to')
+        parser.add_argument('--drop', action='store_true', help='Drop detached partitions instead of archiving them')
+        parser.add_argument('--keep-old', action='store_true', help=f'Keep the original table as {OLD_TABLE} after converting')
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.cursor = cursor
+            partitioned = is_partitioned(cursor, TABLE)
+            if options['action'] == 'convert':
+                if partitioned:
+                    raise CommandError(f'{TABLE} is already partitioned')
+                self._convert(options)
+            elif not partitioned:
+                raise CommandError(f'{TABLE} is not partitioned, run convert first')
+            elif options['action'] == 'create':
+                self._create_partitions(date.today().replace(day=1), options['months_ahead'])
+            else:
+                if not options['before']:
+                    raise CommandError('detach needs --before')
+                self._detach(options)
+
+
+    def _partitions(self):
+        """
+        _partitions
+
+        :return: list - (month, name) of the monthly partitions, oldest first
+        """
+        self.cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass',
+            [TABLE]
+        )
+        months = []
+        for name, in self.cursor.fetchall():
+            match = PARTITION_PATTERN.match(name)
+            if match:
+                months.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+        return sorted(months)
+
+    def _create_partitions(self, start, months_ahead):
+        end = add_months(date.today().replace(day=1), months_ahead + 1)
+        existing = {month for month, _ in self._partitions()}
+        month = start
+        while month < end:
+            if month not in existing:
+                self._create_partition(month)
+            month = add_months(month, 1)
+
+    def _create_partition(self, month):
+        bounds = [month.isoformat(), add_months(month, 1).isoformat()]
+        # Postgres refuses to add a partition while the default partition holds rows of its range, so those
+        # are moved over with the default partition detached, all within the command's transaction
+        moving = False
+        self.cursor.execute('SELECT to_regclass(%s)', [DEFAULT_PARTITION])
+        if self.cursor.fetchone()[0]:
+            self.cursor.execute(
+                f'SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE date_uploaded >= %s AND date_uploaded < %s)',
+                bounds
+            )
+            moving = self.cursor.fetchone()[0]
+        if moving:
+            self.cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+        self.cursor.execute(
+            f'CREATE TABLE {partition_name(month)} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)', bounds
+        )
+        if moving:
+            self.cursor.execute(
+                f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE date_uploaded >= %s AND date_uploaded < %s '
+                f'RETURNING *) INSERT INTO {TABLE} SELECT * FROM moved',
+                bounds
+            )
+            print(f'Moved {self.cursor.rowcount} file(s) from {DEFAULT_PARTITION} to {partition_name(month)}')
+            self.cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+        print(f'Created partition {partition_name(month)}')
+
+    def _convert(self, options):
+        # Fire deferred foreign key checks now, Postgres will not alter a table with pending trigger events
+        self.cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        self.cursor.execute(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE confrelid = %s::regclass AND contype = 'f'",
+            [TABLE]
+        )
+        references = self.cursor.fetchall()
+        if references:
+            raise CommandError(
+                'Foreign keys must not reference the file table: ' + ', '.join(f'{t}.{c}' for t, c in references)
+            )
+
+        self.cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+        self.cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {OLD_TABLE}')
+        self.cursor.execute(f'CREATE TABLE {TABLE} (LIKE {OLD_TABLE} INCLUDING DEFAULTS) PARTITION BY RANGE (date_uploaded)')
+        # Keep the id sequence when the old table is dropped
+        self.cursor.execute(f'ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+        self._copy_indexes()
+        self._copy_foreign_keys()
+
+        self.cursor.execute(f"SELECT date_trunc('month', min(date_uploaded))::date FROM {OLD_TABLE}")
+        first = self.cursor.fetchone()[0] or date.today().replace(day=1)
+        self._create_partitions(first, options['months_ahead'])
+        self.cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT')
+
+        self.cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {OLD_TABLE}')
+        print(f'Copied {self.cursor.rowcount} file(s) into {TABLE}')
+        if not options['keep_old']:
+            self.cursor.execute(f'DROP TABLE {OLD_TABLE}')
+
+    def _copy_indexes(self):
+        self.cursor.execute(
+            'SELECT pg_get_indexdef(i.indexrelid), i.indisunique, i.indisprimary FROM pg_index i WHERE i.indrelid = %s::regclass',
+            [OLD_TABLE]
+        )
+        for definition, unique, primary in self.cursor.fetchall():
+            method, columns = re.search(r'USING (\w+) \((.*)\)$', definition).groups()
+            if primary:
+                self.cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY ({columns}, date_uploaded)')
+            elif unique:
+                if 'date_uploaded' not in columns:
+                    columns = f'{columns}, date_uploaded'
+                self.cursor.execute(f'CREATE UNIQUE INDEX ON {TABLE} USING {method} ({columns})')
+            else:
+                self.cursor.execute(f'CREATE INDEX ON {TABLE} USING {method} ({columns})')
+
+    def _copy_foreign_keys(self):
+        self.cursor.execute(
+            "SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [OLD_TABLE]
+        )
+        for definition, in self.cursor.fetchall():
+            self.cursor.execute(f'ALTER TABLE {TABLE} ADD {definition}')
+
+    def _detach(self, options):
+        if not options['drop']:
+            self.cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {connection.ops.quote_name(options["schema"])}')
+        for month, name in self._partitions():
+            if month >= options['before']:
+                break
+            self.cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+            if options['drop']:
+                self.cursor.execute(f'DROP TABLE {name}')
+                print(f'Dropped partition {name}')
+            else:
+                self.cursor.execute(f'ALTER TABLE {name} SET SCHEMA {connection.ops.quote_name(options["schema"])}')
+                print(f'Archived partition {name} to {options["schema"]}')
@@ -0,0 +1,187 @@
+import heapq
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+
+from server.pj import store
+from server.pj.models import Vendor, File, FileStatusRollup
+from server.pj.management.commands.partition_files import detached_partitions
+
+ORPHAN = 'orphan'
+MISSING = 'missing'
+MISMATCH = 'mismatch'
+DUPLICATE = 'duplicate'
+
+
+def tagged(iterable, status):
+    for key, _, _ in iterable:
+        yield key, status
+
+
+class Command(BaseCommand):
+    help = '''
+    Compare the objects in storage with the file table and report objects without a file (orphan), files without an
+    object (missing), files whose object is stored under another status (mismatch) and files stored under several
+    statuses (duplicate). Both sides are streamed in key order and merge joined a vendor at a time, so memory stays
+    constant however many objects there are.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', type=str, help='Base location to reconcile, defaults to UPLOAD_LOCATION')
+        parser.add_argument('--vendors', type=lambda v: v.split(','), help='Comma separated vendor short names, defaults to all')
+        parser.add_argument('--workers', type=int, default=4, help='Vendors reconciled in parallel')
+        parser.add_argument('--repair', action='store_true', help='Set mismatched statuses from storage and delete missing files')
+        parser.add_argument('--delete-orphans', action='store_true', help='Delete orphaned objects from storage')
+        parser.add_argument('--min-age', type=int, default=60, help='Only delete files uploaded at least this many minutes ago')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        location = options['location'] or settings.UPLOAD_LOCATION or ''
+        vendors = Vendor.objects.order_by('short_name')
+        if options['vendors']:
+            vendors = vendors.filter(short_name__in=options['vendors'])
+
+        self.options = options
+        # Rows of detached partitions still own their objects, which would otherwise look orphaned
+        with connection.cursor() as cursor:
+            self.detached = detached_partitions(cursor)
+        self.counts = {ORPHAN: 0, MISSING: 0, MISMATCH: 0, DUPLICATE: 0}
+        self.lock = threading.Lock()
+
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                for _ in executor.map(lambda v: self._reconcile_threaded(location, v), vendors):
+                    pass
+        else:
+            for vendor in vendors:
+                self._reconcile(location, vendor)
+
+        print('Found {orphan} orphan(s), {missing} missing, {mismatch} mismatch(es), {duplicate} duplicate(s).'.format(**self.counts))
+
+    def _reconcile_threaded(self, location, vendor):
+        try:
+            self._reconcile(location, vendor)
+        finally:
+            # Each thread opens its own connection
+            connection.close()
+
+    def _storage(self, location, vendor):
+        """
+        _storage
+
+        :return: generator - (key, set of statuses the key is stored under) in key byte order
+        """
+        listings = [
+            tagged(store.walk(os.path.join(location, status, vendor.short_name)), status)
+            for status, _ in File.STATUS_CHOICES
+        ]
+        for relative, group in itertools.groupby(heapq.merge(*listings), key=lambda item: item[0]):
+            yield f'{vendor.short_name}/{relative}', {status for _, status in group}
+
+    def _files(self, location, vendor):
+        """
+        _files
+
+        :return: iterator - (pk, key, status) of the vendor's files in key byte order
+        """
+        return (
+            File.objects
+            .filter(vendor=vendor, location=location, key__startswith=f'{vendor.short_name}/')
+            .order_by(RawSQL('key COLLATE "C"', []))
+            .values_list('pk', 'key', 'status')
+            .iterator(chunk_size=self.options['batch_size'])
+        )
+
+    def _report(self, kind, message):
+        with self.lock:
+            self.counts[kind] += 1
+            print(f'{kind} {message}')
+
+    def _reconcile(self, location, vendor):
+        stored = self._storage(location, vendor)
+        files = self._files(location, vendor)
+        repairs = {}
+        missing = []
+
+        object_key, statuses = next(stored, (None, None))
+        row = next(files, None)
+        while object_key is not None or row is not None:
+            if row is None or (object_key is not None and object_key < row[1]):
+                for status in sorted(statuses):
+                    self._report(ORPHAN, os.path.join(location, status, object_key))
+                    # The file may have been registered since its rows were read
+                    if self.options['delete_orphans'] and not self._registered(object_key):
+                        store.delete(os.path.join(location, status, object_key))
+                object_key, statuses = next(stored, (None, None))
+                continue
+
+            pk, key, status = row
+            if object_key != key:
+                self._report(MISSING, f'{key} ({status})')
+                missing.append(pk)
+            elif len(statuses) > 1:
+                self._report(DUPLICATE, f'{key} ({status}) stored as {", ".join(sorted(statuses))}')
+            elif status not in statuses:
+                stored_status = statuses.pop()
+                self._report(MISMATCH, f'{key} ({status}) stored as {stored_status}')
+                repairs.setdefault(stored_status, []).append((pk, status))
+            if object_key == key:
+                object_key, statuses = next(stored, (None, None))
+            row = next(files, None)
+
+            if self.options['repair']:
+                self._repair(repairs, missing)
+
+        if self.options['repair']:
+            self._repair(repairs, missing, flush=True)
+
+    def _registered(self, key):
+        """
+        _registered
+
+        :key: str - object key relative to its status
+
+        :return: bool - whether a file, live or in a detached partition, has the key
+        """
+        if File.objects.filter(key=key).exists():
+            return True
+        with connection.cursor() as cursor:
+            for table in self.detached:
+                cursor.execute(f'SELECT 1 FROM {table} WHERE key = %s LIMIT 1', [key])
+                if cursor.fetchone():
+                    return True
+        return False
+
+    def _repair(self, repairs, missing, flush=False):
+        """
+        Apply queued repairs once a batch has built up, or everything when flushing. Files with a pending
+        transition are being moved and are left alone, as are files whose status or object changed since they
+        were listed, files missing their object that were uploaded recently or whose object has appeared since.
+        """
+        for status, rows in repairs.items():
+            if rows and (flush or len(rows) >= self.options['batch_size']):
+                scanned = dict(rows)
+                for f in File.objects.filter(pk__in=scanned, transitions__isnull=True):
+                    if f.status != scanned[f.pk] or store.exists(f.get_url()):
+                        continue
+                    if not store.exists(os.path.join(f.location, status, f.key)):
+                        continue
+                    # Only if the row is still as listed, a transition may have completed meanwhile
+                    if File.objects.filter(pk=f.pk, status=f.status, transitions__isnull=True).update(status=status):
+                        f.status = status
+                        FileStatusRollup.objects.record(f)
+                rows.clear()
+        if missing and (flush or len(missing) >= self.options['batch_size']):
+            cutoff = timezone.now() - timedelta(minutes=self.options['min_age'])
+            candidates = File.objects.filter(pk__in=missing, date_uploaded__lt=cutoff, transitions__isnull=True)
+            gone = [f.pk for f in candidates if not store.exists(f.get_url())]
+            File.objects.filter(pk__in=gone, transitions__isnull=True).delete()
+            missing.clear()
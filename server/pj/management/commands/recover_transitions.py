@@ -0,0 +1,37 @@
+import time
+import logging
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.core.management.base import BaseCommand
+
+from server.pj.models import FileTransition
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '''
+    Finish or roll back status transitions interrupted between moving the object and saving the file.
+    Run when the application starts, intents younger than --age seconds are assumed to still be in flight.
+    Those are left for later runs, so also run it on a schedule or keep it running with --loop.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--age', type=int, help='Minimum age in seconds of recovered intents, defaults to TRANSITION_RECOVERY_AGE')
+        parser.add_argument('--loop', action='store_true', help='Recover again every TRANSITION_RECOVERY_INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                counts = FileTransition.objects.recover(options['age'])
+                print('Completed {completed}, rolled back {rolled_back} and lost {lost} transition(s).'.format(**counts))
+            except Exception as e:
+                if not options['loop']:
+                    raise
+                # The database may be briefly unavailable, try again next time round
+                logger.error(f'Failed to recover status transitions: {e}')
+            if not options['loop'] or settings.TRANSITION_RECOVERY_INTERVAL <= 0:
+                return
+            close_old_connections()
+            time.sleep(settings.TRANSITION_RECOVERY_INTERVAL)
@@ -0,0 +1,115 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+
+from server.pj.models import File
+from server.pj.store import ChecksumReader, CHUNK_SIZE
+
+
+class Throttle:
+    """Sleep as needed to keep the bytes consumed at or below a rate."""
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self.consumed = 0
+        self.start = time.monotonic()
+
+    def consume(self, count):
+        self.consumed += count
+        ahead = self.consumed / self.bytes_per_second - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+class Command(BaseCommand):
+    help = '''
+    Re-read stored objects and compare them with the checksum recorded at upload, least recently verified first,
+    so repeated runs cycle through every file. Reads are throttled to --bytes-per-second. Fails when any object is
+    missing or does not match, so a scheduler can alert on it.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bytes-per-second', type=int, help='Read rate, defaults to VERIFY_BYTES_PER_SECOND')
+        parser.add_argument('--limit', type=int, default=1000, help='Files verified in this run')
+        parser.add_argument('--max-bytes', type=int, help='Stop once this many bytes have been read')
+        parser.add_argument('--min-age', type=int, default=30, help='Skip files verified in the last this many days')
+        parser.add_argument('--backfill', action='store_true', help='Record checksums of files uploaded without one')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        bytes_per_second = options['bytes_per_second'] or settings.VERIFY_BYTES_PER_SECOND
+        if bytes_per_second <= 0:
+            raise CommandError('--bytes-per-second must be positive')
+        self.throttle = Throttle(bytes_per_second)
+
+        files = File.objects \
+            .exclude(location='') \
+            .filter(Q(date_verified__isnull=True) | Q(date_verified__lt=timezone.now() - timedelta(days=options['min_age']))) \
+            .order_by(F('date_verified').asc(nulls_first=True), 'pk')
+        if not options['backfill']:
+            files = files.exclude(checksum='')
+
+        counts = {'verified': 0, 'backfilled': 0, 'mismatched': 0, 'missing': 0}
+        for f in files[:options['limit']].iterator(chunk_size=options['batch_size']):
+            if options['max_bytes'] is not None and self.throttle.consumed >= options['max_bytes']:
+                break
+            checksum = f.checksum
+            result = self._verify(f)
+            if result in ('verified', 'backfilled'):
+                # Only if the file still has the object that was read, retention may have archived it meanwhile
+                current = File.objects.filter(
+                    pk=f.pk, location=f.location, status=f.status, key=f.key, compressed=f.compressed, checksum=checksum
+                )
+                if not current.update(checksum=f.checksum, date_verified=f.date_verified):
+                    result = 'moved'
+            if result in counts:
+                counts[result] += 1
+
+        print(
+            'Verified {verified} file(s), backfilled {backfilled}, {mismatched} mismatched, {missing} missing.'.format(**counts),
+            f'Read {self.throttle.consumed} bytes.'
+        )
+        if counts['mismatched'] or counts['missing']:
+            raise CommandError(f'{counts["mismatched"] + counts["missing"]} file(s) failed verification')
+
+    def _verify(self, f):
+        """
+        _verify
+
+        :f: File - file to check, its checksum and date_verified are set when it passes
+
+        :return: str - verified, backfilled, mismatched, missing or moved
+        """
+        url = f.get_url()
+        try:
+            stream = f.retrieve()
+        except Exception as e:
+            # The file may have changed status or been archived since it was selected
+            current = File.objects.filter(pk=f.pk).values_list('location', 'status', 'key').first()
+            if current != (f.location, f.status, f.key):
+                return 'moved'
+            print(f'missing {url}: {e}')
+            return 'missing'
+
+        reader = ChecksumReader(stream)
+        try:
+            while True:
+                data = reader.read(CHUNK_SIZE)
+                if not data:
+                    break
+                self.throttle.consume(len(data))
+        finally:
+            stream.close()
+        sha256, _, size = reader.digests()
+
+        if size != f.size or (f.checksum and sha256 != f.checksum):
+            print(f'mismatch {url}: {size} bytes with checksum {sha256}, expected {f.size} bytes with checksum {f.checksum or "unknown"}')
+            return 'mismatched'
+        backfilled = not f.checksum
+        f.checksum = sha256
+        f.date_verified = timezone.now()
+        return 'backfilled' if backfilled else 'verified'
@@ -1,8 +1,49 @@
 import os.path
 
-from django.db import models
+from django.db import models, connections, transaction
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+
+from server.metrics import timed, FILE_CREATE_SECONDS
+
+MISSING_VENDOR = 'missing'
+
+
+def vendor_code_cache_key(code):
+    return f'pj:vendor:code:{code}'
+
+
+class VendorManager(models.Manager):
+
+    def get_by_code(self, code):
+        """
+        get_by_code
+
+        Resolve a vendor from its upload code, case insensitively, through the shared cache. Codes no vendor
+        could have are rejected without a lookup, so junk sent by clients does not fill the cache.
+
+        :code: str - vendor upload code
+
+        :return: Vendor - matching vendor or None
+        """
+        code = str(code).lower()
+        try:
+            self.model._meta.get_field('code').run_validators(code)
+        except ValidationError:
+            return None
+        key = vendor_code_cache_key(code)
+        vendor = cache.get(key)
+        if vendor is None:
+            try:
+                vendor = self.get(code=code)
+            except ObjectDoesNotExist:
+                vendor = MISSING_VENDOR
+            cache.set(key, vendor, settings.VENDOR_CACHE_TIMEOUT)
+        return None if vendor == MISSING_VENDOR else vendor
+
+    def invalidate_code(self, *codes):
+        cache.delete_many([vendor_code_cache_key(str(code).lower()) for code in codes if code])
 
 
 class FileManager(models.Manager):
@@ -17,6 +58,21 @@ class FileManager(models.Manager):
         name, extension = os.path.splitext(name)
         return '{}_{}{}'.format(name, count, extension)
 
+    def _lock_name(self, name):
+        """
+        Serialize uploads of the same name until the current transaction ends. Versioning reads the taken
+        names before writing, and a partitioned file table no longer has a unique index on key to catch a race.
+        """
+        self._lock_names([name])
+
+    def _lock_names(self, names):
+        """Take the locks of _lock_name for several names, in sorted order so concurrent callers cannot deadlock."""
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                'SELECT count(pg_advisory_xact_lock(hashtext(name))) FROM unnest(%s::text[]) AS name',
+                [[f'pj:file:name:{name}' for name in sorted(set(names))]]
+            )
+
     def _get_next_filename(self, name):
         existing_file = self.get_file_by_name(name)
         if not existing_file:
@@ -39,22 +95,24 @@ class FileManager(models.Manager):
 
         :return: File - instance of file created
         """
-        filename = self._get_next_filename(uploaded_file.name)
-        key = os.path.join(vendor.short_name, submitter, filename)
-
-        extra = {}
-        if status:
-            extra['status'] = status
-
-        f = self.create(
-            name=filename,
-            size=uploaded_file.size,
-            location=settings.UPLOAD_LOCATION or '',
-            key=key,
-            vendor=vendor,
-            priority=vendor.priority,
-            submitter=submitter,
-            **extra
-        )
+        with timed(FILE_CREATE_SECONDS), transaction.atomic(using=self.db):
+            self._lock_name(uploaded_file.name)
+            filename = self._get_next_filename(uploaded_file.name)
+            key = os.path.join(vendor.short_name, submitter, filename)
+
+            extra = {}
+            if status:
+                extra['status'] = status
+
+            f = self.create(
+                name=filename,
+                size=uploaded_file.size,
+                location=settings.UPLOAD_LOCATION or '',
+                key=key,
+                vendor=vendor,
+                priority=vendor.priority,
+                submitter=submitter,
+                **extra
+            )
 
         return f
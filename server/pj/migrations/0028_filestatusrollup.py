@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-19 13:52
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0027_auto_20190905_0910'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileStatusRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(db_index=True, verbose_name='Start of the hour the transitions happened in')),
+                ('status', models.CharField(choices=[('unscanned', 'unscanned'), ('clean', 'clean'), ('quarantined', 'quarantined'), ('approved', 'approved'), ('transferred', 'transferred'), ('failed', 'failed'), ('rejected', 'rejected')], max_length=11)),
+                ('file_count', models.IntegerField(default=0, verbose_name='Number of files that entered the status')),
+                ('byte_count', models.BigIntegerField(default=0, verbose_name='Total size of the files that entered the status')),
+                ('total_duration', models.DurationField(default=datetime.timedelta(0), verbose_name='Summed time from upload until the status was reached')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pj.Vendor')),
+            ],
+            options={
+                'unique_together': {('hour', 'vendor', 'status')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+from django.db.models.functions import Lower
+
+
+def lowercase_codes(apps, schema_editor):
+    Vendor = apps.get_model('pj', 'Vendor')
+    Vendor.objects.update(code=Lower('code'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0028_filestatusrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_codes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-19 14:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0029_lowercase_vendor_codes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileTransition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin', models.CharField(choices=[('unscanned', 'unscanned'), ('clean', 'clean'), ('quarantined', 'quarantined'), ('approved', 'approved'), ('transferred', 'transferred'), ('failed', 'failed'), ('rejected', 'rejected')], max_length=11)),
+                ('target', models.CharField(choices=[('unscanned', 'unscanned'), ('clean', 'clean'), ('quarantined', 'quarantined'), ('approved', 'approved'), ('transferred', 'transferred'), ('failed', 'failed'), ('rejected', 'rejected')], max_length=11)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transitions', to='pj.File')),
+            ],
+            options={
+                'unique_together': {('file', 'origin', 'target')},
+            },
+        ),
+    ]
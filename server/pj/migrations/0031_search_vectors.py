@@ -0,0 +1,59 @@
+# Generated by Django 2.2.28 on 2026-10-19 14:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+from server.pj.search import build_vector
+
+SEARCH_FIELDS = {
+    'DataSource': (
+        ('name', 'A'), ('theme', 'B'), ('data_origin', 'C'), ('data_type', 'C'),
+        ('entities', 'C'), ('portfolio', 'C'), ('leads', 'D')
+    ),
+    'Note': (('note', 'A'),),
+    'Todo': (('lead', 'A'), ('text', 'B')),
+}
+
+
+def fill_search_vectors(apps, schema_editor):
+    for model_name, fields in SEARCH_FIELDS.items():
+        apps.get_model('pj', model_name).objects.update(search_vector=build_vector(fields))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0030_filetransition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasource',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='todo',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='datasource',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='pj_datasour_search__2cef11_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='pj_note_search__716093_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='pj_todo_search__11791b_gin'),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
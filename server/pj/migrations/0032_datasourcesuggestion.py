@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-19 14:11
+
+from django.db import migrations, models
+
+SUGGESTION_FIELDS = (
+    'name', 'data_origin', 'data_type', 'entities', 'frequency', 'leads',
+    'portfolio', 'request_method', 'status', 'theme', 'update_periodically'
+)
+
+
+def count_suggestions(apps, schema_editor):
+    DataSource = apps.get_model('pj', 'DataSource')
+    DataSourceSuggestion = apps.get_model('pj', 'DataSourceSuggestion')
+    for field in SUGGESTION_FIELDS:
+        rows = DataSource.objects.exclude(**{field: ''}).values(field).annotate(total=models.Count('pk'))
+        DataSourceSuggestion.objects.bulk_create(
+            [DataSourceSuggestion(field=field, value=r[field], count=r['total']) for r in rows]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0031_search_vectors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataSourceSuggestion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=32, verbose_name='Data source field')),
+                ('value', models.CharField(max_length=1028, verbose_name='Value of the field')),
+                ('count', models.IntegerField(default=0, verbose_name='Number of data sources with the value')),
+            ],
+            options={
+                'unique_together': {('field', 'value')},
+            },
+        ),
+        migrations.RunPython(count_suggestions, migrations.RunPython.noop),
+    ]
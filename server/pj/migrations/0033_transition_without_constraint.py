@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-19 14:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0032_datasourcesuggestion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='filetransition',
+            name='file',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='transitions', to='pj.File'),
+        ),
+    ]
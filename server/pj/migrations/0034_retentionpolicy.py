@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-19 14:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0033_transition_without_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('unscanned', 'unscanned'), ('clean', 'clean'), ('quarantined', 'quarantined'), ('approved', 'approved'), ('transferred', 'transferred'), ('failed', 'failed'), ('rejected', 'rejected')], max_length=11)),
+                ('days', models.PositiveIntegerField(verbose_name='Days after upload before the policy applies')),
+                ('action', models.CharField(choices=[('archive', 'archive'), ('delete', 'delete')], default='archive', max_length=7)),
+                ('archive_location', models.CharField(blank=True, default='', max_length=1024, verbose_name='Base URL archived files are moved to, e.g. a bucket with a cold storage lifecycle rule')),
+                ('compress', models.BooleanField(default=False, verbose_name='Gzip files as they are archived')),
+                ('vendor', models.ForeignKey(blank=True, help_text='Leave empty to apply to every vendor without its own policy for the status', null=True, on_delete=django.db.models.deletion.CASCADE, to='pj.Vendor')),
+            ],
+            options={
+                'verbose_name_plural': 'retention policies',
+                'unique_together': {('vendor', 'status')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0034_retentionpolicy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='checksum',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='SHA-256 hex digest of the stored object, blank if unknown'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='date_verified',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='When the stored object last matched its checksum'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-19 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0035_file_checksum'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='retentionpolicy',
+            constraint=models.UniqueConstraint(condition=models.Q(vendor__isnull=True), fields=('status',), name='unique_every_vendor_retention'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 15:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0036_unique_every_vendor_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='compressed',
+            field=models.BooleanField(default=False, verbose_name='Whether the stored object is gzipped, size and checksum are of its contents'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pj', '0037_file_compressed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='name',
+            field=models.CharField(db_index=True, max_length=128, verbose_name='Name of the file that was uploaded'),
+        ),
+    ]
@@ -1,17 +1,31 @@
 import re
+import time
 import string
 import os.path
 import logging
-
-from django.db import models
+from datetime import timedelta
+from collections import Counter
+
+from django.conf import settings
+from django.db import models, IntegrityError, connection, transaction
+from django.db.models import F, Q, Case, When, Value, IntegerField
+from django.dispatch import receiver
+from django.db.models.signals import post_init, post_save, post_delete
+from django.utils import timezone
 from django.utils.crypto import get_random_string
+from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 from server.auth.models import User
-from server.pj.managers import FileManager
+from server.pj.managers import FileManager, VendorManager
 
-from server.pj.store import move, delete
+from server.pj.store import move, delete, exists, retrieve, GzipReader
+from server.pj.search import update_search_vectors
+from server.pj.suggestions import bump_suggestions_version
+from server.metrics import STATUS_CHANGE_SECONDS
 
 def create_vendor_code():
     # Stripping out characters that be confused with each other or another
@@ -46,6 +60,8 @@ class Stakeholder(models.Model):
 class Vendor(models.Model):
     """Represent a vendor/organization that is allowed to upload files to the puddle."""
 
+    objects = VendorManager()
+
     name = models.CharField(max_length=128, unique=True)
     short_name = models.CharField(max_length=128, unique=True, validators=[RegexValidator(s3_pattern)])
     code = models.CharField(
@@ -61,6 +77,11 @@ class Vendor(models.Model):
     priority = models.IntegerField("Default priority for files belonging to this vendor", validators=priority_validators, default=5)
     approval_regex = models.CharField("Regex approval value", max_length=128, null=True, blank=True, validators=[validate_regex])
 
+    def save(self, *args, **kwargs):
+        # Codes are matched case insensitively, store them lowercase so lookups can use the unique index
+        self.code = str(self.code).lower()
+        super().save(*args, **kwargs)
+
     def approves(self, file_obj):
         if self.auto_approve:
             return True
@@ -73,6 +94,18 @@ class Vendor(models.Model):
         return f'{self.name} ({self.code})'
 
 
+@receiver(post_init, sender=Vendor)
+def remember_code(sender, instance=None, **kwargs):
+    instance._loaded_code = instance.__dict__.get('code') if instance.pk else None
+
+@receiver(post_save, sender=Vendor)
+@receiver(post_delete, sender=Vendor)
+def invalidate_vendor_code(sender, instance=None, **kwargs):
+    """Drop cached code lookups for the vendor, including a code it was just renamed from."""
+    Vendor.objects.invalidate_code(instance.code, getattr(instance, '_loaded_code', None))
+    instance._loaded_code = instance.code
+
+
 class FilenameCounter(models.Model):
     """Track how many instances of each name we have seen to correctly increment versions."""
     count = models.IntegerField("Number of files with this name encountered", default=0)
@@ -103,7 +136,7 @@ class File(models.Model):
 
     objects = FileManager()
 
-    name = models.CharField('Name of the file that was uploaded', max_length=128)
+    name = models.CharField('Name of the file that was uploaded', max_length=128, db_index=True)
     # The URL for a file should be {location}/{status}/{key}
     location = models.CharField('Base URL the file is stored at', max_length=1024, blank=True, default='')
     key = models.CharField(
@@ -114,6 +147,9 @@ class File(models.Model):
         unique=True
     )
     size = models.BigIntegerField('The size of the file in bytes')
+    checksum = models.CharField('SHA-256 hex digest of the stored object, blank if unknown', max_length=64, blank=True, default='')
+    date_verified = models.DateTimeField('When the stored object last matched its checksum', null=True, blank=True)
+    compressed = models.BooleanField('Whether the stored object is gzipped, size and checksum are of its contents', default=False)
     vendor = models.ForeignKey(Vendor, on_delete=models.PROTECT)
     submitter = models.CharField(
         'Name of the person/thing that submitted the file',
@@ -135,16 +171,37 @@ class File(models.Model):
     priority = models.IntegerField("Priority of file for processing order", validators=priority_validators)
 
     def change_status(self, origin_status, target_status, request=None):
+        """
+        change_status
+
+        Move the file's object and then save its new status. An intent is recorded before the move and
+        removed with the save, so a crash in between is resolved by FileTransition.objects.recover and
+        retrying an interrupted transition does not move the object twice.
+
+        :origin_status: str - status the object is currently stored under
+        :target_status: str - status to move the file to
+        :request: Request - request for log context
+
+        :return: bool - whether the transition succeeded
+        """
+        start = time.perf_counter()
+        succeeded = False
         try:
             origin_path, target_path = (os.path.join(self.location, status, self.key) for status in (origin_status, target_status))
-            move(origin_path, target_path)
-            self.status = target_status
-            self.save()
+            intent, created = FileTransition.objects.get_or_create(file=self, origin=origin_status, target=target_status)
+            # A previous attempt may have moved the object before failing to save
+            if created or not (exists(target_path) and not exists(origin_path)):
+                move(origin_path, target_path)
+            with transaction.atomic():
+                self.status = target_status
+                self.save()
+                intent.delete()
             logger.info(f'Set file {self.key} to {target_status}', extra={'request': request})
-            return True
+            succeeded = True
         except Exception as e:
             logger.error(f'Failed to change file {self.key} to {target_status}: {e}', extra={'request': request})
-            return False
+        STATUS_CHANGE_SECONDS.labels(status=target_status, succeeded=succeeded).observe(time.perf_counter() - start)
+        return succeeded
 
     def reset(self, request):
         target_status = None
@@ -187,12 +244,305 @@ class File(models.Model):
     def get_url(self):
         return os.path.join(self.location, self.status, self.key)
 
+    def retrieve(self):
+        """
+        retrieve
+
+        :return: file - stream of the file's contents, decompressed if it was archived compressed
+        """
+        stream = retrieve(self.get_url())
+        return GzipReader(stream) if self.compressed else stream
+
     def start_counter(self):
         self.counter = FilenameCounter.objects.create(count=2)
         self.save()
 
+@receiver(post_init, sender=File)
+def remember_status(sender, instance=None, **kwargs):
+    """Keep the status the file was loaded with so saves can detect transitions."""
+    # Read through __dict__ so deferred status fields are not fetched
+    instance._loaded_status = instance.__dict__.get('status') if instance.pk else None
+
+@receiver(post_save, sender=File)
+def record_status_transition(sender, instance=None, created=False, **kwargs):
+    """Roll each status transition up into the hourly statistics table."""
+    if instance is None or (not created and instance.status == getattr(instance, '_loaded_status', None)):
+        return
+    instance._loaded_status = instance.status
+    try:
+        FileStatusRollup.objects.record(instance)
+    except Exception as e:
+        logger.error(f'Failed to record status rollup for file {instance.key}: {e}')
+
+
+class FileStatusRollupManager(models.Manager):
+
+    def record(self, file_obj, when=None):
+        """
+        record
+
+        :file_obj: File - file that just entered its current status
+        :when: datetime - time of the transition, defaults to now
+
+        :return: None
+        """
+        when = when or timezone.now()
+        hour = when.replace(minute=0, second=0, microsecond=0)
+        elapsed = when - file_obj.date_uploaded if file_obj.date_uploaded else timedelta(0)
+        lookup = {'hour': hour, 'vendor_id': file_obj.vendor_id, 'status': file_obj.status}
+        changes = {
+            'file_count': F('file_count') + 1,
+            'byte_count': F('byte_count') + file_obj.size,
+            'total_duration': F('total_duration') + elapsed
+        }
+        if self.filter(**lookup).update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                self.create(file_count=1, byte_count=file_obj.size, total_duration=elapsed, **lookup)
+        except IntegrityError:
+            # Another worker created the bucket first
+            self.filter(**lookup).update(**changes)
+
+    def record_inserted(self, pks):
+        """
+        record_inserted
+
+        Roll up files inserted in bulk, which skip the save signal, as having entered their status on upload.
+
+        :pks: list - primary keys of the inserted files
+
+        :return: None
+        """
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (hour, vendor_id, status, file_count, byte_count, total_duration) '
+                f"SELECT date_trunc('hour', date_uploaded), vendor_id, status, count(*), sum(size), interval '0' "
+                f'FROM {File._meta.db_table} WHERE id = ANY(%s) GROUP BY 1, 2, 3 '
+                f'ON CONFLICT (hour, vendor_id, status) DO UPDATE SET file_count = {table}.file_count + EXCLUDED.file_count, '
+                f'byte_count = {table}.byte_count + EXCLUDED.byte_count',
+                [list(pks)]
+            )
+
+
+class FileStatusRollup(models.Model):
+    """Hourly count of files and bytes that entered a status for a vendor."""
+
+    objects = FileStatusRollupManager()
+
+    hour = models.DateTimeField('Start of the hour the transitions happened in', db_index=True)
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
+    status = models.CharField(choices=File.STATUS_CHOICES, max_length=11)
+    file_count = models.IntegerField('Number of files that entered the status', default=0)
+    byte_count = models.BigIntegerField('Total size of the files that entered the status', default=0)
+    total_duration = models.DurationField('Summed time from upload until the status was reached', default=timedelta(0))
+
+    class Meta:
+        unique_together = ('hour', 'vendor', 'status')
+
+    def __str__(self):
+        return f'{self.vendor_id} {self.status} {self.hour}'
+
+class FileTransitionManager(models.Manager):
+
+    def recover(self, age=None):
+        """
+        recover
+
+        Resolve transitions left behind by crashed or failed moves using where the object is now. Each intent
+        is locked while it is recovered and intents locked by another process are skipped, so several
+        processes can recover at once.
+
+        :age: int - only recover intents older than this many seconds, defaults to TRANSITION_RECOVERY_AGE
+
+        :return: dict - number of intents completed, rolled back and lost
+        """
+        age = settings.TRANSITION_RECOVERY_AGE if age is None else age
+        cutoff = timezone.now() - timedelta(seconds=age)
+        counts = {FileTransition.COMPLETED: 0, FileTransition.ROLLED_BACK: 0, FileTransition.LOST: 0}
+        for pk in self.filter(created__lte=cutoff).order_by('pk').values_list('pk', flat=True).iterator():
+            try:
+                with transaction.atomic():
+                    intent = self.filter(pk=pk).select_related('file').select_for_update(skip_locked=True, of=('self',)).first()
+                    if intent is None:
+                        # Resolved or being resolved elsewhere
+                        continue
+                    result = intent.recover()
+            except Exception as e:
+                logger.error(f'Failed to recover transition {pk}: {e}')
+                continue
+            counts[result] += 1
+        return counts
+
+
+class FileTransition(models.Model):
+    """Intent to move a file between statuses, kept until the new status is saved."""
+    COMPLETED = 'completed'
+    ROLLED_BACK = 'rolled_back'
+    LOST = 'lost'
+
+    objects = FileTransitionManager()
+
+    # No database constraint so the file table can be partitioned, see the partition_files command
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='transitions', db_constraint=False)
+    origin = models.CharField(choices=File.STATUS_CHOICES, max_length=11)
+    target = models.CharField(choices=File.STATUS_CHOICES, max_length=11)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('file', 'origin', 'target')
+
+    def __str__(self):
+        return f'{self.file_id} {self.origin} -> {self.target}'
+
+    def recover(self):
+        """
+        recover
+
+        Finish the transition if the object reached the target, otherwise leave the file where it is.
+
+        :return: str - COMPLETED, ROLLED_BACK or LOST
+        """
+        f = self.file
+        origin_path, target_path = (os.path.join(f.location, status, f.key) for status in (self.origin, self.target))
+        if exists(target_path):
+            # An S3 move copies before deleting, so the original may still be there
+            if exists(origin_path):
+                delete(origin_path)
+            with transaction.atomic():
+                f.status = self.target
+                f.save()
+                self.delete()
+            logger.info(f'Completed transition of file {f.key} to {self.target}')
+            return FileTransition.COMPLETED
+
+        self.delete()
+        if exists(origin_path):
+            logger.info(f'Rolled back transition of file {f.key} to {self.target}')
+            return FileTransition.ROLLED_BACK
+        logger.error(f'Lost object of file {f.key} transitioning from {self.origin} to {self.target}')
+        return FileTransition.LOST
+
+
+class RetentionPolicy(models.Model):
+    """Age after which files in a status, of one vendor or every vendor, are archived or deleted."""
+    ARCHIVE = 'archive'
+    DELETE = 'delete'
+    ACTION_CHOICES = (
+        (ARCHIVE, ARCHIVE),
+        (DELETE, DELETE)
+    )
+
+    vendor = models.ForeignKey(
+        Vendor,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        help_text='Leave empty to apply to every vendor without its own policy for the status'
+    )
+    status = models.CharField(choices=File.STATUS_CHOICES, max_length=11)
+    days = models.PositiveIntegerField('Days after upload before the policy applies')
+    action = models.CharField(choices=ACTION_CHOICES, default=ARCHIVE, max_length=7)
+    archive_location = models.CharField(
+        'Base URL archived files are moved to, e.g. a bucket with a cold storage lifecycle rule',
+        max_length=1024,
+        blank=True,
+        default=''
+    )
+    compress = models.BooleanField('Gzip files as they are archived', default=False)
+
+    class Meta:
+        unique_together = ('vendor', 'status')
+        # NULL vendors are distinct to the unique together index, so every vendor policies need their own
+        constraints = [
+            models.UniqueConstraint(fields=['status'], condition=Q(vendor__isnull=True), name='unique_every_vendor_retention')
+        ]
+        verbose_name_plural = 'retention policies'
+
+    def __str__(self):
+        return f'{self.action} {self.status} files of {self.vendor or "every vendor"} after {self.days} days'
+
+    def clean(self):
+        if self.action == RetentionPolicy.ARCHIVE and not self.archive_location:
+            raise ValidationError({'archive_location': 'Archive policies need an archive location'})
+        # Model validation does not check conditional constraints
+        duplicates = RetentionPolicy.objects.filter(vendor__isnull=True, status=self.status).exclude(pk=self.pk)
+        if self.vendor_id is None and duplicates.exists():
+            raise ValidationError({'status': f'There is already a policy for {self.status} files of every vendor'})
+
+    def get_files(self):
+        """
+        get_files
+
+        :return: QuerySet - files old enough for the policy that it has not already archived
+        """
+        files = File.objects.filter(status=self.status, date_uploaded__lt=timezone.now() - timedelta(days=self.days))
+        if self.vendor_id:
+            files = files.filter(vendor_id=self.vendor_id)
+        else:
+            overridden = RetentionPolicy.objects.filter(status=self.status, vendor__isnull=False).values('vendor_id')
+            files = files.exclude(vendor_id__in=overridden)
+        if self.action == RetentionPolicy.ARCHIVE:
+            files = files.exclude(location=self.archive_location)
+        return files
+
+
+class DataSourceManager(models.Manager):
+
+    def create_many(self, instances, batch_size=1000):
+        """
+        create_many
+
+        Insert data sources in batches within one transaction, indexing them for search and suggestions.
+
+        :instances: list - unsaved DataSource instances
+
+        :return: list - the saved instances
+        """
+        with transaction.atomic():
+            self.bulk_create(instances, batch_size=batch_size)
+            self._index(instances)
+        return instances
+
+    def update_many(self, instances, fields, batch_size=1000):
+        """
+        update_many
+
+        :instances: list - loaded DataSource instances with their new values set
+        :fields: iterable - names of the fields that were changed
+
+        :return: list - the updated instances
+        """
+        if not instances or not fields:
+            return instances
+        with transaction.atomic():
+            self.bulk_update(instances, list(fields), batch_size=batch_size)
+            self._index(instances)
+        return instances
+
+    def _index(self, instances):
+        # Bulk writes skip the save signals that normally maintain these
+        update_search_vectors(self.model, [i.pk for i in instances])
+        DataSourceSuggestion.objects.adjust(change for i in instances for change in suggestion_changes(i))
+
+
 class DataSource(models.Model):
     """Provider of data for puddle jumper"""
+    SEARCH_FIELDS = (
+        ('name', 'A'),
+        ('theme', 'B'),
+        ('data_origin', 'C'),
+        ('data_type', 'C'),
+        ('entities', 'C'),
+        ('portfolio', 'C'),
+        ('leads', 'D')
+    )
+    # Free text fields offered as typeahead suggestions
+    SUGGESTION_FIELDS = (
+        'name', 'data_origin', 'data_type', 'entities', 'frequency', 'leads',
+        'portfolio', 'request_method', 'status', 'theme', 'update_periodically'
+    )
 
     name = models.CharField("Data source name", max_length=128)
     data_origin = models.CharField("Source/origin of the data", max_length=256)
@@ -208,29 +558,143 @@ class DataSource(models.Model):
     status = models.CharField("Status of the data source", max_length=128)  # Limit choices?
     theme = models.CharField("Theme", max_length=128, blank=True, default="")
     update_periodically = models.CharField("Update Periodically", max_length=128, blank=True, default="")  # boolean?
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = DataSourceManager()
+
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'])]
 
     def __str__(self):
         return self.name
 
+class DataSourceSuggestionManager(models.Manager):
+
+    def adjust(self, changes):
+        """
+        adjust
+
+        :changes: iterable - (field, value, delta) counts to add, empty values are ignored
+
+        :return: None
+        """
+        totals = Counter()
+        for field, value, delta in changes:
+            if value:
+                totals[(field, value)] += delta
+        totals = {k: v for k, v in totals.items() if v}
+        if not totals:
+            return
+        table = self.model._meta.db_table
+        values = ', '.join(['(%s, %s, %s)'] * len(totals))
+        params = [p for (field, value), delta in totals.items() for p in (field, value, delta)]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (field, value, count) VALUES {values} '
+                f'ON CONFLICT (field, value) DO UPDATE SET count = {table}.count + EXCLUDED.count',
+                params
+            )
+            if any(delta < 0 for delta in totals.values()):
+                self.filter(count__lte=0).delete()
+        bump_suggestions_version()
+
+    def rebuild(self):
+        """Recount every suggestible value, for use after bulk writes that skip signals."""
+        with transaction.atomic():
+            self.all().delete()
+            for field in DataSource.SUGGESTION_FIELDS:
+                rows = DataSource.objects.exclude(**{field: ''}).values(field).annotate(total=models.Count('pk'))
+                self.bulk_create([DataSourceSuggestion(field=field, value=r[field], count=r['total']) for r in rows])
+        bump_suggestions_version()
+
+    def suggest(self, field, text, limit=10):
+        return list(
+            self.filter(field=field, value__icontains=text)
+            .annotate(prefix=Case(When(value__istartswith=text, then=Value(0)), default=Value(1), output_field=IntegerField()))
+            .order_by('prefix', '-count', 'value')
+            .values_list('value', flat=True)[:limit]
+        )
+
+
+class DataSourceSuggestion(models.Model):
+    """Distinct value of a data source field and how many data sources use it."""
+
+    objects = DataSourceSuggestionManager()
+
+    field = models.CharField('Data source field', max_length=32)
+    value = models.CharField('Value of the field', max_length=1028)
+    count = models.IntegerField('Number of data sources with the value', default=0)
+
+    class Meta:
+        unique_together = ('field', 'value')
+
+    def __str__(self):
+        return f'{self.field}: {self.value}'
+
+@receiver(post_init, sender=DataSource)
+def remember_suggestions(sender, instance=None, **kwargs):
+    """Keep the suggestible values the data source was loaded with so saves can adjust their counts."""
+    instance._loaded_suggestions = {f: instance.__dict__.get(f) for f in DataSource.SUGGESTION_FIELDS} if instance.pk else {}
+
+def suggestion_changes(instance):
+    """
+    suggestion_changes
+
+    :instance: DataSource - data source that was just written
+
+    :return: list - (field, value, delta) suggestion counts to adjust since it was loaded
+    """
+    loaded = getattr(instance, '_loaded_suggestions', {})
+    current = {f: getattr(instance, f) for f in DataSource.SUGGESTION_FIELDS}
+    changed = [f for f in DataSource.SUGGESTION_FIELDS if loaded.get(f) != current[f]]
+    instance._loaded_suggestions = current
+    return [(f, loaded.get(f), -1) for f in changed] + [(f, current[f], 1) for f in changed]
+
+@receiver(post_save, sender=DataSource)
+def count_suggestions(sender, instance=None, **kwargs):
+    DataSourceSuggestion.objects.adjust(suggestion_changes(instance))
+
+@receiver(post_delete, sender=DataSource)
+def uncount_suggestions(sender, instance=None, **kwargs):
+    DataSourceSuggestion.objects.adjust((f, instance._loaded_suggestions.get(f), -1) for f in DataSource.SUGGESTION_FIELDS)
+
 class Note(models.Model):
     """Note to store ideas"""
+    SEARCH_FIELDS = (('note', 'A'),)
     
     note = models.TextField("Note Content", blank=True, default='')
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Name of creater")
     created_at = models.DateTimeField("Date note created", auto_now_add=True)
     data_source = models.ForeignKey(DataSource, on_delete=models.CASCADE)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'])]
 
     def __str__(self):
         return self.note[:256] # pylint: disable=unsubscriptable-object
 
 class Todo(models.Model):
     """Things to do"""
+    SEARCH_FIELDS = (('lead', 'A'), ('text', 'B'))
 
     lead = models.CharField("Title of todo", max_length=128, blank=True, default='')
     text = models.TextField("Note Content", blank=True, default='')
     complete = models.BooleanField("Status of the todo", default=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Name of creater")
     created_at = models.DateTimeField("Date note created", auto_now_add=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'])]
 
     def __str__(self):
         return self.lead
+
+@receiver(post_save, sender=DataSource)
+@receiver(post_save, sender=Note)
+@receiver(post_save, sender=Todo)
+def refresh_search_vector(sender, instance=None, update_fields=None, **kwargs):
+    """Keep the search vector in step with the searched fields."""
+    if update_fields is None or {field for field, _ in sender.SEARCH_FIELDS} & set(update_fields):
+        update_search_vectors(sender, [instance.pk])
@@ -6,6 +6,8 @@ action_map = {
     'update': 'change',
     'partial_update': 'change',
     'create': 'add',
+    'create_bulk': 'add',
+    'import_csv': 'add',
     'destroy': 'delete'
 }
 
@@ -0,0 +1,50 @@
+"""
+Full text search over data sources, notes and todos.
+
+Each searchable model declares SEARCH_FIELDS, (field, weight) pairs that are combined into its
+search_vector column. The column is refreshed whenever a row is saved and is GIN indexed, so
+searches are index lookups rather than ILIKE scans.
+"""
+from functools import reduce
+from operator import add
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F
+
+SEARCH_CONFIG = 'english'
+
+
+def build_vector(fields):
+    return reduce(add, (SearchVector(field, weight=weight, config=SEARCH_CONFIG) for field, weight in fields))
+
+
+def search_query(text):
+    return SearchQuery(text, config=SEARCH_CONFIG)
+
+
+def update_search_vectors(model, pks):
+    """
+    update_search_vectors
+
+    :model: Model - searchable model class
+    :pks: list - primary keys of the rows to refresh
+
+    :return: int - number of rows refreshed
+    """
+    return model.objects.filter(pk__in=pks).update(search_vector=build_vector(model.SEARCH_FIELDS))
+
+
+def search(queryset, text):
+    """
+    search
+
+    :queryset: QuerySet - rows of a searchable model
+    :text: str - user entered search terms
+
+    :return: QuerySet - matching rows annotated with rank, best match first
+    """
+    query = search_query(text)
+    return queryset \
+        .filter(search_vector=query) \
+        .annotate(rank=SearchRank(F('search_vector'), query)) \
+        .order_by('-rank', 'pk')
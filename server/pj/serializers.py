@@ -1,7 +1,7 @@
 from rest_framework import serializers
 
 from server.pj.models import File, Vendor, Stakeholder, DataSource, Note, Todo
-from server.auth.serializers import UserSerializer
+from server.auth.serializers import AuthorSerializer
 
 class StakeholderSerializer(serializers.ModelSerializer):
     pk = serializers.IntegerField(required=False) # Needed so pk can be passed from the client
@@ -59,9 +59,21 @@ class VendorSerializer(serializers.ModelSerializer):
 class VendorValidateSerializer(serializers.Serializer):
     code = serializers.CharField()
 
+class VendorCodeField(serializers.SlugRelatedField):
+    """Resolve vendors by upload code through the cached, case insensitive lookup."""
+
+    def __init__(self, **kwargs):
+        super().__init__(slug_field='code', queryset=Vendor.objects.all(), **kwargs)
+
+    def to_internal_value(self, data):
+        vendor = Vendor.objects.get_by_code(data)
+        if vendor is None:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=str(data))
+        return vendor
+
 class FileUploadSerializer(serializers.Serializer):
     file = serializers.ListField(child=serializers.FileField())
-    vendor_code = serializers.SlugRelatedField(slug_field='code__iexact', queryset=Vendor.objects.all(), source='vendor')
+    vendor_code = VendorCodeField(source='vendor')
     submitter = serializers.CharField(max_length=64)
 
 
@@ -79,6 +91,9 @@ class FileSerializer(serializers.ModelSerializer):
             'key',
             'url',
             'size',
+            'checksum',
+            'date_verified',
+            'compressed',
             'vendor',
             'vendor_short_name',
             'submitter',
@@ -90,9 +105,27 @@ class FileSerializer(serializers.ModelSerializer):
             'priority'
         )
         extra_kwargs = {'priority':{'required': False}} # Allows POSTing a file without a priority to default from the priority of the vendor
+        read_only_fields = ('checksum', 'date_verified', 'compressed')
+
+
+class FileStatsSerializer(serializers.Serializer):
+    period = serializers.DateTimeField()
+    vendor = serializers.CharField(source='vendor__name')
+    status = serializers.CharField()
+    file_count = serializers.IntegerField()
+    byte_count = serializers.IntegerField()
+    average_seconds = serializers.SerializerMethodField()
+
+    def get_average_seconds(self, obj):
+        # Average time from upload until the file reached this status, e.g. time-to-clean
+        if not obj['file_count']:
+            return None
+        return obj['total_duration'].total_seconds() / obj['file_count']
 
 
 class DataSourceSerializer(serializers.ModelSerializer):
+    note_count = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = DataSource
         fields = (
@@ -110,11 +143,12 @@ class DataSourceSerializer(serializers.ModelSerializer):
             'request_method',
             'theme',
             'status',
-            'update_periodically'
+            'update_periodically',
+            'note_count'
         )
 
 class NoteSerializer(serializers.ModelSerializer):
-    created_by = UserSerializer(read_only=True)
+    created_by = AuthorSerializer(read_only=True)
     data_source = serializers.PrimaryKeyRelatedField(queryset=DataSource.objects.all())
 
     class Meta:
@@ -128,7 +162,7 @@ class NoteSerializer(serializers.ModelSerializer):
         )
 
 class TodoSerializer(serializers.ModelSerializer):
-    created_by = UserSerializer(read_only=True)
+    created_by = AuthorSerializer(read_only=True)
 
     class Meta:
         model = Todo
@@ -1,10 +1,45 @@
 from enum import Enum, unique
+from datetime import datetime, timezone
+import base64
+import gzip
+import hashlib
 import os
+import shutil
+import sys
+import threading
 import urllib.parse
 
-import boto3
+from server.metrics import timed, STORAGE_SECONDS, STORAGE_BYTES
+
+_s3 = None
+_s3_lock = threading.Lock()
+
+CHUNK_SIZE = 1024 * 1024
+# boto3's multipart threshold, smaller uploads are sent with a single put carrying their MD5
+S3_PUT_MAX_SIZE = 8 * 1024 * 1024
+
+
+class ChecksumMismatch(Exception):
+    """Stored bytes do not match what was written or copied."""
+
+
+def get_s3():
+    """
+    get_s3
+
+    boto3 takes a few hundred milliseconds to import and build a resource, so this is deferred to
+    the first S3 operation and file:// deployments and short lived commands never pay for it.
+
+    :return: ServiceResource - shared S3 resource
+    """
+    global _s3
+    if _s3 is None:
+        with _s3_lock:
+            if _s3 is None:
+                import boto3
+                _s3 = boto3.resource('s3')
+    return _s3
 
-s3 = boto3.resource('s3')
 
 @unique
 class Scheme(Enum):
@@ -12,6 +47,29 @@ class Scheme(Enum):
     FILE = 'file'
 
 
+def gevent_patched():
+    # Only look at modules already loaded, gunicorn's gevent worker patches before the app is imported
+    monkey = sys.modules.get('gevent.monkey')
+    return bool(monkey and monkey.is_module_patched('socket'))
+
+
+def run_blocking(fn, *args, **kwargs):
+    """
+    run_blocking
+
+    Under gevent workers sockets (and so boto3) are cooperative but disk I/O still blocks the whole
+    worker, so local storage work is handed to gevent's thread pool. Otherwise this is a plain call.
+
+    :fn: callable - blocking function to run
+
+    :return: result of fn
+    """
+    if gevent_patched():
+        from gevent import get_hub
+        return get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
+
+
 def extract_s3(parsed):
     return parsed.netloc, parsed.path.lstrip('/')
 
@@ -25,89 +83,414 @@ def create_folders(location, vendor_name, choices):
     for status, _ in choices:
         if parsed.scheme == Scheme.S3.value:
             bucket, key = extract_s3(parsed)
-            obj = s3.Object(bucket, os.path.join(key, status, vendor_name, ''))
+            obj = get_s3().Object(bucket, os.path.join(key, status, vendor_name, ''))
             obj.put()
         elif parsed.scheme == Scheme.FILE.value:
-            os.makedirs(os.path.join(parsed.path, status, vendor_name, ''), exist_ok=True)
+            run_blocking(os.makedirs, os.path.join(parsed.path, status, vendor_name, ''), exist_ok=True)
         else:
             raise Exception(f'Unknown scheme for create folders: {parsed.scheme}')
 
 
+class ChecksumReader:
+    """
+    Read through a file object while hashing it, so uploads are checksummed as they stream.
+
+    Readers may seek back and read again, as boto3 does when retrying, so only bytes past the furthest
+    position read are hashed. A forward seek leaves a gap and the digest is then recomputed from the start.
+    """
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.sha256 = hashlib.sha256()
+        self.md5 = hashlib.md5()
+        self.position = 0
+        self.hashed = 0
+        self.gap = False
+
+    def read(self, size=-1):
+        data = self.file_obj.read(size)
+        start, self.position = self.position, self.position + len(data)
+        if start > self.hashed:
+            self.gap = True
+        elif self.position > self.hashed:
+            new = data[self.hashed - start:]
+            self.sha256.update(new)
+            self.md5.update(new)
+            self.hashed = self.position
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.file_obj.seek(offset, whence)
+        self.position = self.file_obj.tell()
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def seekable(self):
+        return getattr(self.file_obj, 'seekable', lambda: False)()
+
+    def digests(self):
+        """
+        digests
+
+        :return: tuple - (sha256 hex digest, md5 hex digest, size) of everything read
+        """
+        if self.gap:
+            self.seek(0)
+            self.sha256, self.md5, self.hashed, self.gap = hashlib.sha256(), hashlib.md5(), 0, False
+            while self.read(CHUNK_SIZE):
+                pass
+        return self.sha256.hexdigest(), self.md5.hexdigest(), self.hashed
+
+
 def upload(url, file_obj):
+    """
+    upload
+
+    Stream file_obj to url, hashing it on the way, then check the stored object has the size read
+    (and on S3 the MD5, which small uploads also send for S3 to check).
+
+    :url: str - where to store the object
+    :file_obj: file - contents
+
+    :return: str - sha256 hex digest of the contents
+    """
+    reader = ChecksumReader(file_obj)
+    with timed(STORAGE_SECONDS, op='upload'):
+        _upload(url, reader)
+    sha256, _, size = reader.digests()
+    STORAGE_BYTES.labels(op='upload').inc(size)
+    return sha256
+
+
+def _upload(url, reader):
     parsed = urllib.parse.urlparse(url)
 
     if parsed.scheme == Scheme.S3.value:
         bucket, key = extract_s3(parsed)
-        s3_upload(bucket, key, file_obj)
+        s3_upload(bucket, key, reader)
     elif parsed.scheme == Scheme.FILE.value:
-        file_name = extract_file(parsed)
-        os.makedirs(os.path.dirname(file_name), exist_ok=True)
-        with open(file_name, 'wb') as new_file:
-            new_file.write(file_obj.read())
+        run_blocking(file_upload, extract_file(parsed), reader)
     else:
         raise Exception(f'Unknown scheme for file upload: {parsed.scheme}')
 
 
-def s3_upload(bucket, key, file_obj):
-    obj = s3.Object(bucket, key)
-    obj.upload_fileobj(file_obj)
+def file_upload(file_name, reader):
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, 'wb') as new_file:
+        # Copy in chunks rather than reading whole uploads into memory
+        shutil.copyfileobj(reader, new_file)
+    _, _, size = reader.digests()
+    stored = os.stat(file_name).st_size
+    if stored != size:
+        raise ChecksumMismatch(f'Stored {stored} of {size} bytes to {file_name}')
+
+
+def s3_upload(bucket, key, reader):
+    obj = get_s3().Object(bucket, key)
+    if reader.seekable() and _remaining(reader) <= S3_PUT_MAX_SIZE:
+        body = reader.read()
+        _, md5, _ = reader.digests()
+        # S3 rejects the put if the bytes it received do not match, whatever the bucket's encryption
+        obj.put(Body=body, ContentMD5=base64.b64encode(bytes.fromhex(md5)).decode())
+    else:
+        obj.upload_fileobj(reader)
+    _, md5, size = reader.digests()
+    # Served from the upload response would be free, but upload_fileobj does not return it
+    obj.load()
+    verify_s3(f's3://{bucket}/{key}', obj, size, md5)
+
+
+def _remaining(file_obj):
+    position = file_obj.tell()
+    end = file_obj.seek(0, os.SEEK_END)
+    file_obj.seek(position)
+    return end - position
+
+
+def s3_etag(obj):
+    return obj.e_tag.strip('"')
+
+
+def s3_etag_is_md5(obj):
+    """
+    s3_etag_is_md5
+
+    The ETag of an object is the MD5 of its contents unless it was uploaded in parts or encrypted with
+    SSE-KMS or SSE-C.
+
+    :obj: Object - loaded S3 object
+
+    :return: bool - whether the ETag can be compared to an MD5
+    """
+    encryption = obj.server_side_encryption or ''
+    return '-' not in s3_etag(obj) and not encryption.startswith('aws:kms') and not obj.sse_customer_algorithm
+
+
+def verify_s3(url, obj, size, md5=None):
+    """
+    verify_s3
+
+    :url: str - object url for the error message
+    :obj: Object - loaded S3 object
+    :size: int - expected size in bytes
+    :md5: str - expected MD5 hex digest, only compared when the object's ETag is its MD5
+
+    :return: None
+    """
+    if obj.content_length != size:
+        raise ChecksumMismatch(f'{url} has {obj.content_length} bytes, expected {size}')
+    stored = s3_etag(obj)
+    if md5 and s3_etag_is_md5(obj) and stored != md5:
+        raise ChecksumMismatch(f'{url} has ETag {stored}, expected {md5}')
 
 
 def move(old_url, new_url):
+    with timed(STORAGE_SECONDS, op='move'):
+        _transfer(old_url, new_url, s3_move, file_move)
+
+
+def copy(old_url, new_url):
+    """Copy an object, leaving the original in place, e.g. until a database update pointing at the copy commits."""
+    with timed(STORAGE_SECONDS, op='copy'):
+        _transfer(old_url, new_url, s3_copy, file_copy)
+
+
+def _transfer(old_url, new_url, s3_transfer, file_transfer):
     old_parsed = urllib.parse.urlparse(old_url)
     new_parsed = urllib.parse.urlparse(new_url)
 
     if old_parsed.scheme == Scheme.S3.value and new_parsed.scheme == Scheme.S3.value:
         old_bucket, old_key = extract_s3(old_parsed)
         new_bucket, new_key = extract_s3(new_parsed)
-        s3_move(old_bucket, old_key, new_bucket, new_key)
+        s3_transfer(old_bucket, old_key, new_bucket, new_key)
     elif old_parsed.scheme == Scheme.FILE.value and new_parsed.scheme == Scheme.FILE.value:
-        new_filename = extract_file(new_parsed)
-        os.makedirs(os.path.dirname(new_filename), exist_ok=True)
-        os.rename(extract_file(old_parsed), new_filename)
+        run_blocking(file_transfer, extract_file(old_parsed), extract_file(new_parsed))
     else:
         raise Exception(
-            f'Unknown scheme for file move: {(old_parsed.scheme, new_parsed.scheme)}')
+            f'Unknown scheme for file transfer: {(old_parsed.scheme, new_parsed.scheme)}')
+
+
+def file_move(old_filename, new_filename):
+    os.makedirs(os.path.dirname(new_filename), exist_ok=True)
+    size = os.stat(old_filename).st_size
+    os.rename(old_filename, new_filename)
+    stored = os.stat(new_filename).st_size
+    if stored != size:
+        raise ChecksumMismatch(f'Moved {stored} of {size} bytes to {new_filename}')
+
+
+def file_copy(old_filename, new_filename):
+    os.makedirs(os.path.dirname(new_filename), exist_ok=True)
+    size = os.stat(old_filename).st_size
+    # Left over from an interrupted copy
+    if os.path.exists(new_filename):
+        os.remove(new_filename)
+    try:
+        # A hard link copies nothing when both paths are on one file system
+        os.link(old_filename, new_filename)
+    except OSError:
+        shutil.copyfile(old_filename, new_filename)
+    stored = os.stat(new_filename).st_size
+    if stored != size:
+        raise ChecksumMismatch(f'Copied {stored} of {size} bytes to {new_filename}')
+
+
+def s3_copy(old_bucket, old_key, new_bucket, new_key):
+    source = get_s3().Object(old_bucket, old_key)
+    source.load()
+    target = get_s3().Object(new_bucket, new_key)
+    target.copy({'Bucket': old_bucket, 'Key': old_key})
+    target.load()
+    md5 = s3_etag(source) if s3_etag_is_md5(source) else None
+    verify_s3(f's3://{new_bucket}/{new_key}', target, source.content_length, md5)
+    return source
 
 
 def s3_move(old_bucket, old_key, new_bucket, new_key):
-    s3.Object(new_bucket, new_key).copy({'Bucket': old_bucket, 'Key': old_key})
-    s3.Object(old_bucket, old_key).delete()
+    # The source is only deleted once the copy is known to be complete
+    s3_copy(old_bucket, old_key, new_bucket, new_key).delete()
 
 
 def delete(url):
+    with timed(STORAGE_SECONDS, op='delete'):
+        _delete(url)
+
+
+def _delete(url):
     parsed = urllib.parse.urlparse(url)
 
     if parsed.scheme == Scheme.S3.value:
         bucket, key = extract_s3(parsed)
         s3_delete(bucket, key)
     elif parsed.scheme == Scheme.FILE.value:
-        filepath = extract_file(parsed)
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        else:
-            raise Exception(f'Could not find local file to delete: {filepath}')
+        run_blocking(file_delete, extract_file(parsed))
     else:
         raise Exception(f'Unknown scheme for file delete: {parsed.scheme}')
 
 
+def file_delete(filepath):
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    else:
+        raise Exception(f'Could not find local file to delete: {filepath}')
+
+
 def s3_delete(bucket, key):
-    obj = s3.Object(bucket, key)
+    obj = get_s3().Object(bucket, key)
     obj.delete()
 
+def exists(url):
+    parsed = urllib.parse.urlparse(url)
+
+    if parsed.scheme == Scheme.S3.value:
+        bucket, key = extract_s3(parsed)
+        from botocore.exceptions import ClientError
+        try:
+            get_s3().Object(bucket, key).load()
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+    if parsed.scheme == Scheme.FILE.value:
+        return run_blocking(os.path.exists, extract_file(parsed))
+
+    raise Exception(f'Unknown scheme for file exists: {parsed.scheme}')
+
+
 def retrieve(url):
+    with timed(STORAGE_SECONDS, op='retrieve'):
+        return _retrieve(url)
+
+
+def _retrieve(url):
     parsed = urllib.parse.urlparse(url)
 
     if parsed.scheme == Scheme.S3.value:
         bucket, key = extract_s3(parsed)
-        obj = s3.Object(bucket, key)
+        obj = get_s3().Object(bucket, key)
         data = obj.get()
         return data['Body']
 
     if parsed.scheme == Scheme.FILE.value:
-        filepath = extract_file(parsed)
-        if os.path.exists(filepath):
-            return open(filepath, 'rb')
-        raise Exception(f'Could not find local file to retrieve: {filepath}')
+        return run_blocking(file_retrieve, extract_file(parsed))
 
     raise Exception(f'Unknown scheme for file retrieve: {parsed.scheme}')
+
+
+def file_retrieve(filepath):
+    if os.path.exists(filepath):
+        stream = open(filepath, 'rb')
+        return BlockingReader(stream) if gevent_patched() else stream
+    raise Exception(f'Could not find local file to retrieve: {filepath}')
+
+
+class BlockingReader:
+    """Local file whose reads, like other disk I/O, run off the gevent hub so downloads do not stall the worker."""
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+
+    def read(self, size=-1):
+        return run_blocking(self.file_obj.read, size)
+
+    def close(self):
+        run_blocking(self.file_obj.close)
+
+    def __getattr__(self, name):
+        return getattr(self.file_obj, name)
+
+
+class GzipReader:
+    """
+    Decompress a gzipped stream as it is read, closing the stream with it.
+
+    It is deliberately not seekable and has no name, so responses do not rewind it or size it by the compressed object.
+    """
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.gzip_file = gzip.GzipFile(fileobj=file_obj, mode='rb')
+
+    def read(self, size=-1):
+        return self.gzip_file.read(size)
+
+    def close(self):
+        try:
+            self.gzip_file.close()
+        finally:
+            self.file_obj.close()
+
+
+def list_prefixes(url):
+    """
+    list_prefixes
+
+    :url: str - location to list the immediate "folders" of
+
+    :return: list - sorted names of the folders directly under url
+    """
+    parsed = urllib.parse.urlparse(url)
+
+    if parsed.scheme == Scheme.S3.value:
+        bucket, key = extract_s3(parsed)
+        paginator = get_s3().meta.client.get_paginator('list_objects_v2')
+        prefix = os.path.join(key, '')
+        return sorted(
+            p['Prefix'][len(prefix):].rstrip('/')
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/')
+            for p in page.get('CommonPrefixes', [])
+        )
+    if parsed.scheme == Scheme.FILE.value:
+        path = extract_file(parsed)
+        if not os.path.isdir(path):
+            return []
+        with os.scandir(path) as entries:
+            return sorted(e.name for e in entries if e.is_dir())
+
+    raise Exception(f'Unknown scheme for prefix listing: {parsed.scheme}')
+
+
+def walk(url):
+    """
+    walk
+
+    Stream every object below url in byte order of their keys, the order S3 lists in, without
+    holding the listing in memory.
+
+    :url: str - location to list
+
+    :return: generator - (relative key, size, last modified datetime) for each object
+    """
+    parsed = urllib.parse.urlparse(url)
+
+    if parsed.scheme == Scheme.S3.value:
+        bucket, key = extract_s3(parsed)
+        paginator = get_s3().meta.client.get_paginator('list_objects_v2')
+        prefix = os.path.join(key, '')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                # Skip the placeholder objects create_folders makes
+                if not obj['Key'].endswith('/'):
+                    yield obj['Key'][len(prefix):], obj['Size'], obj['LastModified']
+    elif parsed.scheme == Scheme.FILE.value:
+        yield from file_walk(extract_file(parsed))
+    else:
+        raise Exception(f'Unknown scheme for walk: {parsed.scheme}')
+
+
+def file_walk(path, relative=''):
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except FileNotFoundError:
+        return
+    # Directories sort as "name/" so the output matches a flat listing of full keys
+    for entry in sorted(entries, key=lambda e: e.name + '/' if e.is_dir() else e.name):
+        if entry.is_dir():
+            yield from file_walk(entry.path, f'{relative}{entry.name}/')
+        else:
+            stat = entry.stat()
+            yield f'{relative}{entry.name}', stat.st_size, datetime.fromtimestamp(stat.st_mtime, timezone.utc)
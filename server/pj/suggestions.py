@@ -0,0 +1,82 @@
+"""
+Typeahead suggestions for data source fields.
+
+Distinct values of each suggestible field are kept with their counts in DataSourceSuggestion as data
+sources are written, so lookups scan a small table instead of every data source. Results are also
+kept in a per process LRU cache that is invalidated through a version in the shared cache. Entries also
+expire after SUGGESTION_CACHE_TIMEOUT seconds, which bounds staleness when the cache is not shared.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+SUGGESTIONS_VERSION_KEY = 'pj:suggestions:version'
+
+
+def get_suggestions_version():
+    version = cache.get(SUGGESTIONS_VERSION_KEY)
+    if version is None:
+        # Start from the clock so a lost version key never revives stale entries
+        cache.add(SUGGESTIONS_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(SUGGESTIONS_VERSION_KEY)
+    return version
+
+
+def bump_suggestions_version():
+    try:
+        cache.incr(SUGGESTIONS_VERSION_KEY)
+    except ValueError:
+        get_suggestions_version()
+
+
+class LRUCache:
+    """Thread safe mapping that evicts the least recently used entry beyond maxsize and entries older than timeout."""
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self.lock:
+            if key in self.entries:
+                value, expires = self.entries[key]
+                if expires > now:
+                    self.entries.move_to_end(key)
+                    return value
+                del self.entries[key]
+        value = loader()
+        with self.lock:
+            self.entries[key] = (value, now + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+suggestion_cache = LRUCache(settings.SUGGESTION_CACHE_SIZE, settings.SUGGESTION_CACHE_TIMEOUT)
+
+
+def suggest(field, text, limit=10):
+    """
+    suggest
+
+    :field: str - one of DataSource.SUGGESTION_FIELDS
+    :text: str - text the user has typed so far
+    :limit: int - maximum number of suggestions
+
+    :return: list - values containing text, those starting with it and the most used first
+    """
+    from server.pj.models import DataSourceSuggestion
+    text = text.strip().lower()
+    key = (get_suggestions_version(), field, text, limit)
+    return suggestion_cache.get(key, lambda: DataSourceSuggestion.objects.suggest(field, text, limit))
@@ -0,0 +1,22 @@
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from server.middleware import get_query_budget
+
+
+class QueryBudgetTestMixin:
+    """Assertions that view actions stay within the query_budgets they declare."""
+
+    @contextmanager
+    def assertQueryBudget(self, view_cls, action):
+        budget = get_query_budget(view_cls, action)
+        self.assertIsNotNone(budget, f'{view_cls.__name__}.{action} does not declare a query budget')
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        self.assertLessEqual(
+            len(context), budget,
+            f'{view_cls.__name__}.{action} made {len(context)} queries, over its budget of {budget}:\n' +
+            '\n'.join(query['sql'] for query in context.captured_queries)
+        )
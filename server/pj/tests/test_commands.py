@@ -0,0 +1,576 @@
+"""Tests for the pj management commands"""
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from datetime import timedelta
+from unittest.mock import patch
+from urllib.parse import urlparse
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import ValidationError
+from django.db import connection, migrations, models, transaction, IntegrityError
+from django.db.migrations import Migration
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from server.auth.models import User
+from server.pj.management.commands.import_files import Command as ImportCommand
+from server.pj.management.commands.partition_files import guard_partitioned_migrations
+from server.pj.management.commands.reconcile import Command as ReconcileCommand
+from server.pj.management.commands.verify_files import Command as VerifyCommand
+from server.pj.models import File, FilenameCounter, FileStatusRollup, FileTransition, Vendor, RetentionPolicy
+
+
+class FileSeedTestCase(TestCase):
+    """Test case for the bulk file seeding mode."""
+
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.upload_dir)
+
+    def seed(self, *args, **options):
+        with redirect_stdout(io.StringIO()), override_settings(UPLOAD_LOCATION=f'file://{self.upload_dir}'):
+            call_command('file_seed', *args, bulk=True, **options)
+
+    def test_bulk_mixed(self):
+        """Test bulk seeding spreads files over vendors and versions duplicate names."""
+        self.seed('mixed', 200, vendors=3, duplicates=0.5, batch_size=50)
+        self.assertEqual(File.objects.count(), 200)
+        self.assertEqual(File.objects.values('vendor').distinct().count(), 3)
+        self.assertEqual(File.objects.values('name').distinct().count(), 200)
+        for vendor in Vendor.objects.all():
+            vendor.full_clean()
+        # Rolled up for the stats like uploaded files
+        totals = FileStatusRollup.objects.aggregate(files=Sum('file_count'), bytes=Sum('byte_count'))
+        self.assertEqual(totals, {'files': 200, 'bytes': File.objects.aggregate(Sum('size'))['size__sum']})
+
+        counter = FilenameCounter.objects.first()
+        self.assertIsNotNone(counter)
+        versioned = File.objects._build_name(counter.file.name, counter.count)
+        self.assertTrue(File.objects.filter(name=versioned).exists())
+
+    def test_bulk_sparse_storage(self):
+        """Test sparse storage objects match the recorded sizes."""
+        self.seed(File.CLEAN, 10, vendors=1, storage='sparse')
+        for f in File.objects.filter(status=File.CLEAN):
+            self.assertEqual(os.path.getsize(urlparse(f.get_url()).path), f.size)
+
+
+class ImportFilesTestCase(TestCase):
+    """Test case for importing existing storage objects."""
+
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+        self.vendor = Vendor.objects.create(name='DummyVendor', code='abc123', short_name='dv', priority=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.upload_dir)
+
+    def write(self, path, data=b'data'):
+        path = os.path.join(self.upload_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def run_import(self, **options):
+        with redirect_stdout(io.StringIO()) as output:
+            call_command('import_files', location=f'file://{self.upload_dir}', batch_size=2, **options)
+        return output.getvalue()
+
+    def test_import(self):
+        """Test objects are registered with their status, vendor and submitter and imports are repeatable."""
+        self.write('clean/dv/Bob/a.txt', b'12345')
+        self.write('clean/dv/Bob/b.txt')
+        self.write('approved/dv/Alice/c.txt')
+        self.write('approved/dv/not_a_submitter.txt')
+        self.write('approved/unknown/Alice/d.txt')
+
+        output = self.run_import()
+        self.assertIn('Listed 4 object(s), skipped 1, inserted 3 file(s).', output)
+        f = File.objects.get(key='dv/Bob/a.txt')
+        self.assertEqual((f.name, f.status, f.size, f.vendor, f.submitter, f.priority), ('a.txt', File.CLEAN, 5, self.vendor, 'Bob', 3))
+        self.assertEqual(f.get_url(), f'file://{self.upload_dir}/clean/dv/Bob/a.txt')
+        self.assertEqual(File.objects.get(key='dv/Alice/c.txt').status, File.APPROVED)
+
+        self.assertIn('inserted 0 file(s)', self.run_import())
+        self.assertEqual(File.objects.count(), 3)
+
+    def test_duplicate_names(self):
+        """Test taken names are versioned like repeated uploads, so name lookups and later uploads keep working."""
+        existing = File.objects.create(
+            name='a.txt', location='', key='dv/Carol/a.txt', size=1, vendor=self.vendor, submitter='Carol', priority=3
+        )
+        self.write('clean/dv/Alice/a.txt')
+        self.write('clean/dv/Bob/a.txt')
+        self.write('approved/dv/Dave/a.txt')
+        self.write('approved/dv/Bob/b.txt')
+        self.write('clean/dv/Eve/b.txt')
+
+        self.assertIn('Renamed 4 file(s)', self.run_import())
+        names = sorted(File.objects.values_list('name', flat=True))
+        self.assertEqual(names, ['a.txt', 'a_2.txt', 'a_3.txt', 'a_4.txt', 'b.txt', 'b_2.txt'])
+        existing.refresh_from_db()
+        self.assertEqual(existing.counter.count, 4)
+        self.assertEqual(File.objects.get(name='b.txt').counter.count, 2)
+        self.assertEqual(File.objects._get_next_filename('a.txt'), 'a_5.txt')
+        self.assertEqual(File.objects._get_next_filename('b.txt'), 'b_3.txt')
+
+    def test_version_queries(self):
+        """Test taken names are versioned with a few queries per batch, not one per row."""
+        for name in ('a.txt', 'a_3.txt'):
+            File.objects.create(
+                name=name, location='', key=f'dv/Carol/{name}', size=1, vendor=self.vendor, submitter='Carol', priority=3
+            )
+        rows = [
+            ('a.txt', '', f'dv/Bob{i}/a.txt', 1, self.vendor.pk, f'Bob{i}', File.CLEAN, 3, timezone.now().isoformat())
+            for i in range(10)
+        ]
+        command = ImportCommand()
+        command.counts = {'renamed': 0}
+        with self.assertNumQueries(5):
+            rows, versioned = command._version_names(rows)
+        self.assertEqual(sorted(r[0] for r in rows), sorted(f'a_{i}.txt' for i in (2, *range(4, 13))))
+        self.assertEqual(versioned, {'a.txt': 12})
+
+    def test_locks_names(self):
+        """Test imported names are locked like uploads, so both cannot claim the same version."""
+        self.write('clean/dv/Bob/b.txt')
+        self.write('clean/dv/Bob/a.txt')
+        with patch.object(File.objects, '_lock_names', wraps=File.objects._lock_names) as lock:
+            self.run_import()
+        self.assertEqual(sorted(name for call in lock.call_args_list for name in call[0][0]), ['a.txt', 'b.txt'])
+
+    def test_dry_run(self):
+        self.write('clean/dv/Bob/a.txt')
+        self.assertIn('Listed 1 object(s), skipped 0, inserted 0 file(s).', self.run_import(dry_run=True))
+        self.assertEqual(File.objects.count(), 0)
+
+
+class ReconcileTestCase(TestCase):
+    """Test case for reconciling storage with the file table."""
+
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+        self.location = f'file://{self.upload_dir}'
+        self.vendor = Vendor.objects.create(name='DummyVendor', code='abc123', short_name='dv', priority=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.upload_dir)
+
+    def create_file(self, name, status, stored_as=()):
+        for stored_status in stored_as:
+            path = os.path.join(self.upload_dir, stored_status, 'dv', 'Bob', name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'wb').close()
+        if status:
+            return File.objects.create(
+                name=name, location=self.location, key=f'dv/Bob/{name}', size=0,
+                vendor=self.vendor, submitter='Bob', priority=3, status=status
+            )
+
+    def reconcile(self, **options):
+        with redirect_stdout(io.StringIO()) as output:
+            call_command('reconcile', location=self.location, workers=1, **options)
+        return output.getvalue()
+
+    def test_report(self):
+        """Test each kind of discrepancy is reported."""
+        self.create_file('a.txt', File.CLEAN, [File.CLEAN])
+        self.create_file('b.txt', None, [File.APPROVED])
+        self.create_file('c.txt', File.CLEAN, [])
+        self.create_file('d.txt', File.CLEAN, [File.APPROVED])
+        self.create_file('e.txt', File.CLEAN, [File.CLEAN, File.APPROVED])
+
+        output = self.reconcile()
+        self.assertIn(f'orphan {self.location}/approved/dv/Bob/b.txt', output)
+        self.assertIn('missing dv/Bob/c.txt (clean)', output)
+        self.assertIn('mismatch dv/Bob/d.txt (clean) stored as approved', output)
+        self.assertIn('duplicate dv/Bob/e.txt (clean) stored as approved, clean', output)
+        self.assertIn('Found 1 orphan(s), 1 missing, 1 mismatch(es), 1 duplicate(s).', output)
+        self.assertEqual(File.objects.count(), 4)
+
+    def test_repair(self):
+        """Test repairs follow storage and only delete orphans when asked."""
+        self.create_file('b.txt', None, [File.APPROVED])
+        self.create_file('c.txt', File.CLEAN, [])
+        self.create_file('d.txt', File.CLEAN, [File.APPROVED])
+
+        self.reconcile(repair=True, min_age=0)
+        self.assertFalse(File.objects.filter(name='c.txt').exists())
+        self.assertEqual(File.objects.get(name='d.txt').status, File.APPROVED)
+        self.assertTrue(os.path.exists(os.path.join(self.upload_dir, 'approved/dv/Bob/b.txt')))
+
+        self.reconcile(delete_orphans=True)
+        self.assertFalse(os.path.exists(os.path.join(self.upload_dir, 'approved/dv/Bob/b.txt')))
+        self.assertIn('Found 0 orphan(s), 0 missing, 0 mismatch(es), 0 duplicate(s).', self.reconcile())
+
+
+    def test_repair_skips_files_in_flight(self):
+        """Test recent uploads and files being moved are not deleted or repaired."""
+        recent = self.create_file('a.txt', File.CLEAN, [])
+        moving = self.create_file('b.txt', File.CLEAN, [])
+        FileTransition.objects.create(file=moving, origin=File.CLEAN, target=File.APPROVED)
+        moved = self.create_file('c.txt', File.CLEAN, [File.APPROVED])
+        FileTransition.objects.create(file=moved, origin=File.CLEAN, target=File.APPROVED)
+
+        self.reconcile(repair=True)
+        self.assertTrue(File.objects.filter(pk=recent.pk).exists())
+        self.reconcile(repair=True, min_age=0)
+        self.assertFalse(File.objects.filter(pk=recent.pk).exists())
+        self.assertTrue(File.objects.filter(pk=moving.pk).exists())
+        self.assertEqual(File.objects.get(pk=moved.pk).status, File.CLEAN)
+
+    def test_repair_rechecks_missing(self):
+        """Test a file whose object appears after the listing is kept."""
+        f = self.create_file('a.txt', File.CLEAN, [])
+        with patch('server.pj.store.exists', return_value=True):
+            self.reconcile(repair=True, min_age=0)
+        self.assertTrue(File.objects.filter(pk=f.pk).exists())
+
+    def test_repair_rechecks_status(self):
+        """Test a status repair does not undo a transition that completed after the listing."""
+        f = self.create_file('a.txt', File.CLEAN, [File.APPROVED])
+        files = ReconcileCommand._files
+
+        def list_then_transition(command, location, vendor):
+            rows = list(files(command, location, vendor))
+            File.objects.filter(pk=f.pk).update(status=File.REJECTED)
+            return iter(rows)
+
+        with patch.object(ReconcileCommand, '_files', list_then_transition):
+            self.reconcile(repair=True)
+        self.assertEqual(File.objects.get(pk=f.pk).status, File.REJECTED)
+
+        # Nor one whose object was moved back to the row's status
+        File.objects.filter(pk=f.pk).update(status=File.CLEAN)
+        with patch('server.pj.store.exists', return_value=True):
+            self.reconcile(repair=True)
+        self.assertEqual(File.objects.get(pk=f.pk).status, File.CLEAN)
+
+    def test_detached_partitions_are_not_orphans(self):
+        """Test objects of rows in detached partitions are kept."""
+        f = self.create_file('a.txt', File.CLEAN, [File.CLEAN])
+        File.objects.filter(pk=f.pk).update(date_uploaded=timezone.now() - timedelta(days=800))
+        with redirect_stdout(io.StringIO()):
+            call_command('partition_files', 'convert', months_ahead=1)
+            call_command('partition_files', 'detach', before=timezone.now().date().replace(day=1) - timedelta(days=400))
+        self.assertFalse(File.objects.filter(pk=f.pk).exists())
+
+        self.assertIn('Found 1 orphan(s)', self.reconcile(delete_orphans=True))
+        self.assertTrue(os.path.exists(os.path.join(self.upload_dir, File.CLEAN, f.key)))
+
+class PartitionFilesTestCase(TestCase):
+    """Test case for partitioning the file table by upload month."""
+
+    def setUp(self):
+        self.vendor = Vendor.objects.create(name='DummyVendor', code='abc123', short_name='dv', priority=3)
+        self.old = self.create_file('old.txt')
+        File.objects.filter(pk=self.old.pk).update(date_uploaded=timezone.now() - timedelta(days=800))
+        self.new = self.create_file('new.txt')
+
+    def create_file(self, name):
+        return File.objects.create(
+            name=name, key=f'dv/Bob/{name}', size=0, vendor=self.vendor, submitter='Bob', priority=3
+        )
+
+    def partitions(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'pj_file'::regclass")
+            return sorted(name for name, in cursor.fetchall())
+
+    def test_convert_and_detach(self):
+        with redirect_stdout(io.StringIO()):
+            call_command('partition_files', 'convert', months_ahead=1)
+        partitions = self.partitions()
+        self.assertIn('pj_file_default', partitions)
+        old = File.objects.get(pk=self.old.pk).date_uploaded
+        for month in (old, timezone.now()):
+            self.assertIn(f'pj_file_y{month.year}m{month.month:02}', partitions)
+        self.assertEqual(File.objects.count(), 2)
+
+        # The table keeps working for new files, transitions and deletes
+        f = self.create_file('another.txt')
+        f.status = File.CLEAN
+        f.save()
+        f.delete()
+
+        with redirect_stdout(io.StringIO()):
+            call_command('partition_files', 'detach', before=timezone.now().date().replace(day=1) - timedelta(days=400), drop=True)
+        self.assertEqual(list(File.objects.values_list('name', flat=True)), ['new.txt'])
+
+        with self.assertRaises(CommandError):
+            call_command('partition_files', 'convert')
+
+    def test_create_moves_default_rows(self):
+        """Test a partition is created even when the default partition already holds rows of its month."""
+        with redirect_stdout(io.StringIO()):
+            call_command('partition_files', 'convert', months_ahead=1)
+        future = self.create_file('future.txt')
+        File.objects.filter(pk=future.pk).update(date_uploaded=timezone.now() + timedelta(days=120))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM pj_file_default')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+        with redirect_stdout(io.StringIO()) as output:
+            call_command('partition_files', 'create', months_ahead=6)
+        self.assertIn('Moved 1 file(s) from pj_file_default', output.getvalue())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM pj_file WHERE id = %s', [future.pk])
+            month = File.objects.get(pk=future.pk).date_uploaded
+            self.assertEqual(cursor.fetchone()[0], f'pj_file_y{month.year}m{month.month:02}')
+
+    def test_guards_migrations(self):
+        """Test migrations changing the rebuilt keys and constraints are refused once partitioned."""
+        key = Migration('0099_key', 'pj')
+        key.operations = [migrations.AlterField('file', 'key', models.CharField(max_length=2048, unique=True))]
+        column = Migration('0099_column', 'pj')
+        column.operations = [migrations.AddField('file', 'extra', models.IntegerField(null=True))]
+        config = apps.get_app_config('pj')
+
+        guard_partitioned_migrations(config, plan=[(key, False)])
+        with redirect_stdout(io.StringIO()):
+            call_command('partition_files', 'convert', months_ahead=1)
+        guard_partitioned_migrations(config, plan=[(column, False)])
+        with self.assertRaises(CommandError):
+            guard_partitioned_migrations(config, plan=[(column, False), (key, False)])
+
+    def test_requires_partitioned(self):
+        with self.assertRaises(CommandError):
+            call_command('partition_files', 'create')
+
+
+class ApplyRetentionTestCase(TestCase):
+    """Test case for the retention policies."""
+
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+        self.archive_dir = tempfile.mkdtemp()
+        self.location = f'file://{self.upload_dir}'
+        self.archive = f'file://{self.archive_dir}'
+        self.vendor = Vendor.objects.create(name='DummyVendor', code='abc123', short_name='dv', priority=3)
+        self.other = Vendor.objects.create(name='OtherVendor', code='def456', short_name='ov', priority=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.upload_dir)
+        shutil.rmtree(self.archive_dir)
+
+    def create_file(self, name, vendor, status=File.TRANSFERRED, days=100):
+        f = File.objects.create(
+            name=name, location=self.location, key=f'{vendor.short_name}/Bob/{name}', size=11,
+            vendor=vendor, submitter='Bob', priority=3, status=status
+        )
+        File.objects.filter(pk=f.pk).update(date_uploaded=timezone.now() - timedelta(days=days))
+        path = urlparse(f.get_url()).path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as data:
+            data.write(b'hello world')
+        return File.objects.get(pk=f.pk)
+
+    def apply(self, **options):
+        with redirect_stdout(io.StringIO()) as output:
+            call_command('apply_retention', batch_size=2, workers=2, **options)
+        return output.getvalue()
+
+    def test_archive(self):
+        """Test old files are moved and compressed, recent files and other statuses are left alone."""
+        RetentionPolicy.objects.create(status=File.TRANSFERRED, days=30, archive_location=self.archive, compress=True)
+        old = [self.create_file(f'{i}.txt', self.vendor) for i in range(3)]
+        recent = self.create_file('recent.txt', self.vendor, days=1)
+        rejected = self.create_file('rejected.txt', self.vendor, status=File.REJECTED)
+
+        self.assertIn('3 file(s) done, 0 failed', self.apply())
+        for f in old:
+            f.refresh_from_db()
+            self.assertEqual((f.location, f.key), (self.archive, f'dv/Bob/{f.name}.gz'))
+            with gzip.open(urlparse(f.get_url()).path) as data:
+                self.assertEqual(data.read(), b'hello world')
+        for f in (recent, rejected):
+            self.assertEqual(File.objects.get(pk=f.pk).location, self.location)
+        self.assertIn('0 file(s) done', self.apply())
+
+    def test_vendor_policy(self):
+        """Test a vendor's own policy overrides the policy for every vendor."""
+        RetentionPolicy.objects.create(status=File.REJECTED, days=30, action=RetentionPolicy.DELETE)
+        RetentionPolicy.objects.create(vendor=self.other, status=File.REJECTED, days=365, action=RetentionPolicy.DELETE)
+        deleted = self.create_file('a.txt', self.vendor, status=File.REJECTED)
+        kept = self.create_file('b.txt', self.other, status=File.REJECTED)
+
+        self.assertIn('1 file(s)', self.apply(dry_run=True))
+        self.apply()
+        self.assertFalse(File.objects.filter(pk=deleted.pk).exists())
+        self.assertFalse(os.path.exists(urlparse(deleted.get_url()).path))
+        self.assertTrue(File.objects.filter(pk=kept.pk).exists())
+
+    def test_failures(self):
+        """Test files whose objects cannot be moved are kept and reported."""
+        RetentionPolicy.objects.create(status=File.TRANSFERRED, days=30, archive_location=self.archive)
+        f = self.create_file('a.txt', self.vendor)
+        os.remove(urlparse(f.get_url()).path)
+        self.assertIn('0 file(s) done, 1 failed', self.apply())
+        self.assertEqual(File.objects.get(pk=f.pk).location, self.location)
+
+    def test_one_policy_for_every_vendor(self):
+        """Test a status has at most one policy for every vendor, despite NULL vendors being distinct."""
+        RetentionPolicy.objects.create(status=File.REJECTED, days=30, action=RetentionPolicy.DELETE)
+        duplicate = RetentionPolicy(status=File.REJECTED, days=60, action=RetentionPolicy.DELETE)
+        with self.assertRaises(ValidationError):
+            duplicate.full_clean()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            duplicate.save()
+        RetentionPolicy.objects.create(vendor=self.vendor, status=File.REJECTED, days=60, action=RetentionPolicy.DELETE)
+
+    def test_crash_keeps_original(self):
+        """Test a crash before the rows are updated leaves them pointing at the untouched original."""
+        RetentionPolicy.objects.create(status=File.TRANSFERRED, days=30, archive_location=self.archive)
+        f = self.create_file('a.txt', self.vendor)
+        with patch.object(File.objects, 'bulk_update', side_effect=RuntimeError('crash')):
+            with self.assertRaises(RuntimeError):
+                self.apply()
+        f.refresh_from_db()
+        self.assertEqual(f.location, self.location)
+        self.assertTrue(os.path.exists(urlparse(f.get_url()).path))
+
+        self.assertIn('1 file(s) done', self.apply())
+        f.refresh_from_db()
+        self.assertEqual(f.location, self.archive)
+        self.assertTrue(os.path.exists(urlparse(f.get_url()).path))
+        self.assertFalse(os.path.exists(os.path.join(self.upload_dir, File.TRANSFERRED, f.key)))
+
+    def test_skips_pending_transitions(self):
+        """Test files being moved between statuses are left for a later run."""
+        RetentionPolicy.objects.create(status=File.TRANSFERRED, days=30, archive_location=self.archive)
+        f = self.create_file('a.txt', self.vendor)
+        FileTransition.objects.create(file=f, origin=File.TRANSFERRED, target=File.APPROVED)
+        self.assertIn('0 file(s) done, 0 failed', self.apply())
+        self.assertEqual(File.objects.get(pk=f.pk).location, self.location)
+
+    def test_compress_checks_source(self):
+        """Test a source that no longer matches its checksum is not compressed or deleted."""
+        RetentionPolicy.objects.create(status=File.TRANSFERRED, days=30, archive_location=self.archive, compress=True)
+        f = self.create_file('a.txt', self.vendor)
+        File.objects.filter(pk=f.pk).update(checksum=hashlib.sha256(b'something else').hexdigest())
+        self.assertIn('0 file(s) done, 1 failed', self.apply())
+        self.assertTrue(os.path.exists(urlparse(f.get_url()).path))
+
+        File.objects.filter(pk=f.pk).update(checksum=hashlib.sha256(b'hello world').hexdigest())
+        self.assertIn('1 file(s) done', self.apply())
+        f.refresh_from_db()
+        # The size and checksum are still those of the contents
+        self.assertTrue(f.compressed)
+        self.assertEqual((f.size, f.checksum), (11, hashlib.sha256(b'hello world').hexdigest()))
+
+    def test_download_compressed(self):
+        """Test files archived compressed are downloaded as they were uploaded."""
+        RetentionPolicy.objects.create(status=File.TRANSFERRED, days=30, archive_location=self.archive, compress=True)
+        f = self.create_file('a.txt', self.vendor)
+        self.apply()
+        user = User.objects.create_user(username='admin')
+        user.add_permission_codes('view_file', 'change_file')
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('file-data', args=(f.pk,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'hello world')
+        self.assertEqual(response['Content-Length'], '11')
+
+        # Archiving again elsewhere does not compress twice
+        RetentionPolicy.objects.update(archive_location=self.location)
+        self.apply()
+        f.refresh_from_db()
+        self.assertEqual((f.location, f.key), (self.location, 'dv/Bob/a.txt.gz'))
+        stream = f.retrieve()
+        self.assertEqual(stream.read(), b'hello world')
+        stream.close()
+
+
+class VerifyFilesTestCase(TestCase):
+    """Test case for the stored object verifier."""
+
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+        self.vendor = Vendor.objects.create(name='DummyVendor', code='abc123', short_name='dv', priority=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.upload_dir)
+
+    def create_file(self, name, data=b'hello world', checksum=True):
+        f = File.objects.create(
+            name=name, location=f'file://{self.upload_dir}', key=f'dv/Bob/{name}', size=len(data),
+            vendor=self.vendor, submitter='Bob', priority=3, checksum=hashlib.sha256(data).hexdigest() if checksum else ''
+        )
+        path = urlparse(f.get_url()).path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as stored:
+            stored.write(data)
+        return f
+
+    def verify(self, **options):
+        with redirect_stdout(io.StringIO()) as output:
+            call_command('verify_files', **options)
+        return output.getvalue()
+
+    def test_verify(self):
+        """Test matching files are marked verified and are not read again until they are due."""
+        f = self.create_file('a.txt')
+        unknown = self.create_file('b.txt', checksum=False)
+        self.assertIn('Verified 1 file(s), backfilled 0', self.verify())
+        f.refresh_from_db()
+        self.assertIsNotNone(f.date_verified)
+        self.assertIsNone(File.objects.get(pk=unknown.pk).date_verified)
+        self.assertIn('Verified 0 file(s)', self.verify())
+
+        self.assertIn('backfilled 1', self.verify(backfill=True))
+        self.assertEqual(File.objects.get(pk=unknown.pk).checksum, hashlib.sha256(b'hello world').hexdigest())
+
+    def test_failures(self):
+        """Test corrupted and missing objects fail the run and stay unverified."""
+        corrupted = self.create_file('a.txt')
+        with open(urlparse(corrupted.get_url()).path, 'wb') as stored:
+            stored.write(b'hello')
+        missing = self.create_file('b.txt')
+        os.remove(urlparse(missing.get_url()).path)
+
+        with self.assertRaisesMessage(CommandError, '2 file(s) failed verification'):
+            self.verify()
+        self.assertFalse(File.objects.filter(date_verified__isnull=False).exists())
+
+    def test_changed_while_verifying(self):
+        """Test a file archived while its old object was read keeps its new row."""
+        f = self.create_file('a.txt', checksum=False)
+        verify = VerifyCommand._verify
+
+        def verify_then_archive(command, selected):
+            result = verify(command, selected)
+            File.objects.filter(pk=f.pk).update(key='dv/Bob/a.txt.gz', compressed=True, checksum='new')
+            return result
+
+        with patch.object(VerifyCommand, '_verify', verify_then_archive):
+            self.assertIn('backfilled 0', self.verify(backfill=True))
+        f.refresh_from_db()
+        self.assertEqual((f.checksum, f.date_verified), ('new', None))
+
+    def test_compressed(self):
+        """Test compressed objects are checked against the checksum of their contents."""
+        f = self.create_file('a.txt')
+        path = urlparse(f.get_url()).path
+        with open(path, 'rb') as stored, gzip.open(f'{path}.gz', 'wb') as compressed:
+            compressed.write(stored.read())
+        File.objects.filter(pk=f.pk).update(key=f'{f.key}.gz', compressed=True)
+        self.assertIn('Verified 1 file(s)', self.verify())
+
+    def test_throttle(self):
+        """Test reads are held to the byte rate."""
+        self.create_file('a.txt', data=b'x' * 2000)
+        with patch('server.pj.management.commands.verify_files.time.sleep') as sleep:
+            self.verify(bytes_per_second=1000)
+        self.assertAlmostEqual(sleep.call_args[0][0], 2, delta=0.1)
@@ -0,0 +1,83 @@
+"""Tests for the per route class concurrency limits and concurrent uploads"""
+import threading
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+
+from server.middleware import ConcurrencyLimitMiddleware
+from server.pj.models import File, Vendor
+
+TEST_POOLS = (
+    ('upload', r'^/api/pj/files/upload/', 1),
+    ('download', r'^/api/pj/files/\d+/data/', 1),
+    ('api', r'^/api/', 0),
+)
+
+
+@override_settings(CONCURRENCY_POOLS=TEST_POOLS, CONCURRENCY_RETRY_AFTER=7)
+class ConcurrencyLimitTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.responses = []
+        self.middleware = ConcurrencyLimitMiddleware(lambda request: self.responses.pop())
+
+    def test_saturated_pool(self):
+        """Test a saturated pool rejects requests without affecting other pools."""
+        upload = self.middleware.get_pool('/api/pj/files/upload/')
+        self.assertTrue(upload.acquire())
+
+        response = self.middleware(self.factory.post('/api/pj/files/upload/'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+
+        self.responses.append(HttpResponse())
+        self.assertEqual(self.middleware(self.factory.get('/api/pj/files/')).status_code, 200)
+
+        upload.release()
+        self.responses.append(HttpResponse())
+        self.assertEqual(self.middleware(self.factory.post('/api/pj/files/upload/')).status_code, 200)
+        self.assertEqual(upload.active, 0)
+
+    def test_streaming_holds_slot(self):
+        """Test streaming responses keep their slot until closed."""
+        self.responses.append(StreamingHttpResponse(iter([b'data'])))
+        response = self.middleware(self.factory.get('/api/pj/files/1/data/'))
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.middleware(self.factory.get('/api/pj/files/2/data/')).status_code, 503)
+        response.close()
+        self.responses.append(HttpResponse())
+        self.assertEqual(self.middleware(self.factory.get('/api/pj/files/2/data/')).status_code, 200)
+
+    def test_unmatched(self):
+        self.responses.append(HttpResponse())
+        self.assertEqual(self.middleware(self.factory.get('/admin/')).status_code, 200)
+
+
+class FileNameLockTestCase(TransactionTestCase):
+    """Test concurrent uploads of one name are versioned rather than given the same key."""
+
+    def test_concurrent_uploads(self):
+        vendor = Vendor.objects.create(name='DummyVendor', code='abc123', short_name='dv', priority=3)
+        start = threading.Barrier(4)
+        errors = []
+
+        def upload():
+            try:
+                start.wait()
+                File.objects.create_file(SimpleUploadedFile('a.txt', b'data'), vendor, 'Bob')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=upload) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(File.objects.values_list('name', flat=True)), ['a.txt', 'a_2.txt', 'a_3.txt', 'a_4.txt'])
@@ -0,0 +1,96 @@
+"""Tests for the pooled Postgres backend"""
+import threading
+
+import psycopg2
+from django.db import connection
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase
+
+from server.postgresql_pool.base import ConnectionPool
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        self.params = connection.get_connection_params()
+        self.opened = 0
+        self.pool = ConnectionPool('test', size=2, timeout=0.1, health_check_after=0, max_idle=0)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def connect(self):
+        self.opened += 1
+        return psycopg2.connect(**self.params)
+
+    def test_reuses_returned_connection(self):
+        first = self.pool.get(self.connect)
+        self.pool.put(first)
+        second = self.pool.get(self.connect)
+        self.assertIs(first, second)
+        self.assertEqual(self.opened, 1)
+        self.pool.put(second)
+
+    def test_times_out_when_exhausted(self):
+        held = [self.pool.get(self.connect), self.pool.get(self.connect)]
+        with self.assertRaises(OperationalError):
+            self.pool.get(self.connect)
+        for c in held:
+            self.pool.put(c)
+        # A returned connection frees a slot
+        self.pool.put(self.pool.get(self.connect))
+        self.assertEqual(self.opened, 2)
+
+    def test_waiter_gets_released_connection(self):
+        self.pool.timeout = 5
+        held = [self.pool.get(self.connect), self.pool.get(self.connect)]
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(self.pool.get(self.connect)))
+        waiter.start()
+        self.pool.put(held[0])
+        waiter.join()
+        self.assertIs(got[0], held[0])
+        self.pool.put(got[0])
+        self.pool.put(held[1])
+
+    def test_rolls_back_open_transaction(self):
+        c = self.pool.get(self.connect)
+        with c.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertEqual(c.get_transaction_status(), psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+        self.pool.put(c)
+        self.assertEqual(c.get_transaction_status(), psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.assertIs(self.pool.get(self.connect), c)
+        self.pool.put(c)
+
+    def test_replaces_broken_connection(self):
+        c = self.pool.get(self.connect)
+        self.pool.put(c)
+        c.close()
+        replacement = self.pool.get(self.connect)
+        self.assertIsNot(replacement, c)
+        self.assertEqual(self.opened, 2)
+        self.pool.put(replacement)
+
+    def test_discards_connection_failing_health_check(self):
+        c = self.pool.get(self.connect)
+        self.pool.put(c)
+        with psycopg2.connect(**self.params) as admin, admin.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [c.get_backend_pid()])
+        admin.close()
+        replacement = self.pool.get(self.connect)
+        self.assertIsNot(replacement, c)
+        with replacement.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.pool.put(replacement)
+
+    def test_closes_connections_idle_too_long(self):
+        self.pool.max_idle = 0.001
+        c = self.pool.get(self.connect)
+        self.pool.put(c)
+        threading.Event().wait(0.01)
+        replacement = self.pool.get(self.connect)
+        self.assertIsNot(replacement, c)
+        self.assertTrue(c.closed)
+        self.pool.put(replacement)
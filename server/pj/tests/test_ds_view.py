@@ -1,12 +1,15 @@
 """Tests for the datasource related views"""
+import io
 import logging
+from unittest.mock import Mock, patch
 
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from server.auth.models import User
-from server.pj.models import DataSource
+from server.pj.models import DataSource, DataSourceSuggestion
+from server.pj.suggestions import LRUCache
 
 logging.disable(logging.CRITICAL)
 
@@ -142,6 +145,38 @@ class DataSourceSuggestionTestCase(APITestCase):
         self.assertTrue(response.data)
         self.assertEqual(response.data[0], 'status of us')
 
+    def test_ranking(self):
+        """Test prefix matches and common values come first, and counts follow edits and deletes."""
+        create_datasource(status='us only')
+        create_datasource(status='us only')
+        create_datasource(status='usual')
+        response = self.client.post(self.url, data={'key': 'status', 'value': 'US'}, format='json')
+        self.assertEqual(response.data, ['us only', 'usual', 'status of us'])
+
+        self.datasource.delete()
+        usual = DataSource.objects.get(status='usual')
+        usual.status = 'rare'
+        usual.save()
+        response = self.client.post(self.url, data={'key': 'status', 'value': 'us'}, format='json')
+        self.assertEqual(response.data, ['us only'])
+        self.assertEqual(DataSourceSuggestion.objects.get(field='status', value='us only').count, 2)
+
+    def test_cache_expiry(self):
+        """Test cached results expire even when no version bump reaches the worker."""
+        cache = LRUCache(10, 60)
+        loader = Mock(side_effect=[1, 2])
+        with patch('server.pj.suggestions.time.monotonic', return_value=0):
+            self.assertEqual(cache.get('k', loader), 1)
+        with patch('server.pj.suggestions.time.monotonic', return_value=59):
+            self.assertEqual(cache.get('k', loader), 1)
+        with patch('server.pj.suggestions.time.monotonic', return_value=61):
+            self.assertEqual(cache.get('k', loader), 2)
+
+    def test_invalid_field(self):
+        for data in ({'key': 'date_ingest', 'value': '19'}, {'key': 'search_vector', 'value': 'x'}, {'key': 'status'}):
+            response = self.client.post(self.url, data=data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class DataSourcePermissionTestCase(APITestCase):
     """Test case for the validation of datasource codes action."""
@@ -156,3 +191,70 @@ class DataSourcePermissionTestCase(APITestCase):
         """Test an authorized get with no data sources in the database."""
         response = self.client.get(self.url, format='json')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class DataSourceBulkTestCase(APITestCase):
+    """Test case for the bulk data source actions."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='admin')
+        user.add_permission_codes('view_datasource', 'add_datasource', 'change_datasource')
+        self.client.force_authenticate(user=user)
+
+    def row(self, name, **kwargs):
+        return {'name': name, 'data_origin': 'do', 'data_type': 'dt', 'status': 'S', **kwargs}
+
+    def test_create_bulk(self):
+        """Test a valid batch is created, indexed for search and counted for suggestions."""
+        response = self.client.post(reverse('datasource-create-bulk'), [self.row('Ships'), self.row('Ports')], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([d['name'] for d in response.data], ['Ships', 'Ports'])
+        self.assertTrue(DataSource.objects.filter(search_vector='ships').exists())
+        self.assertEqual(DataSourceSuggestion.objects.get(field='status', value='S').count, 2)
+
+    def test_create_bulk_errors(self):
+        """Test one invalid row rejects the whole batch with its index."""
+        response = self.client.post(reverse('datasource-create-bulk'), [self.row('Ships'), {'name': 'Ports'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([e['row'] for e in response.data['errors']], [1])
+        self.assertIn('status', response.data['errors'][0]['errors'])
+        self.assertFalse(DataSource.objects.exists())
+
+    def test_update_bulk(self):
+        ships = create_datasource(name='Ships', status='old')
+        ports = create_datasource(name='Ports', status='old')
+        response = self.client.post(
+            reverse('datasource-update-bulk'),
+            [{'pk': ships.pk, 'status': 'new'}, {'pk': ports.pk, 'theme': 'Harbours'}],
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(DataSource.objects.get(pk=ships.pk).status, 'new')
+        self.assertEqual(DataSource.objects.get(pk=ports.pk).theme, 'Harbours')
+        self.assertTrue(DataSource.objects.filter(search_vector='harbour').exists())
+        self.assertEqual(DataSourceSuggestion.objects.get(field='status', value='old').count, 1)
+
+        response = self.client.post(reverse('datasource-update-bulk'), [{'pk': 0, 'status': 'x'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'][0]['row'], 0)
+
+    def test_import_csv(self):
+        """Test CSV rows are created and errors point at their line."""
+        data = io.BytesIO(b'name,data_origin,data_type,status,priority\nShips,do,dt,S,\nPorts,do,dt,,2\n')
+        data.name = 'sources.csv'
+        response = self.client.post(reverse('datasource-import-csv'), {'file': data})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([e['row'] for e in response.data['errors']], [3])
+
+        data = io.BytesIO(b'name,data_origin,data_type,status,priority\nShips,do,dt,S,\nPorts,do,dt,S,2\n')
+        data.name = 'sources.csv'
+        response = self.client.post(reverse('datasource-import-csv'), {'file': data})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(DataSource.objects.get(name='Ports').priority, 2)
+
+    def test_forbidden(self):
+        user = User.objects.create_user(username='viewer')
+        user.add_permission_codes('view_datasource', 'change_datasource')
+        self.client.force_authenticate(user=user)
+        response = self.client.post(reverse('datasource-create-bulk'), [self.row('Ships')], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
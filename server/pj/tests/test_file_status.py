@@ -1,12 +1,22 @@
 """Tests for the file related views"""
+import io
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from datetime import timedelta
 from unittest.mock import patch
 
+from django.core.management import call_command
+from django.utils import timezone
+
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from server.auth.models import User
-from server.pj.models import File, Vendor
+from server.pj.models import File, Vendor, FileTransition
 
 
 class FileStatusTestCase(APITestCase):
@@ -72,3 +82,78 @@ class FileStatusTestCase(APITestCase):
         self.client.logout()
         response = self.client.post(reverse(self.url, args=(1,)), {'id': 1, 'status': 'approved'}, format='json')
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class FileTransitionTestCase(TestCase):
+    """Test case for status transition intents and their recovery."""
+
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+        vendor = Vendor.objects.create(name='DummyVendor', code='abc123', short_name='dv')
+        self.file = File.objects.create(
+            name='a.txt', location=f'file://{self.upload_dir}', key='dv/Bob/a.txt', size=0,
+            vendor=vendor, submitter='Bob', priority=5, status=File.CLEAN
+        )
+        self.write(File.CLEAN)
+
+    def tearDown(self):
+        shutil.rmtree(self.upload_dir)
+
+    def path(self, status):
+        return os.path.join(self.upload_dir, status, 'dv/Bob/a.txt')
+
+    def write(self, status):
+        os.makedirs(os.path.dirname(self.path(status)), exist_ok=True)
+        open(self.path(status), 'wb').close()
+
+    def test_change_status(self):
+        """Test a successful transition leaves no intent behind."""
+        self.assertTrue(self.file.change_status(File.CLEAN, File.APPROVED))
+        self.assertTrue(os.path.exists(self.path(File.APPROVED)))
+        self.assertFalse(FileTransition.objects.exists())
+
+    def test_retry_after_save_failure(self):
+        """Test retrying a transition whose save failed does not move the object again."""
+        with patch.object(File, 'save', side_effect=Exception('Database went away')):
+            self.assertFalse(self.file.change_status(File.CLEAN, File.APPROVED))
+        self.assertEqual(FileTransition.objects.count(), 1)
+
+        self.assertTrue(self.file.change_status(File.CLEAN, File.APPROVED))
+        self.assertEqual(File.objects.get(pk=self.file.pk).status, File.APPROVED)
+        self.assertFalse(FileTransition.objects.exists())
+
+    def test_recover(self):
+        """Test recovery completes moved transitions and rolls back the rest."""
+        FileTransition.objects.create(file=self.file, origin=File.CLEAN, target=File.REJECTED)
+        self.assertEqual(FileTransition.objects.recover()[FileTransition.ROLLED_BACK], 0)
+        self.assertEqual(FileTransition.objects.recover(age=0)[FileTransition.ROLLED_BACK], 1)
+        self.assertEqual(File.objects.get(pk=self.file.pk).status, File.CLEAN)
+
+        # Copied but not yet deleted, as an interrupted S3 move leaves it
+        self.write(File.APPROVED)
+        FileTransition.objects.create(file=self.file, origin=File.CLEAN, target=File.APPROVED)
+        self.assertEqual(FileTransition.objects.recover(age=0)[FileTransition.COMPLETED], 1)
+        self.assertEqual(File.objects.get(pk=self.file.pk).status, File.APPROVED)
+        self.assertFalse(os.path.exists(self.path(File.CLEAN)))
+        self.assertFalse(FileTransition.objects.exists())
+
+    @override_settings(TRANSITION_RECOVERY_INTERVAL=300)
+    def test_recover_loop(self):
+        """Test intents too young for one pass are recovered by a later one."""
+        FileTransition.objects.create(file=self.file, origin=File.CLEAN, target=File.REJECTED)
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) > 1:
+                raise KeyboardInterrupt
+            FileTransition.objects.update(created=timezone.now() - timedelta(hours=1))
+
+        # Closing connections between passes would end the test's transaction
+        with patch('server.pj.management.commands.recover_transitions.close_old_connections'), \
+                patch('server.pj.management.commands.recover_transitions.time.sleep', side_effect=sleep):
+            with redirect_stdout(io.StringIO()) as output, self.assertRaises(KeyboardInterrupt):
+                call_command('recover_transitions', loop=True)
+        self.assertEqual(output.getvalue().count('rolled back 1'), 1)
+        self.assertEqual(sleeps, [300, 300])
+        self.assertFalse(FileTransition.objects.exists())
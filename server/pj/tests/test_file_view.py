@@ -1,11 +1,16 @@
 """Tests for the file related views"""
+import hashlib
 import io
 import logging
+import shutil
+import tempfile
+from datetime import timedelta
 from unittest.mock import patch
 
 from django.urls import reverse
 from django.conf import settings
 from django.test import override_settings
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.core.cache import cache
 from rest_framework import status
@@ -14,6 +19,8 @@ from rest_framework.test import APITestCase
 
 from server.auth.models import User
 from server.pj.models import File, Vendor
+from server.pj.views import FileViewSet
+from server.pj.tests.mixins import QueryBudgetTestMixin
 
 logging.disable(logging.CRITICAL)
 
@@ -32,7 +39,7 @@ def create_file(vendor, **kwargs):
         **kwargs
     )
 
-class FileViewTestCase(APITestCase):
+class FileViewTestCase(QueryBudgetTestMixin, APITestCase):
     """Test case for the file list view."""
 
     def setUp(self):
@@ -66,6 +73,32 @@ class FileViewTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 0)
 
+    def test_list_query_budget(self):
+        """Test listing files makes the same number of queries for any page size."""
+        for vendor in (self.testVendor1, self.testVendor2):
+            vendor.pocs.create(name='Poc')
+            for _ in range(10):
+                create_file(vendor)
+
+        for limit in (1, 20):
+            with self.assertQueryBudget(FileViewSet, 'list'):
+                response = self.client.get(self.url, {'limit': limit}, format='json')
+            self.assertEqual(len(response.data['results']), limit)
+        self.assertEqual(len(response.data['results'][0]['vendor']['pocs']), 1)
+
+    @override_settings(FILE_LIST_DEFAULT_DAYS=30)
+    def test_default_window(self):
+        """Test unfiltered lists only show recent files while date filters reach older ones."""
+        recent = create_file(self.testVendor1)
+        old = create_file(self.testVendor1)
+        File.objects.filter(pk=old.pk).update(date_uploaded=timezone.now() - timedelta(days=60))
+
+        response = self.client.get(self.url, format='json')
+        self.assertEqual([f['pk'] for f in response.data], [recent.pk])
+        after = (timezone.now() - timedelta(days=90)).isoformat()
+        response = self.client.get(self.url, {'date_uploaded_after': after}, format='json')
+        self.assertEqual(len(response.data), 2)
+
     def test_unauthorized(self):
         """Test an authorized response to ensure authentication requirements."""
         self.client.logout()
@@ -291,6 +324,24 @@ class FileUploadTestCase(APITestCase):
         self.assertEqual(files[0].status, File.FAILED)
         self.assertTrue(files[0].message)
 
+    @override_settings(REST_FRAMEWORK=TEST_REST_FRAMEWORK)
+    def test_upload_checksum(self):
+        test_file = io.BytesIO(b'Here is a file')
+        test_file.name = 'test.txt'
+        data = {
+            'vendor_code': self.testVendor.code,
+            'submitter': 'Test User 5',
+            'file': test_file
+        }
+        upload_dir = tempfile.mkdtemp()
+        with self.settings(UPLOAD_LOCATION=f'file://{upload_dir}'):
+            response = self.client.post(self.url, data, format='multipart')
+        shutil.rmtree(upload_dir)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        f = File.objects.get(submitter=data['submitter'])
+        self.assertEqual(f.checksum, hashlib.sha256(b'Here is a file').hexdigest())
+
     @override_settings(REST_FRAMEWORK=TEST_REST_FRAMEWORK)
     @patch('server.pj.store.s3_upload')
     def test_s3_upload(self, upload_function):
@@ -0,0 +1,34 @@
+"""Tests for the Prometheus metrics endpoint"""
+import logging
+
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from server.auth.models import User
+
+logging.disable(logging.CRITICAL)
+
+
+class MetricsTestCase(APITestCase):
+
+    def setUp(self):
+        self.url = reverse('metrics')
+
+    def test_metrics(self):
+        """Test staff can scrape request and hot path metrics."""
+        user = User.objects.create_user(username='admin', is_staff=True)
+        self.client.force_authenticate(user=user)
+        self.client.get(reverse('vendor-list'))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('pj_request_seconds_count{method="GET",status="403",view="vendor-list"}', body)
+        self.assertIn('pj_request_queries_bucket', body)
+        self.assertIn('pj_storage_seconds', body)
+
+    def test_not_staff(self):
+        user = User.objects.create_user(username='user')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,59 @@
+"""Tests for the note and todo views"""
+import logging
+
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from server.auth.models import User
+from server.pj.models import Note, Todo
+from server.pj.tests.mixins import QueryBudgetTestMixin
+from server.pj.tests.test_ds_view import create_datasource
+from server.pj.views import NoteViewSet, TodoViewSet, DataSourceViewSet
+
+logging.disable(logging.CRITICAL)
+
+
+class NoteViewTestCase(QueryBudgetTestMixin, APITestCase):
+    """Test case for the note and todo list views."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin', password='secret')
+        self.user.add_permission_codes('view_note', 'add_note', 'view_todo', 'view_datasource')
+        self.client.login(username=self.user.username, password='secret')
+        self.source = create_datasource(name='Ships')
+        self.authors = [User.objects.create_user(username=f'author{i}') for i in range(5)]
+
+    def test_note_list_query_budget(self):
+        """Test listing notes makes the same number of queries however many authors wrote them."""
+        for author in self.authors:
+            Note.objects.create(note=f'By {author.username}', created_by=author, data_source=self.source)
+
+        with self.assertQueryBudget(NoteViewSet, 'list'):
+            response = self.client.get(reverse('note-list'), {'source': self.source.pk, 'limit': 10})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(response.data['results'][0]['created_by'], {'username': 'author0', 'first_name': '', 'last_name': ''})
+
+    def test_todo_list_query_budget(self):
+        for author in self.authors:
+            Todo.objects.create(lead='Call', text=f'By {author.username}', created_by=author)
+
+        with self.assertQueryBudget(TodoViewSet, 'list'):
+            response = self.client.get(reverse('todo-list'), {'limit': 10})
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_note_counts(self):
+        """Test data sources carry their note counts."""
+        create_datasource(name='Ports')
+        for author in self.authors[:3]:
+            Note.objects.create(note='Note', created_by=author, data_source=self.source)
+
+        with self.assertQueryBudget(DataSourceViewSet, 'list'):
+            response = self.client.get(reverse('datasource-list'), {'ordering': '-note_count', 'limit': 10})
+        self.assertEqual([(d['name'], d['note_count']) for d in response.data['results']], [('Ships', 3), ('Ports', 0)])
+
+    def test_create(self):
+        response = self.client.post(reverse('note-list'), {'note': 'New', 'data_source': self.source.pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created_by']['username'], 'admin')
@@ -0,0 +1,86 @@
+"""Tests for read replica routing"""
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+
+from server.auth.models import User
+from server.metrics import QueryCounter
+from server.middleware import ReplicaRoutingMiddleware, count_queries
+from server.pj.models import File
+from server.pj.views import FileViewSet
+from server.routers import ReplicaRouter
+
+
+@override_settings(REPLICA_DATABASES=['replica0'], REPLICA_STICKY_SECONDS=60)
+class ReplicaRoutingTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+        self.middleware = ReplicaRoutingMiddleware(self.respond)
+        self.view = FileViewSet.as_view({'get': 'list', 'post': 'upload'})
+
+    def respond(self, request):
+        response = HttpResponse(self.router.db_for_read(File))
+        response['X-User-Db'] = self.router.db_for_read(User)
+        return response
+
+    def request(self, method, token='abc', cookies=None):
+        request = getattr(self.factory, method)('/api/pj/files/', HTTP_AUTHORIZATION=f'Token {token}')
+        request.COOKIES.update(cookies or {})
+        self.middleware.process_view(request, self.view, (), {})
+        return self.middleware(request)
+
+    def test_reads(self):
+        """Test only declared read actions of pj models use a replica."""
+        response = self.request('get')
+        self.assertEqual(response.content, b'replica0')
+        self.assertEqual(response['X-User-Db'], 'default')
+        self.assertEqual(self.request('post').content, b'default')
+        # Routing is reset once the request is done
+        self.assertEqual(self.router.db_for_read(File), 'default')
+        self.assertEqual(self.router.db_for_write(File), 'default')
+
+    @override_settings(SHARED_CACHE=True)
+    def test_sticky(self):
+        """Test with a shared cache a token client reads from the primary after its writes, other clients do not."""
+        self.request('post')
+        self.assertEqual(self.request('get').content, b'default')
+        self.assertEqual(self.request('get', token='other').content, b'replica0')
+
+    @override_settings(SHARED_CACHE=False)
+    def test_sticky_cookie(self):
+        """Test without a shared cache only the signed cookie keeps a client on the primary."""
+        response = self.request('post')
+        cookie = response.cookies[ReplicaRoutingMiddleware.STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], 60)
+        self.assertEqual(self.request('get').content, b'replica0')
+        cookies = {cookie.key: cookie.value}
+        self.assertEqual(self.request('get', cookies=cookies).content, b'default')
+        # A forged cookie is ignored
+        cookies = {cookie.key: '1'}
+        self.assertEqual(self.request('get', cookies=cookies).content, b'replica0')
+
+    def test_downloads_use_primary(self):
+        """Test downloads read the file's location from the primary, a stale one would miss the object."""
+        self.assertNotIn('data', FileViewSet.replica_actions)
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_no_replicas(self):
+        self.assertEqual(self.request('get').content, b'default')
+
+    def test_migrate(self):
+        self.assertTrue(self.router.allow_migrate('default', 'pj'))
+        self.assertFalse(self.router.allow_migrate('replica0', 'pj'))
+
+    def test_queries_counted_on_every_alias(self):
+        """Test metrics and query budgets count the queries sent to replicas."""
+        aliases = {'default': MagicMock(), 'replica0': MagicMock()}
+        counter = QueryCounter()
+        with patch('server.middleware.connections', aliases), count_queries(counter) as installed:
+            self.assertIs(installed, counter)
+        for alias in aliases.values():
+            alias.execute_wrapper.assert_called_once_with(counter)
@@ -0,0 +1,63 @@
+"""Tests for the full text search view"""
+import logging
+
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from server.auth.models import User
+from server.pj.models import Note, Todo
+from server.pj.tests.test_ds_view import create_datasource
+
+logging.disable(logging.CRITICAL)
+
+
+class SearchViewTestCase(APITestCase):
+    """Test case for the search view."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin')
+        self.user.add_permission_codes('view_datasource', 'view_note', 'view_todo')
+        self.url = reverse('search-list')
+        self.client.force_authenticate(user=self.user)
+        self.source = create_datasource(name='Shipping manifests', theme='Maritime')
+        create_datasource(name='Weather', theme='Climate')
+        self.note = Note.objects.create(note='The manifests arrive weekly', created_by=self.user, data_source=self.source)
+        Todo.objects.create(lead='Chase shipping contact', text='Ask about manifest formats', created_by=self.user)
+
+    def test_search(self):
+        """Test results span types and rank title matches first."""
+        response = self.client.get(self.url, {'q': 'manifests'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['type'] for r in response.data], ['datasource', 'note', 'todo'])
+        self.assertEqual(response.data[0]['pk'], self.source.pk)
+        self.assertEqual(response.data[1]['data_source'], self.source.pk)
+
+    def test_updates(self):
+        """Test edits are searchable straight away."""
+        self.note.note = 'Rewritten about tides'
+        self.note.save()
+        response = self.client.get(self.url, {'q': 'tides', 'types': 'note,todo'})
+        self.assertEqual([(r['type'], r['pk']) for r in response.data], [('note', self.note.pk)])
+
+    def test_permissions(self):
+        """Test types the user cannot view are left out."""
+        user = User.objects.create_user(username='notes')
+        user.add_permission_codes('view_note')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.url, {'q': 'manifests'})
+        self.assertEqual([r['type'] for r in response.data], ['note'])
+
+    def test_invalid(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'q': 'x', 'types': 'file'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_filter(self):
+        """Test the list views accept a search filter."""
+        response = self.client.get(reverse('note-list'), {'search': 'weekly manifest'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([n['pk'] for n in response.data], [self.note.pk])
+
+    def test_unauthorized(self):
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(self.url, {'q': 'x'}).status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,70 @@
+"""Tests for the file statistics views"""
+import logging
+from unittest.mock import patch
+
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from server.auth.models import User
+from server.pj.models import File, Vendor, FileStatusRollup
+
+logging.disable(logging.CRITICAL)
+
+
+class FileStatsViewTestCase(APITestCase):
+    """Test case for the file statistics view."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='admin')
+        user.add_permission_codes('view_file')
+        self.url = reverse('filestatusrollup-list')
+        self.client.force_authenticate(user=user)
+        self.testVendor = Vendor.objects.create(name='DummyVendor', code='abc123', short_name='dv')
+
+    def create_file(self, name, size=10):
+        return File.objects.create(
+            name=name, location='s3://test-bucket', key=f'dv/Uploader/{name}', size=size,
+            vendor=self.testVendor, submitter='Uploader', priority=5
+        )
+
+    def test_rollup_on_create(self):
+        """Test that creating files rolls them up as unscanned."""
+        self.create_file('a.txt', size=10)
+        self.create_file('b.txt', size=20)
+        rollup = FileStatusRollup.objects.get(status=File.UNSCANNED)
+        self.assertEqual(rollup.file_count, 2)
+        self.assertEqual(rollup.byte_count, 30)
+
+    @patch('server.pj.store.s3_move')
+    def test_rollup_on_transition(self, move_function):
+        """Test that only real status changes are rolled up."""
+        f = self.create_file('a.txt')
+        f.change_status(File.UNSCANNED, File.CLEAN)
+        f.message = 'Not a transition'
+        f.save()
+        self.assertEqual(FileStatusRollup.objects.get(status=File.CLEAN).file_count, 1)
+        self.assertEqual(FileStatusRollup.objects.get(status=File.UNSCANNED).file_count, 1)
+
+    def test_list(self):
+        """Test the aggregated statistics response."""
+        self.create_file('a.txt', size=10)
+        self.create_file('b.txt', size=20)
+        response = self.client.get(self.url, {'interval': 'day', 'status': File.UNSCANNED})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['vendor'], self.testVendor.name)
+        self.assertEqual(response.data[0]['file_count'], 2)
+        self.assertEqual(response.data[0]['byte_count'], 30)
+
+        response = self.client.get(self.url, {'status': File.CLEAN})
+        self.assertEqual(len(response.data), 0)
+
+    def test_invalid_interval(self):
+        response = self.client.get(self.url, {'interval': 'century'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unauthorized(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -1,5 +1,10 @@
+import hashlib
 import io
 import os
+import shutil
+import sys
+import tempfile
+from unittest.mock import MagicMock, patch
 from urllib.parse import urlparse
 
 from django.test import TestCase
@@ -35,6 +40,32 @@ class TestStore(TestCase):
             store.delete('file:///tmp/folder/test.txt')
         
 
+    def test_run_blocking(self):
+        self.assertEqual(store.run_blocking(max, 1, 2), 2)
+
+        monkey = MagicMock()
+        monkey.is_module_patched.return_value = True
+        hub = MagicMock()
+        hub.threadpool.apply.side_effect = lambda fn, args, kwargs: fn(*args, **kwargs)
+        with patch.dict(sys.modules, {'gevent': MagicMock(get_hub=lambda: hub), 'gevent.monkey': monkey}):
+            self.assertEqual(store.run_blocking(max, 1, 2), 2)
+        hub.threadpool.apply.assert_called_once()
+
+    def test_retrieve_off_hub(self):
+        store.upload('file:///tmp/offload.txt', io.BytesIO(b'abc'))
+        monkey = MagicMock()
+        monkey.is_module_patched.return_value = True
+        hub = MagicMock()
+        hub.threadpool.apply.side_effect = lambda fn, args, kwargs: fn(*args, **kwargs)
+        with patch.dict(sys.modules, {'gevent': MagicMock(get_hub=lambda: hub), 'gevent.monkey': monkey}):
+            stream = store.retrieve('file:///tmp/offload.txt')
+            self.assertEqual(stream.read(2), b'ab')
+            self.assertEqual(stream.name, '/tmp/offload.txt')
+            stream.close()
+        # Opening, the read and the close each ran on the thread pool
+        self.assertEqual(hub.threadpool.apply.call_count, 3)
+        store.delete('file:///tmp/offload.txt')
+
     def test_bad_scheme(self):
         with self.assertRaises(Exception):
             store.upload('http://place/to/upload', None)
@@ -47,3 +78,118 @@ class TestStore(TestCase):
 
         with self.assertRaises(Exception):
             store.retrieve('http://place/to/upload')
+
+    def test_walk(self):
+        root = tempfile.mkdtemp()
+        for path in ('a-b', 'a/x', 'a/y/z', 'b'):
+            store.upload(f'file://{root}/{path}', io.BytesIO(b'abc'))
+        self.assertEqual([key for key, _, _ in store.walk(f'file://{root}')], ['a-b', 'a/x', 'a/y/z', 'b'])
+        self.assertEqual(next(store.walk(f'file://{root}'))[1], 3)
+        self.assertEqual(store.list_prefixes(f'file://{root}'), ['a'])
+        self.assertEqual(list(store.walk(f'file://{root}/missing')), [])
+        shutil.rmtree(root)
+
+    def test_walk_s3(self):
+        paginator = MagicMock()
+        paginator.paginate.return_value = [
+            {'Contents': [{'Key': 'base/clean/', 'Size': 0, 'LastModified': None}]},
+            {'Contents': [{'Key': 'base/clean/dv/Bob/a.txt', 'Size': 3, 'LastModified': None}]}
+        ]
+        with patch.object(store.get_s3().meta.client, 'get_paginator', return_value=paginator):
+            self.assertEqual(list(store.walk('s3://bucket/base/clean')), [('dv/Bob/a.txt', 3, None)])
+        paginator.paginate.assert_called_with(Bucket='bucket', Prefix='base/clean/')
+
+    def test_s3_created_on_first_use(self):
+        with patch.object(store, '_s3', None), patch('boto3.resource') as resource:
+            store.upload('file:///tmp/lazy.txt', io.BytesIO(b'data'))
+            store.delete('file:///tmp/lazy.txt')
+            resource.assert_not_called()
+            self.assertIs(store.get_s3(), store.get_s3())
+            resource.assert_called_once_with('s3')
+
+    def test_checksum_reader(self):
+        data = b'0123456789' * 10
+        reader = store.ChecksumReader(io.BytesIO(data))
+        reader.read(30)
+        # Rereading after a seek back, as retries do, is not hashed twice
+        reader.seek(10)
+        reader.read(50)
+        reader.read()
+        self.assertEqual(reader.digests(), (hashlib.sha256(data).hexdigest(), hashlib.md5(data).hexdigest(), 100))
+
+        reader = store.ChecksumReader(io.BytesIO(data))
+        reader.seek(50)
+        reader.read()
+        self.assertEqual(reader.digests()[0], hashlib.sha256(data).hexdigest())
+
+    def test_upload_checksum(self):
+        self.assertEqual(store.upload('file:///tmp/checksum.txt', io.BytesIO(b'abc')), hashlib.sha256(b'abc').hexdigest())
+        store.delete('file:///tmp/checksum.txt')
+
+    def test_s3_move_verified(self):
+        objects = {}
+
+        def s3_object(bucket, key):
+            return objects.setdefault((bucket, key), MagicMock(
+                content_length=10, e_tag='"abc"', server_side_encryption=None, sse_customer_algorithm=None
+            ))
+
+        s3 = MagicMock()
+        s3.Object.side_effect = s3_object
+        with patch.object(store, 'get_s3', return_value=s3):
+            store.s3_move('bucket', 'old', 'bucket', 'new')
+            objects[('bucket', 'old')].delete.assert_called_once()
+
+            objects.clear()
+            s3_object('bucket', 'new').content_length = 4
+            with self.assertRaises(store.ChecksumMismatch):
+                store.s3_move('bucket', 'old', 'bucket', 'new')
+            objects[('bucket', 'old')].delete.assert_not_called()
+
+            objects.clear()
+            s3_object('bucket', 'new').e_tag = '"def"'
+            with self.assertRaises(store.ChecksumMismatch):
+                store.s3_move('bucket', 'old', 'bucket', 'new')
+            # Multipart ETags are not comparable, only sizes are checked
+            s3_object('bucket', 'new').e_tag = '"def-2"'
+            store.s3_move('bucket', 'old', 'bucket', 'new')
+            # Nor are ETags of encrypted sources
+            s3_object('bucket', 'new').e_tag = '"def"'
+            s3_object('bucket', 'old').server_side_encryption = 'aws:kms'
+            store.s3_move('bucket', 'old', 'bucket', 'new')
+
+    def test_s3_upload(self):
+        data = b'0123456789'
+        md5 = hashlib.md5(data).hexdigest()
+        obj = MagicMock(content_length=10, e_tag=f'"{md5}"', server_side_encryption=None, sse_customer_algorithm=None)
+        s3 = MagicMock()
+        s3.Object.return_value = obj
+        with patch.object(store, 'get_s3', return_value=s3):
+            store.upload('s3://bucket/key', io.BytesIO(data))
+            s3.Object.assert_called_with('bucket', 'key')
+            obj.put.assert_called_once_with(Body=data, ContentMD5='eB5eJF1ptWaXm4bijSPyxw==')
+            obj.upload_fileobj.assert_not_called()
+
+            obj.e_tag = '"def"'
+            with self.assertRaises(store.ChecksumMismatch):
+                store.upload('s3://bucket/key', io.BytesIO(data))
+            # SSE-KMS and SSE-C ETags are not the MD5 of the contents
+            obj.server_side_encryption = 'aws:kms'
+            store.upload('s3://bucket/key', io.BytesIO(data))
+            obj.server_side_encryption, obj.sse_customer_algorithm = 'AES256', 'AES256'
+            store.upload('s3://bucket/key', io.BytesIO(data))
+
+            obj.content_length = 4
+            with self.assertRaises(store.ChecksumMismatch):
+                store.upload('s3://bucket/key', io.BytesIO(data))
+
+    def test_s3_upload_multipart(self):
+        data = b'0123456789'
+        obj = MagicMock(content_length=10, e_tag='"abc-2"', server_side_encryption=None, sse_customer_algorithm=None)
+        s3 = MagicMock()
+        obj.upload_fileobj.side_effect = lambda reader: reader.read()
+        s3.Object.return_value = obj
+        with patch.object(store, 'get_s3', return_value=s3), patch.object(store, 'S3_PUT_MAX_SIZE', 4):
+            store.upload('s3://bucket/key', io.BytesIO(data))
+        obj.put.assert_not_called()
+        obj.upload_fileobj.assert_called_once()
@@ -0,0 +1,69 @@
+"""Tests for the shared cache backends and the anonymous throttle"""
+import shutil
+import tempfile
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from server.pj.throttles import AtomicAnonRateThrottle
+
+
+class ThrottleTestMixin:
+    """Run the throttle and incr assertions against the configured cache."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.factory = APIRequestFactory()
+
+    def test_incr(self):
+        cache = caches['default']
+        with self.assertRaises(ValueError):
+            cache.incr('missing')
+        cache.set('counter', 1)
+        self.assertEqual(cache.incr('counter'), 2)
+        self.assertEqual(cache.incr('counter', 3), 5)
+        self.assertEqual(cache.get('counter'), 5)
+
+    def test_throttle(self):
+        throttle = AtomicAnonRateThrottle()
+        throttle.rate = '2/minute'
+        throttle.num_requests, throttle.duration = throttle.parse_rate(throttle.rate)
+        request = self.factory.post('/', REMOTE_ADDR='10.0.0.1')
+        request.user = AnonymousUser()
+
+        self.assertTrue(throttle.allow_request(request, None))
+        self.assertTrue(throttle.allow_request(request, None))
+        self.assertFalse(throttle.allow_request(request, None))
+        self.assertEqual(throttle.wait(), 60)
+
+        other = self.factory.post('/', REMOTE_ADDR='10.0.0.2')
+        other.user = AnonymousUser()
+        self.assertTrue(throttle.allow_request(other, None))
+
+
+class LocMemThrottleTestCase(ThrottleTestMixin, TestCase):
+    pass
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'server.cache.DatabaseCache', 'LOCATION': 'pj_test_cache'}})
+class DatabaseThrottleTestCase(ThrottleTestMixin, TestCase):
+
+    def setUp(self):
+        call_command('createcachetable', verbosity=0)
+        super().setUp()
+
+
+class FileThrottleTestCase(ThrottleTestMixin, TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.override = override_settings(CACHES={'default': {'BACKEND': 'server.cache.FileBasedCache', 'LOCATION': self.cache_dir}})
+        self.override.enable()
+        super().setUp()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.cache_dir)
@@ -4,11 +4,13 @@ import os
 import shutil
 
 from django.urls import reverse
+from django.core.cache import cache
 from django.utils.crypto import get_random_string
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from server.auth.models import User
+from server.pj.managers import vendor_code_cache_key
 from server.pj.models import Vendor, File
 
 logging.disable(logging.CRITICAL)
@@ -119,6 +121,7 @@ class VendorValidateTestCase(APITestCase):
         user.add_permission_codes('add_file', 'change_file', 'delete_file', 'view_file')
         self.url = reverse('vendor-validate')
         self.client.force_authenticate(user=user)
+        cache.clear()
         self.testVendor = Vendor.objects.create(
             name='DummyVendor', code='abcdefgh')
 
@@ -139,3 +142,31 @@ class VendorValidateTestCase(APITestCase):
         response = self.client.post(self.url, data, format='json')
         self.assertFalse(response.data)
         self.assertIsInstance(response.data, bool)
+
+    def test_cached_lookup(self):
+        data = {'code': self.testVendor.code}
+        self.client.post(self.url, data, format='json')
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, data, format='json')
+        self.assertTrue(response.data)
+
+    def test_cache_invalidated_on_change(self):
+        old_code = self.testVendor.code
+        self.assertTrue(self.client.post(self.url, {'code': old_code}, format='json').data)
+        self.assertFalse(self.client.post(self.url, {'code': 'NEWCODE1'}, format='json').data)
+
+        self.testVendor.code = 'NEWCODE1'
+        self.testVendor.save()
+        self.assertEqual(Vendor.objects.get(pk=self.testVendor.pk).code, 'newcode1')
+        self.assertFalse(self.client.post(self.url, {'code': old_code}, format='json').data)
+        self.assertTrue(self.client.post(self.url, {'code': 'NEWCODE1'}, format='json').data)
+
+        self.testVendor.delete()
+        self.assertFalse(self.client.post(self.url, {'code': 'newcode1'}, format='json').data)
+
+    def test_junk_not_cached(self):
+        """Test codes no vendor could have are rejected without a lookup or a cache entry."""
+        for code in ('not-a-code', 'muchtoolongforacode'):
+            with self.assertNumQueries(0):
+                self.assertFalse(self.client.post(self.url, {'code': code}, format='json').data)
+            self.assertIsNone(cache.get(vendor_code_cache_key(code)))
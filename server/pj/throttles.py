@@ -1,6 +1,37 @@
 from rest_framework.throttling import AnonRateThrottle
 
 
+class AtomicAnonRateThrottle(AnonRateThrottle):
+    """
+    AtomicAnonRateThrottle
+
+    Counts anonymous requests with a single cache increment instead of DRF's history list, which is
+    read, appended to and written back so concurrent workers overwrite each other's requests.
+    The counter is created on a client's first request and expires one throttle duration later.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.cache.add(self.key, 0, self.duration)
+        try:
+            count = self.cache.incr(self.key)
+        except ValueError:
+            # The window expired between add and incr, start a new one
+            self.cache.set(self.key, 1, self.duration)
+            count = 1
+        return count <= self.num_requests
+
+    def wait(self):
+        # Cache backends don't expose a key's remaining lifetime, so report the whole window
+        return self.duration
+
+
 def get_throttle_classes(*throttle_actions):
     """
     get_throttle_classes 
@@ -10,7 +41,7 @@ def get_throttle_classes(*throttle_actions):
     :return: tuple of permissions
     """
 
-    class Throttle(AnonRateThrottle):
+    class Throttle(AtomicAnonRateThrottle):
 
         def allow_request(self, request, view):
             # Never throttle logged in user
@@ -5,11 +5,13 @@ from server.pj import views
 
 router = DefaultRouter()
 router.register(r'files', views.FileViewSet)
+router.register(r'stats', views.FileStatsViewSet)
 router.register(r'vendors', views.VendorViewSet)
 router.register(r'stakeholders', views.StakeholderViewSet)
 router.register(r'datasources', views.DataSourceViewSet)
 router.register(r'notes', views.NoteViewSet)
 router.register(r'todos', views.TodoViewSet)
+router.register(r'search', views.SearchViewSet, basename='search')
 
 urlpatterns = [
     path('', include(router.urls))
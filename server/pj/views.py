@@ -1,31 +1,42 @@
+import io
+import csv
 import logging
+from datetime import timedelta
 
 from django.conf import settings
-from django.db.models.functions import Concat
-from django.db.models import Count, F, Value, CharField
+from django.db.models.functions import Concat, TruncHour, TruncDay, TruncWeek, TruncMonth
+from django.db.models import Count, Sum, F, Value, CharField
 from django.http.response import FileResponse
+from django.utils import timezone
 from rest_framework import status, viewsets, mixins, filters
 from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.permissions import IsAuthenticated
 from filters.mixins import FiltersMixin
 
 from server.pj.email_service import email
-from server.pj.models import File, Vendor, Stakeholder, DataSource, Note, Todo
+from server.pj.models import File, Vendor, Stakeholder, DataSource, Note, Todo, FileStatusRollup
 from server.pj.serializers import (FileSerializer, FileUploadSerializer,
                                    VendorSerializer, VendorValidateSerializer, StakeholderSerializer,
-                                   DataSourceSerializer, NoteSerializer, TodoSerializer)
-from server.pj.store import upload, retrieve, create_folders
+                                   DataSourceSerializer, NoteSerializer, TodoSerializer, FileStatsSerializer)
+from server.pj.store import upload, create_folders
 from server.pj.permissions import get_permission_classes
+from server.pj.search import search, search_query
+from server.pj.suggestions import suggest
 from server.pj.ordering import MappedOrderFilter
 from server.pj.throttles import get_throttle_classes
+from server.metrics import STORAGE_BYTES
 
 logger = logging.getLogger(__name__)
 
 def parse_list(val):
     return val.split(',')
 
+def row_errors(errors, offset=0):
+    return [{'row': index + offset, 'errors': e} for index, e in enumerate(errors) if e]
+
 def validate_int(num):
     try:
         return int(num)
@@ -52,10 +63,20 @@ class FileViewSet(
 ):
     """View set to interact with the file model."""
     permission_classes = get_permission_classes('pj', 'file', anon_actions=('upload',))
+    # Read only actions served from the read replicas when configured (see ReplicaRoutingMiddleware)
+    replica_actions = ('list', 'retrieve')
     serializer_class = FileSerializer
-    queryset = File.objects.all().annotate(url=Concat(F('location'), Value('/'), F('status'), Value('/'), F('key'), output_field=CharField()))
+    queryset = File.objects.order_by('pk') \
+        .select_related('vendor') \
+        .prefetch_related('vendor__pocs') \
+        .annotate(url=Concat(F('location'), Value('/'), F('status'), Value('/'), F('key'), output_field=CharField()))
     pagination_class = LimitOffsetPagination
     throttle_classes = get_throttle_classes('upload')
+    # Maximum queries per action independent of page size, including a cold permission cache (see QueryBudgetMiddleware)
+    query_budgets = {
+        'list': 6,
+        'retrieve': 6
+    }
     filter_backends = (MappedOrderFilter,)
     filter_mappings = {
         'code': 'vendor__code',
@@ -73,6 +94,7 @@ class FileViewSet(
         'key': 'key'
     }
     filter_value_transformations = {
+        'code': str.lower,
         'status': parse_list,
         'size': validate_int
     }
@@ -82,6 +104,15 @@ class FileViewSet(
     }
     ordering = ('-date_uploaded',)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        days = settings.FILE_LIST_DEFAULT_DAYS
+        params = self.request.query_params
+        # Bound unfiltered lists by upload date so Postgres only scans recent partitions
+        if self.action == 'list' and days and not any(p in params for p in ('date_uploaded_after', 'date_uploaded_before', 'key')):
+            queryset = queryset.filter(date_uploaded__gte=timezone.now() - timedelta(days=days))
+        return queryset
+
     @action(
         detail=False,
         methods=['POST'],
@@ -103,7 +134,8 @@ class FileViewSet(
             if f.location:
                 try:
                     url = f.get_url()
-                    upload(url, uploaded_file)
+                    f.checksum = upload(url, uploaded_file)
+                    File.objects.filter(pk=f.pk).update(checksum=f.checksum)
                     successful_urls.append(url)
                 except Exception as e:
                     logger.error(f'Upload to {f.location} failed: {e}', extra={'request': request})
@@ -133,11 +165,14 @@ class FileViewSet(
         if not f.status in status_whitelist:
             return Response('File has not been successfully virus scanned', status=status.HTTP_400_BAD_REQUEST)
 
-        stream = retrieve(f.get_url())
+        stream = f.retrieve()
+        STORAGE_BYTES.labels(op='download').inc(f.size)
 
         download = 'download' in request.query_params
 
-        return FileResponse(stream, filename=f.name, as_attachment=download)
+        response = FileResponse(stream, filename=f.name, as_attachment=download)
+        response['Content-Length'] = f.size
+        return response
 
     @action(detail=True, methods=['POST'])
     def status(self, request, pk=None):
@@ -284,10 +319,51 @@ class FileViewSet(
             extra['priority'] = vendor.priority
         serializer.save(**extra)
 
+stats_intervals = {
+    'hour': TruncHour,
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth
+}
+
+class FileStatsViewSet(FiltersMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """Throughput statistics aggregated from the hourly file status rollups."""
+    permission_classes = get_permission_classes('pj', 'file')
+    replica_actions = ('list',)
+    serializer_class = FileStatsSerializer
+    queryset = FileStatusRollup.objects.all()
+    filter_mappings = {
+        'code': 'vendor__code',
+        'vendor': 'vendor__name__icontains',
+        'status': 'status__in',
+        'after': 'hour__gte',
+        'before': 'hour__lt'
+    }
+    filter_value_transformations = {
+        'status': parse_list
+    }
+
+    def list(self, request):
+        interval = request.query_params.get('interval', 'hour')
+        if interval not in stats_intervals:
+            return Response(f'Interval must be one of {", ".join(stats_intervals)}', status=status.HTTP_400_BAD_REQUEST)
+
+        stats = self.get_queryset() \
+            .annotate(period=stats_intervals[interval]('hour')) \
+            .values('period', 'vendor__name', 'status') \
+            .annotate(
+                file_count=Sum('file_count'),
+                byte_count=Sum('byte_count'),
+                total_duration=Sum('total_duration')
+            ) \
+            .order_by('period', 'vendor__name', 'status')
+        return Response(self.get_serializer(stats, many=True).data)
+
 class StakeholderViewSet(FiltersMixin, viewsets.ModelViewSet):
     queryset = Stakeholder.objects.all()
     serializer_class = StakeholderSerializer
     permission_classes = get_permission_classes('pj', 'stakeholder')
+    replica_actions = ('list', 'retrieve')
     pagination_class = LimitOffsetPagination
     filter_backends = (filters.OrderingFilter,)
     filter_mappings = {
@@ -299,11 +375,17 @@ class StakeholderViewSet(FiltersMixin, viewsets.ModelViewSet):
     ordering = ('name',)
 
 class VendorViewSet(FiltersMixin, viewsets.ModelViewSet):
-    queryset = Vendor.objects.all()
+    queryset = Vendor.objects.all().prefetch_related('pocs')
     serializer_class = VendorSerializer
     permission_classes = get_permission_classes('pj', 'vendor', anon_actions=('validate',))
+    replica_actions = ('list', 'retrieve')
     throttle_classes = get_throttle_classes('validate')
     pagination_class = LimitOffsetPagination
+    query_budgets = {
+        'list': 6,
+        'retrieve': 6,
+        'validate': 1
+    }
     filter_backends = (filters.OrderingFilter,)
     filter_mappings = {
         'name': 'name__icontains',
@@ -336,12 +418,16 @@ class VendorViewSet(FiltersMixin, viewsets.ModelViewSet):
     def validate(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        return Response(Vendor.objects.filter(code__iexact=serializer.validated_data['code']).exists())
+        return Response(Vendor.objects.get_by_code(serializer.validated_data['code']) is not None)
 
 class DataSourceViewSet(FiltersMixin, viewsets.ModelViewSet):
     queryset = DataSource.objects.all()
     serializer_class = DataSourceSerializer
     permission_classes = get_permission_classes('pj', 'datasource')
+    replica_actions = ('list', 'retrieve')
+    query_budgets = {
+        'list': 5
+    }
     pagination_class = LimitOffsetPagination
     filter_backends = (filters.OrderingFilter,)
     filter_mappings = {
@@ -351,38 +437,101 @@ class DataSourceViewSet(FiltersMixin, viewsets.ModelViewSet):
         'theme': 'theme__icontains',
         'info': 'info__icontains',
         'date_ingest': 'date_ingest__icontains',
+        'search': 'search_vector'
+    }
+    filter_value_transformations = {
+        'search': search_query
     }
-    ordering_fields = ('name', 'status', 'priority', 'theme', 'info', 'date_ingest')
+    ordering_fields = ('name', 'status', 'priority', 'theme', 'info', 'date_ingest', 'note_count')
     ordering = ('name',)
 
+    def get_queryset(self):
+        return self.queryset.annotate(note_count=Count('note'))
+
     @action(detail=False, methods=['POST'])
     def delete_bulk(self, request):
         self.get_queryset().filter(pk__in=request.data).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _create_many(self, rows, offset=0):
+        serializer = self.get_serializer(data=rows, many=True)
+        if not serializer.is_valid():
+            return Response({'errors': row_errors(serializer.errors, offset)}, status=status.HTTP_400_BAD_REQUEST)
+        instances = DataSource.objects.create_many([DataSource(**row) for row in serializer.validated_data])
+        return Response(self.get_serializer(instances, many=True).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['POST'])
+    def create_bulk(self, request):
+        if not isinstance(request.data, list):
+            return Response('Need to submit a list of data sources', status=status.HTTP_400_BAD_REQUEST)
+        return self._create_many(request.data)
+
+    @action(detail=False, methods=['POST'])
+    def update_bulk(self, request):
+        if not isinstance(request.data, list) or not all(isinstance(row, dict) for row in request.data):
+            return Response('Need to submit a list of data sources', status=status.HTTP_400_BAD_REQUEST)
+        instances = self.get_queryset().in_bulk([row.get('pk') for row in request.data if isinstance(row.get('pk'), int)])
+        errors = []
+        updated = []
+        fields = set()
+        for index, row in enumerate(request.data):
+            instance = instances.get(row.get('pk'))
+            if instance is None:
+                errors.append({'row': index, 'errors': {'pk': ['Data source not found']}})
+                continue
+            serializer = self.get_serializer(instance, data=row, partial=True)
+            if not serializer.is_valid():
+                errors.append({'row': index, 'errors': serializer.errors})
+                continue
+            for field, value in serializer.validated_data.items():
+                setattr(instance, field, value)
+                fields.add(field)
+            updated.append(instance)
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        DataSource.objects.update_many(updated, fields)
+        return Response(self.get_serializer(updated, many=True).data)
+
+    @action(detail=False, methods=['POST'], parser_classes=(MultiPartParser,))
+    def import_csv(self, request):
+        """Create data sources from an uploaded CSV file with a header row of serializer field names."""
+        if 'file' not in request.FILES:
+            return Response('Need to submit a CSV file', status=status.HTTP_400_BAD_REQUEST)
+        try:
+            reader = csv.DictReader(io.TextIOWrapper(request.FILES['file'], encoding='utf-8-sig'))
+            # Blank cells fall back to the field defaults
+            rows = [{k: v for k, v in row.items() if k and v not in ('', None)} for row in reader]
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response(f'Could not read CSV file: {e}', status=status.HTTP_400_BAD_REQUEST)
+        # Report rows by their line in the file, after the header
+        return self._create_many(rows, offset=2)
+
     @action(detail=False, methods=['POST'])
     def suggestions(self, request):
         if not request.data.get('key') or not request.data.get('value'):
-            Response("Need to submit a key and value", status=status.HTTP_400_BAD_REQUEST)
+            return Response("Need to submit a key and value", status=status.HTTP_400_BAD_REQUEST)
         key = request.data['key']
-        value = request.data['value']
-        values = self.get_queryset() \
-            .filter(**{f'{key}__icontains': value}) \
-            .exclude(**{key:""}) \
-            .distinct(key) \
-            .values_list(key, flat=True) \
-            [:10]
-        return Response(values)
+        if key not in DataSource.SUGGESTION_FIELDS:
+            return Response(f'Cannot suggest values for {key}', status=status.HTTP_400_BAD_REQUEST)
+        return Response(suggest(key, str(request.data['value'])))
 
 class NoteViewSet(FiltersMixin, viewsets.ModelViewSet):
-    queryset = Note.objects.all()
+    queryset = Note.objects.select_related('created_by')
     serializer_class = NoteSerializer
     permission_classes = get_permission_classes('pj', 'note')
+    replica_actions = ('list', 'retrieve')
+    query_budgets = {
+        'list': 5
+    }
     pagination_class = LimitOffsetPagination
     filter_backends = (filters.OrderingFilter,)
     filter_mappings = {
         'note': 'note__icontains',
-        'source': 'data_source__pk'
+        'source': 'data_source__pk',
+        'search': 'search_vector'
+    }
+    filter_value_transformations = {
+        'search': search_query
     }
     ordering_fields = ('note',)
     ordering = ('note',)
@@ -391,16 +540,64 @@ class NoteViewSet(FiltersMixin, viewsets.ModelViewSet):
         serializer.save(created_by=self.request.user)
 
 class TodoViewSet(FiltersMixin, viewsets.ModelViewSet):
-    queryset = Todo.objects.all()
+    queryset = Todo.objects.select_related('created_by')
     serializer_class = TodoSerializer
     permission_classes = get_permission_classes('pj', 'todo')
+    replica_actions = ('list', 'retrieve')
+    query_budgets = {
+        'list': 5
+    }
     pagination_class = LimitOffsetPagination
     filter_backends = (filters.OrderingFilter,)
     filter_mappings = {
         'text': 'text__icontains',
+        'search': 'search_vector'
+    }
+    filter_value_transformations = {
+        'search': search_query
     }
     ordering_fields = ('text',)
     ordering = ('text',)
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
+
+class SearchViewSet(viewsets.ViewSet):
+    """Ranked full text search across the data sources, notes and todos the user can view."""
+    permission_classes = (IsAuthenticated,)
+    replica_actions = ('list',)
+    # type: (model, title field, text field)
+    search_types = {
+        'datasource': (DataSource, 'name', 'theme'),
+        'note': (Note, 'note', 'note'),
+        'todo': (Todo, 'lead', 'text')
+    }
+
+    def list(self, request):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response('Need to submit a search query', status=status.HTTP_400_BAD_REQUEST)
+        limit = min(max(validate_int(request.query_params.get('limit', 20)), 1), 100)
+        types = request.query_params.get('types')
+        types = parse_list(types) if types else list(self.search_types)
+
+        results = []
+        for search_type in types:
+            if search_type not in self.search_types:
+                return Response(f'Unknown search type {search_type}', status=status.HTTP_400_BAD_REQUEST)
+            if not request.user.has_perm(f'pj.view_{search_type}'):
+                continue
+            model, title, text_field = self.search_types[search_type]
+            fields = ['pk', 'rank', title, text_field] + (['data_source'] if model is Note else [])
+            for row in search(model.objects.all(), text).values(*fields)[:limit]:
+                results.append({
+                    'type': search_type,
+                    'pk': row['pk'],
+                    'rank': row['rank'],
+                    'title': row[title][:128],
+                    'text': row[text_field][:256],
+                    'data_source': row.get('data_source')
+                })
+
+        results.sort(key=lambda r: -r['rank'])
+        return Response(results[:limit])
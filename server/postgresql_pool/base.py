@@ -0,0 +1,166 @@
+"""
+Postgres backend that shares a pool of connections between the threads, or gevent greenlets, of a process.
+
+Django opens a connection per thread and, with CONN_MAX_AGE = 0, closes it at the end of each request.
+Under gevent workers every greenlet is a thread to Django, so persistent connections would leak one per
+greenlet. This backend instead checks connections out of a per process pool and returns them on close,
+keeping at most POOL['SIZE'] connections open and taking connection setup out of request latency.
+"""
+import os
+import time
+import threading
+from collections import deque
+
+from django.db.backends.postgresql import base, creation
+from django.db.utils import OperationalError
+from psycopg2 import extensions
+
+from server.metrics import DB_POOL_CHECKOUTS, DB_POOL_WAIT_SECONDS, DB_POOL_CONNECTIONS
+
+DEFAULT_POOL = {
+    # Connections a process may hold open
+    'SIZE': 10,
+    # Seconds to wait for a free connection before failing the query
+    'TIMEOUT': 30,
+    # Idle connections older than this many seconds are checked with a query before reuse
+    'HEALTH_CHECK_AFTER': 30,
+    # Idle connections older than this many seconds are closed instead of reused, 0 keeps them
+    'MAX_IDLE': 600
+}
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Bounded LIFO pool of psycopg2 connections."""
+
+    def __init__(self, alias, size=10, timeout=30, health_check_after=30, max_idle=600):
+        self.alias = alias
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.max_idle = max_idle
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def get(self, connect):
+        """
+        get
+
+        :connect: callable - opens a new connection when no healthy idle one is available
+
+        :return: connection - psycopg2 connection checked out of the pool
+        """
+        start = time.perf_counter()
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(f'Timed out after {self.timeout}s waiting for a {self.alias} database connection')
+        DB_POOL_WAIT_SECONDS.labels(alias=self.alias).observe(time.perf_counter() - start)
+        try:
+            connection = self._get_idle() or connect()
+        except BaseException:
+            self.slots.release()
+            raise
+        DB_POOL_CHECKOUTS.labels(alias=self.alias).inc()
+        DB_POOL_CONNECTIONS.labels(alias=self.alias, state='in_use').inc()
+        return connection
+
+    def _get_idle(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                connection, returned = self.idle.pop()
+            DB_POOL_CONNECTIONS.labels(alias=self.alias, state='idle').dec()
+            if self._healthy(connection, time.monotonic() - returned):
+                return connection
+            self._discard(connection)
+
+    def _healthy(self, connection, idle_seconds):
+        if connection.closed or (self.max_idle and idle_seconds > self.max_idle):
+            return False
+        if idle_seconds > self.health_check_after:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                # The check may have opened a transaction
+                connection.rollback()
+            except Exception:
+                return False
+        return True
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def put(self, connection):
+        """Return a connection, rolling back anything left open so the next user starts clean."""
+        DB_POOL_CONNECTIONS.labels(alias=self.alias, state='in_use').dec()
+        try:
+            if not connection.closed and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            reusable = not connection.closed and connection.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+        except Exception:
+            reusable = False
+        if reusable:
+            with self.lock:
+                self.idle.append((connection, time.monotonic()))
+            DB_POOL_CONNECTIONS.labels(alias=self.alias, state='idle').inc()
+        else:
+            self._discard(connection)
+        self.slots.release()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for connection, _ in idle:
+            DB_POOL_CONNECTIONS.labels(alias=self.alias, state='idle').dec()
+            self._discard(connection)
+
+
+def get_pool(alias, settings_dict):
+    # Keyed by process so forked workers never share the parent's sockets, and by database as Django briefly
+    # connects to the postgres database under the same alias to create and drop test databases
+    key = (os.getpid(), alias, settings_dict['NAME'], settings_dict['HOST'], settings_dict['PORT'])
+    with pools_lock:
+        if key not in pools:
+            options = {**DEFAULT_POOL, **settings_dict.get('POOL', {})}
+            pools[key] = ConnectionPool(
+                alias,
+                size=options['SIZE'],
+                timeout=options['TIMEOUT'],
+                health_check_after=options['HEALTH_CHECK_AFTER'],
+                max_idle=options['MAX_IDLE']
+            )
+        return pools[key]
+
+
+def close_pools(name):
+    """Close the idle connections of every pool connected to database name."""
+    with pools_lock:
+        matching = [pool for key, pool in pools.items() if key[2] == name]
+    for pool in matching:
+        pool.close()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Pooled connections would otherwise keep the test database in use
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict)
+        return pool.get(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                get_pool(self.alias, self.settings_dict).put(self.connection)
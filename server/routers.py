@@ -0,0 +1,36 @@
+"""
+Database routing to read replicas.
+
+Reads of the pj app's models go to a replica only while a request for a view action declared in the
+view's replica_actions is being handled (see ReplicaRoutingMiddleware). Everything else, including
+all writes, processor callbacks and status transitions, uses the primary.
+"""
+import random
+import threading
+
+from django.conf import settings
+
+# Greenlet local under gevent workers, the monkey patching swaps threading.local
+state = threading.local()
+
+
+def use_replica(enabled):
+    state.use_replica = enabled
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if settings.REPLICA_DATABASES and getattr(state, 'use_replica', False) and model._meta.app_label == 'pj':
+            return random.choice(settings.REPLICA_DATABASES)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
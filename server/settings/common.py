@@ -10,9 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
-import json
 import os
 import environ
+from django.core.exceptions import ImproperlyConfigured
 
 env = environ.Env()
 
@@ -27,16 +27,14 @@ SECRET_KEY = 'sh#(3i!zq392o_2(&snzd(dx5ubj2z+6(=a9@2-7e)h_iv5%y*'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = env.bool('DJANGO_DEBUG', default=False)
 
-VERSION = ''
-with open('package.json') as file:
-    VERSION = json.load(file)['version']
-
 ALLOWED_HOSTS = env.list('DJANGO_ALLOWED_HOSTS', default=[])
 
 LOG_DIR = '/var/log/pj/'
 
 UPLOAD_LOCATION = env('UPLOAD_LOCATION', default=None)
 FILE_UPLOAD_TEMP_DIR = env('FILE_UPLOAD_TEMP_DIR', default=None)
+# Largest non file request body, raise it to send large batches to the bulk data source actions
+DATA_UPLOAD_MAX_MEMORY_SIZE = env.int('DATA_UPLOAD_MAX_MEMORY_SIZE', default=2621440)
 
 # Application definition
 
@@ -57,6 +55,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Shed load before any session or database work is done
+    'server.middleware.ConcurrencyLimitMiddleware',
+    'server.middleware.MetricsMiddleware',
+    'server.middleware.QueryBudgetMiddleware',
+    'server.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,6 +70,21 @@ MIDDLEWARE = [
     'axes.middleware.AxesMiddleware',
 ]
 
+# Concurrent requests each worker process admits per route class, as (name, path regex, limit).
+# Requests use the first matching pool, a limit of 0 means unlimited.
+CONCURRENCY_POOLS = (
+    ('upload', r'^/api/pj/files/upload/', env.int('PJ_UPLOAD_CONCURRENCY', default=0)),
+    ('download', r'^/api/pj/files/\d+/data/', env.int('PJ_DOWNLOAD_CONCURRENCY', default=0)),
+    ('processor', r'^/api/pj/files/\d+/status/', env.int('PJ_PROCESSOR_CONCURRENCY', default=0)),
+    ('api', r'^/api/', env.int('PJ_API_CONCURRENCY', default=0)),
+    ('ui', r'^/', env.int('PJ_UI_CONCURRENCY', default=0)),
+)
+# Seconds clients are told to wait when a pool is saturated
+CONCURRENCY_RETRY_AFTER = env.int('PJ_CONCURRENCY_RETRY_AFTER', default=5)
+
+# What to do when a view action makes more queries than its declared query_budgets: off, log or raise
+QUERY_BUDGET_MODE = env('QUERY_BUDGET_MODE', default='log')
+
 ROOT_URLCONF = 'server.urls'
 
 TEMPLATES = [
@@ -99,10 +117,44 @@ DATABASES = {
         'USER': env('POSTGRES_USER', default='postgres'),
         'PASSWORD': env('POSTGRES_PASSWORD', default=None),
         'HOST': env('POSTGRES_HOST', default='postgres'),
-        'PORT': env('POSTGRES_PORT', default=5432)
+        'PORT': env('POSTGRES_PORT', default=5432),
+        # Server side cursors break behind transaction pooling proxies such as PgBouncer
+        'DISABLE_SERVER_SIDE_CURSORS': env.bool('POSTGRES_DISABLE_SERVER_SIDE_CURSORS', default=False)
     }
 }
 
+# none closes connections after each request, persistent keeps one per thread for DB_CONN_MAX_AGE seconds and pool
+# shares DB_POOL_SIZE connections between the threads and greenlets of each process. persistent is for sync and
+# gthread workers only, every greenlet counts as a thread so gevent workers would leak a connection per request.
+DB_POOL_MODE = env('DB_POOL_MODE', default='none')
+if DB_POOL_MODE == 'persistent':
+    GUNICORN_WORKER_CLASS = env('GUNICORN_WORKER_CLASS', default='gevent')
+    if 'gevent' in GUNICORN_WORKER_CLASS or 'eventlet' in GUNICORN_WORKER_CLASS:
+        raise ImproperlyConfigured(
+            f'DB_POOL_MODE persistent needs a sync or gthread GUNICORN_WORKER_CLASS, not {GUNICORN_WORKER_CLASS}, '
+            'use pool instead'
+        )
+    DATABASES['default']['CONN_MAX_AGE'] = env.int('DB_CONN_MAX_AGE', default=60)
+elif DB_POOL_MODE == 'pool':
+    DATABASES['default']['ENGINE'] = 'server.postgresql_pool'
+    DATABASES['default']['POOL'] = {
+        'SIZE': env.int('DB_POOL_SIZE', default=10),
+        'TIMEOUT': env.float('DB_POOL_TIMEOUT', default=30),
+        'HEALTH_CHECK_AFTER': env.float('DB_POOL_HEALTH_CHECK_AFTER', default=30),
+        'MAX_IDLE': env.float('DB_POOL_MAX_IDLE', default=600)
+    }
+elif DB_POOL_MODE != 'none':
+    raise ImproperlyConfigured(f'DB_POOL_MODE must be none, persistent or pool, not {DB_POOL_MODE}')
+
+# Read replicas sharing the primary's credentials, list and retrieve style reads are routed to them
+REPLICA_DATABASES = []
+for index, host in enumerate(env.list('POSTGRES_REPLICA_HOSTS', default=[])):
+    REPLICA_DATABASES.append(f'replica{index}')
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['server.routers.ReplicaRouter']
+# Seconds a client stays on the primary after a write so it reads its own writes
+REPLICA_STICKY_SECONDS = env.int('REPLICA_STICKY_SECONDS', default=5)
+
 # Email service settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = env('EMAIL_HOST', default=None)
@@ -115,8 +167,13 @@ EMAIL_SENDER = env('EMAIL_SENDER', default=None)
 
 AUTH_USER_MODEL = 'custom_auth.User'
 
-SESSION_ENGINE = "django.contrib.sessions.backends.db"
-SESSION_COOKIE_AGE = 86400
+# Seconds a user's permission sets stay cached, group and permission changes invalidate them sooner.
+# Only used with a SHARED_CACHE, a per-process cache would keep revoked permissions on other workers
+PERMISSION_CACHE_TIMEOUT = env.int('PERMISSION_CACHE_TIMEOUT', default=300)
+
+# Seconds an authenticated token stays cached, deleting the token or saving its user invalidates it sooner.
+# Only used with a SHARED_CACHE, a per-process cache would keep revoked tokens working on other workers
+TOKEN_CACHE_TIMEOUT = env.int('TOKEN_CACHE_TIMEOUT', default=60)
 
 AUTHENTICATION_BACKENDS = (
     # Axes need to be the first
@@ -127,7 +184,7 @@ AUTHENTICATION_BACKENDS = (
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         # Django handles the authentication, this just picks up the authenticated user in the HttpRequest
-        'rest_framework.authentication.TokenAuthentication',
+        'server.auth.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_THROTTLE_RATES': {
@@ -135,11 +192,56 @@ REST_FRAMEWORK = {
     }
 }
 
+# The cache is shared by throttling and lookups, so production should point every worker at the same
+# backend: dbcache://pj_cache (run createcachetable), filecache:///path or redis://host:6379/0 (needs django-redis)
 CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    'default': env.cache('CACHE_URL', default='locmemcache://')
+}
+
+# Swap in the backends whose incr is atomic across processes
+SHARED_CACHE_BACKENDS = {
+    'django.core.cache.backends.db.DatabaseCache': 'server.cache.DatabaseCache',
+    'django.core.cache.backends.filebased.FileBasedCache': 'server.cache.FileBasedCache'
 }
+CACHES['default']['BACKEND'] = SHARED_CACHE_BACKENDS.get(CACHES['default']['BACKEND'], CACHES['default']['BACKEND'])
+
+# Whether every worker sees the same cache, features that invalidate through the cache need it
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache'
+)
+
+# cached_db reads sessions from the shared cache and only falls back to the table on a miss, signed_cookies
+# keeps them in the browser entirely. Prune the table with the prune_sessions command. cached_db is only the
+# default with a shared cache, with a per-process cache a logout would not reach the other workers.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies'
+}
+SESSION_ENGINE = SESSION_ENGINES[env('SESSION_MODE', default='cached_db' if SHARED_CACHE else 'db')]
+SESSION_COOKIE_AGE = 86400
+
+# Seconds a vendor code lookup stays cached, saves and deletes invalidate it sooner. Short without a shared cache,
+# as they only invalidate the worker that made them
+VENDOR_CACHE_TIMEOUT = env.int('VENDOR_CACHE_TIMEOUT', default=300 if SHARED_CACHE else 10)
+
+# Limit file lists without an upload date filter to this many recent days so partitions can be pruned, 0 lists everything
+FILE_LIST_DEFAULT_DAYS = env.int('FILE_LIST_DEFAULT_DAYS', default=0)
+
+# Typeahead results kept in each worker's LRU cache, any data source write invalidates them
+SUGGESTION_CACHE_SIZE = env.int('SUGGESTION_CACHE_SIZE', default=1024)
+# Seconds a cached typeahead result is served, short without a shared cache as other workers' writes cannot invalidate it
+SUGGESTION_CACHE_TIMEOUT = env.int('SUGGESTION_CACHE_TIMEOUT', default=300 if SHARED_CACHE else 10)
+
+# Seconds a status transition intent must be pending before recovery treats its move as interrupted
+TRANSITION_RECOVERY_AGE = env.int('TRANSITION_RECOVERY_AGE', default=300)
+
+# Seconds between the recover_transitions --loop passes the container entrypoint runs beside gunicorn, 0 disables
+TRANSITION_RECOVERY_INTERVAL = env.int('TRANSITION_RECOVERY_INTERVAL', default=300)
+
+# Read rate verify_files holds itself to so checking stored objects does not starve uploads and downloads
+VERIFY_BYTES_PER_SECOND = env.int('VERIFY_BYTES_PER_SECOND', default=10 * 1024 * 1024)
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -1,3 +1,8 @@
 from .common import * # pylint: disable=unused-wildcard-import
 
 AXES_ENABLED = False
+QUERY_BUDGET_MODE = 'raise'
+# Tests run in one process, so the memory cache is effectively shared and query budgets assume cached sessions,
+# tokens and permissions
+SHARED_CACHE = True
+SESSION_ENGINE = SESSION_ENGINES['cached_db']
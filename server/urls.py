@@ -27,5 +27,6 @@ api = [
 urlpatterns = [
     path('api/', include(api)),
     path('admin/', admin.site.urls),
+    path('metrics', views.metrics, name='metrics'),
     re_path(r'^.*$', views.IndexView.as_view(), name="index")
 ]
@@ -0,0 +1,20 @@
+"""Application version, read from package.json on first use rather than at settings import."""
+import json
+import os
+from functools import lru_cache
+
+PACKAGE_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'package.json')
+
+
+@lru_cache(maxsize=None)
+def get_version():
+    """
+    get_version
+
+    :return: str - version from package.json, empty when it is missing
+    """
+    try:
+        with open(PACKAGE_JSON) as file:
+            return json.load(file)['version']
+    except FileNotFoundError:
+        return ''
@@ -1,12 +1,17 @@
 import logging
 
+from django.http import HttpResponse
 from django.views.generic import TemplateView
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import ensure_csrf_cookie
 
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from server.metrics import export
 
 logger = logging.getLogger(__name__)
 
@@ -23,3 +28,8 @@ class IndexView(TemplateView):
 @api_view(['GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'])
 def not_found(request):
     return Response({'error': 'Unknown path'}, status=status.HTTP_404_NOT_FOUND)
+
+@api_view(['GET'])
+@permission_classes((IsAdminUser,))
+def metrics(request):
+    return HttpResponse(export(), content_type=CONTENT_TYPE_LATEST)